@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+from collections.abc import Awaitable, Callable
+from datetime import date
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs
+
+import polars as pl
+
+from cache import CACHE
+from common import MEASURES
+from query import COUNT, DIMENSIONS, DIRECTORY, PER_UNIT_PATH, query, risk_per_unit, smallest_cuboid
+
+# A plain ASGI application answering from the artifacts the pages read, for services that want the numbers without a
+# browser session. Serve it with any ASGI server, for instance `uvicorn api:app --workers 4`.
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+Route = Callable[[dict[str, list[str]]], tuple[int, Callable[[], pl.DataFrame]]]
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+FORMATS = {"json": JSON, "arrow": ARROW}
+# Answers only change with the data, so clients keep them but check the ETag before every use.
+CACHE_CONTROL = "no-cache"
+VALUE_TYPES: dict[str, Callable[[str], Any]] = {
+    "borough": str.upper,
+    "date": date.fromisoformat,
+    "year": int,
+    "month": int,
+    "weekday": int,
+    "hour": int,
+}
+TOTALS_PARAMETERS = {"by", "measures", "start", "end", "format", *DIMENSIONS}
+RISK_PARAMETERS = {"borough", "format"}
+
+
+def values(params: dict[str, list[str]], name: str) -> list[str]:
+    # Repeated parameters and comma separated values are the same, by=borough&by=year is by=borough,year.
+    return [value for param in params.get(name, []) for value in param.split(",") if value]
+
+
+def check_parameters(params: dict[str, list[str]], allowed: set[str]) -> None:
+    unknown = set(params) - allowed
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}, expected some of {sorted(allowed)}")
+
+
+def version(path: str | Path) -> int:
+    # A missing artifact is not built yet or is being rebuilt, which the caller is told with a 503.
+    return Path(path).stat().st_mtime_ns
+
+
+def totals(params: dict[str, list[str]]) -> tuple[int, Callable[[], pl.DataFrame]]:
+    check_parameters(params, TOTALS_PARAMETERS)
+    dimensions = values(params, "by")
+    unknown = set(dimensions) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Can not group by {sorted(unknown)}, expected some of {DIMENSIONS}")
+    measures = values(params, "measures") or MEASURES + [COUNT]
+    unknown = set(measures) - set(MEASURES + [COUNT])
+    if unknown:
+        raise ValueError(f"Can not sum {sorted(unknown)}, expected some of {MEASURES + [COUNT]}")
+
+    filters = []
+    for dimension, cast in VALUE_TYPES.items():
+        if dimension in params:
+            filters.append(pl.col(dimension).is_in([cast(value) for value in values(params, dimension)]))
+    if "start" in params:
+        filters.append(pl.col("date") >= date.fromisoformat(params["start"][-1]))
+    if "end" in params:
+        filters.append(pl.col("date") <= date.fromisoformat(params["end"][-1]))
+
+    # The answer is versioned by the artifact query reads it from, the processed index when no cuboid covers it.
+    needed = set(dimensions).union(*(expr.meta.root_names() for expr in filters))
+    found = smallest_cuboid(needed, measures=measures)
+    path = found[1] if found else os.path.join(DIRECTORY, "processed", "_index.parquet")
+
+    return version(path), lambda: query(dimensions, filters=filters, measures=measures)
+
+
+def risk(params: dict[str, list[str]]) -> tuple[int, Callable[[], pl.DataFrame]]:
+    check_parameters(params, RISK_PARAMETERS)
+    boroughs = [borough.lower() for borough in values(params, "borough")]
+
+    def compute() -> pl.DataFrame:
+        data = risk_per_unit()
+        return data.filter(pl.col("borough").is_in(boroughs)) if boroughs else data
+
+    return version(PER_UNIT_PATH), compute
+
+
+ROUTES: dict[str, Route] = {"/totals": totals, "/risk": risk}
+
+
+def response_format(params: dict[str, list[str]], headers: dict[bytes, bytes]) -> str:
+    if "format" in params:
+        name = params["format"][-1]
+        if name not in FORMATS:
+            raise ValueError(f"Unknown format {name}, expected one of {list(FORMATS)}")
+        return FORMATS[name]
+
+    return ARROW if ARROW.encode() in headers.get(b"accept", b"") else JSON
+
+
+def encode(data: pl.DataFrame, content_type: str) -> bytes:
+    if content_type == JSON:
+        return data.write_json().encode()
+    buffer = io.BytesIO()
+    data.write_ipc_stream(buffer)
+
+    return buffer.getvalue()
+
+
+def error(message: str) -> bytes:
+    return json.dumps({"error": message}).encode()
+
+
+async def respond(
+    send: Send, status: int, body: bytes, content_type: str = JSON, etag: str | None = None, head: bool = False
+) -> None:
+    headers = [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+    if etag is not None:
+        headers += [(b"etag", etag.encode()), (b"cache-control", CACHE_CONTROL.encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    route = ROUTES.get(scope["path"])
+    if route is None:
+        await respond(send, 404, error(f"No route {scope['path']}, expected one of {list(ROUTES)}"))
+        return
+    if scope["method"] not in ("GET", "HEAD"):
+        await respond(send, 405, error("Only GET and HEAD are allowed"))
+        return
+
+    headers = dict(scope["headers"])
+    params = parse_qs(scope["query_string"].decode())
+    try:
+        content_type = response_format(params, headers)
+        data_version, compute = route(params)
+    except ValueError as invalid:
+        await respond(send, 400, error(str(invalid)))
+        return
+    except FileNotFoundError as missing:
+        await respond(send, 503, error(f"The data is not available: {missing.filename}"))
+        return
+
+    # The ETag follows from the request and the version of the artifact alone, so a client holding the current answer
+    # is told so without computing it.
+    arguments = tuple(sorted((name, tuple(value)) for name, value in params.items()))
+    key = ("api", scope["path"], arguments, content_type, data_version)
+    etag = f'"{hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()}"'
+    if etag.encode() in headers.get(b"if-none-match", b""):
+        await respond(send, 304, b"", content_type=content_type, etag=etag, head=True)
+        return
+
+    # Cached answers are sent from the event loop, others are computed on a worker thread so they never hold it.
+    body = CACHE.get(key)
+    if body is None:
+        try:
+            body = await asyncio.to_thread(CACHE.get_or_compute, key, lambda: encode(compute(), content_type))
+        except (ValueError, pl.exceptions.PolarsError) as invalid:
+            # Columns the processed data does not have, or values of the wrong type for them.
+            await respond(send, 400, error(str(invalid)))
+            return
+        except FileNotFoundError as missing:
+            await respond(send, 503, error(f"The data is not available: {missing.filename}"))
+            return
+
+    await respond(send, 200, body, content_type=content_type, etag=etag, head=scope["method"] == "HEAD")
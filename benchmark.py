@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+import folium
+import folium.plugins
+import polars as pl
+
+from catalog import bounds
+from common import BOROUGHS, CUBOIDS, MEASURES, NY_CENTER, persist_data_bitmask
+from dataset import CLEAN_MAP_PATH, PROCESSED_PATH, read_dates, scan_dataset
+from export import ExportFormat, sink
+from hexbin import HEX_SIZES_KM, build_pyramid, hex_boundaries, load_cells
+from ingest import ingest, peak_rss_mb, reset_peak_rss
+from query import materialized_cuboids, query
+from summary import build_summary
+from synthetic import generate
+
+BENCHMARK_DIRECTORY = "benchmarks"
+RESULTS_NAME = "results.json"
+SCALES = [1, 10, 100]
+REPEATS = 3
+# Committed files ingestion reads besides the raw export.
+SHARED_FILES = ["nyc_projected.parquet"]
+# Bounds of the committed data, which the synthetic data follows. They are read before the workspaces are entered.
+BOUNDS = {dimension: bounds(dimension) for dimension in ["date", "year", "hour"]}
+# The day the date sliders of the pages start on.
+DAY = BOUNDS["date"][2]
+
+
+def measure(name: str, func: Callable[[], Any], repeats: int = REPEATS) -> dict[str, Any]:
+    seconds, peaks = [], []
+    for _ in range(repeats):
+        reset_peak_rss()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+        peaks.append(peak_rss_mb())
+    print(f"{name:<36} {min(seconds):10.3f}s best of {repeats:<3} peak rss {max(peaks):>10,.1f} MB")
+
+    return {"name": name, "seconds": seconds, "peak_rss_mb": max(peaks)}
+
+
+def persist_cuboids() -> None:
+    for by in CUBOIDS:
+        persist_data_bitmask(scan_dataset(PROCESSED_PATH), by=by, on=MEASURES)
+    materialized_cuboids.cache_clear()
+
+
+def load_time_data(option: str, start: Any, end: Any) -> pl.DataFrame:
+    # The loaders of the pages run streamlit when imported, so each case runs the calls the loader makes.
+    return query(dimensions=["borough", option]).filter(
+        pl.col("borough").is_in(BOROUGHS), pl.col(option).is_between(start, end)
+    )
+
+
+def load_stats(filters: list[pl.Expr]) -> pl.DataFrame:
+    return query(dimensions=[], filters=filters)
+
+
+def load_multiple_borough_maps(start: date, end: date) -> pl.DataFrame:
+    return read_dates(CLEAN_MAP_PATH, start=start, end=end, boroughs=BOROUGHS)
+
+
+def build_marker_map(start: date, end: date) -> str:
+    points = load_multiple_borough_maps(start=start, end=end).select("latitude", "longitude")
+    fl_map = folium.Map(location=NY_CENTER, zoom_start=15)
+    folium.plugins.FastMarkerCluster(data=points.rows()).add_to(fl_map)
+
+    return fl_map.get_root().render()
+
+
+def build_density_map(level: int, start: Any, end: Any) -> int:
+    cells = load_cells(level=level, start=start, end=end, column="number_of_crash")
+    latitude, _ = hex_boundaries(cells["q"].to_numpy(), cells["r"].to_numpy(), size=HEX_SIZES_KM[level])
+
+    return latitude.shape[0]
+
+
+def export_csv() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        sink(scan_dataset(PROCESSED_PATH), Path(directory) / "crashes.csv", export_format=ExportFormat.CSV)
+
+
+def run_cases(repeats: int = REPEATS) -> list[dict[str, Any]]:
+    year = date(DAY.year, 1, 1), date(DAY.year, 12, 31)
+    victim = (pl.col("number_of_pedestrians_injured") + pl.col("number_of_pedestrians_killed")) > 0
+    cases: list[tuple[str, Callable[[], Any]]] = [
+        ("persist_data_bitmask", persist_cuboids),
+        ("load_time_data date", lambda: load_time_data("date", start=BOUNDS["date"][0], end=BOUNDS["date"][2])),
+        ("load_time_data hour", lambda: load_time_data("hour", start=BOUNDS["hour"][0], end=BOUNDS["hour"][2])),
+        ("load_stats borough year", lambda: load_stats([pl.col("borough") == "BROOKLYN", pl.col("year") == 2019])),
+        ("load_stats victim", lambda: load_stats([victim])),
+        ("load_multiple_borough_maps day", lambda: load_multiple_borough_maps(DAY, DAY)),
+        ("load_multiple_borough_maps year", lambda: load_multiple_borough_maps(*year)),
+        ("build_summary", lambda: build_summary(scan_dataset(PROCESSED_PATH))),
+        ("build_pyramid", build_pyramid),
+        ("marker map day", lambda: build_marker_map(DAY, DAY)),
+        ("density map", lambda: build_density_map(len(HEX_SIZES_KM) - 1, *BOUNDS["year"][:2])),
+        ("export csv", export_csv),
+    ]
+
+    return [measure(name, func, repeats=repeats) for name, func in cases]
+
+
+def run(scale: float, repeats: int = REPEATS, directory: str | Path = BENCHMARK_DIRECTORY) -> dict[str, Any]:
+    # Every scale gets a workspace with its own data directory, the code under test reads and writes paths relative
+    # to the working directory.
+    source = Path("data").resolve()
+    workspace = Path(directory).resolve() / f"{scale:g}x"
+    (workspace / "data").mkdir(parents=True, exist_ok=True)
+    for name in SHARED_FILES:
+        shutil.copy(source / name, workspace / "data" / name)
+
+    raw = workspace / "data" / "synthetic_crash.parquet"
+    setup = []
+    if not raw.exists():
+        setup.append(measure("generate", lambda: generate(output=raw, scale=scale, directory=source), repeats=1))
+
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        if not Path(PROCESSED_PATH).exists():
+            setup.append(measure("ingest", lambda: ingest(str(raw), output="data"), repeats=1))
+        rows = scan_dataset(PROCESSED_PATH).select(pl.len()).collect().item()
+        cases = run_cases(repeats=repeats)
+    finally:
+        os.chdir(cwd)
+        materialized_cuboids.cache_clear()
+
+    return {"scale": scale, "rows": rows, "cpus": os.cpu_count(), "date": str(date.today()), "cases": setup + cases}
+
+
+def record(results: list[dict[str, Any]], directory: str | Path = BENCHMARK_DIRECTORY) -> Path:
+    # Results of earlier runs at other scales are kept, a scale run again replaces its entry.
+    path = Path(directory) / RESULTS_NAME
+    recorded = {}
+    if path.exists():
+        with open(path) as f:
+            recorded = {str(result["scale"]): result for result in json.load(f)}
+    recorded.update({str(result["scale"]): result for result in results})
+
+    with open(path, mode="w") as f:
+        json.dump(sorted(recorded.values(), key=lambda result: result["scale"]), f, indent=2)
+
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the hot paths on synthetic data and record their peak memory.")
+    parser.add_argument(
+        "--scale", type=float, action="append", help=f"Rows relative to the committed data, by default {SCALES}"
+    )
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Runs of every case")
+    parser.add_argument("--output", default=BENCHMARK_DIRECTORY, help="Directory for workspaces and results")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scale or SCALES:
+        print(f"scale {scale:g}x")
+        results.append(run(scale, repeats=args.repeats, directory=args.output))
+    print(f"results written to {record(results, directory=args.output)}")
@@ -0,0 +1,127 @@
+import math
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+import shapely
+
+import storage
+from common import BOROUGH_CODES
+from query import PER_UNIT_PATH
+
+NYC_PATH = "data/nyc.parquet"
+BOUNDARIES_PATH = "data/nyc_projected.parquet"
+SIMPLIFIED_PATH = "data/nyc_simplified.parquet"
+HEATMAP_PATH = "data/heatmap.parquet"
+BOROUGH_PATH = "data/borough.parquet"
+WGS84 = 4326
+
+# Simplification tolerance of every level in degrees, a quarter of the one before it. Coordinates are rounded to a
+# tenth of the tolerance, which is what keeps the coarse levels small once written as GeoJSON.
+TOLERANCES = [0.004, 0.001, 0.00025, 0.0000625]
+PRECISION = 10
+# Share of a face that has to lie in a borough for the face to be part of it, the rest of the faces cover water.
+MIN_OVERLAP = 0.5
+
+GeometryArray = npt.NDArray[np.object_]
+
+
+def shared_arcs(geometries: GeometryArray) -> GeometryArray:
+    # Borough outlines split into arcs between the points where boroughs meet, so a border two boroughs share is one
+    # arc and is simplified once for both of them.
+    return shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(geometries))))
+
+
+def simplify_coverage(boundaries: gpd.GeoDataFrame, tolerance: float) -> gpd.GeoDataFrame:
+    # shapely 2.0 has no coverage simplification, so the arcs are simplified and polygonized again and every face goes
+    # to the borough it overlaps most. Neighbouring boroughs keep one border without gaps or overlaps between them.
+    geometries = boundaries.geometry.values
+    arcs = shapely.simplify(shared_arcs(geometries), tolerance, preserve_topology=True)
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(shapely.union_all(arcs))))
+
+    face_index, borough_index = shapely.STRtree(geometries).query(faces, predicate="intersects")
+    overlap = shapely.area(shapely.intersection(faces[face_index], geometries[borough_index]))
+    order = np.lexsort((-overlap, face_index))
+    first = np.unique(face_index[order], return_index=True)[1]
+    face_index, borough_index, overlap = face_index[order][first], borough_index[order][first], overlap[order][first]
+    kept = overlap > MIN_OVERLAP * shapely.area(faces[face_index])
+
+    grid_size = tolerance / PRECISION
+    decimals = math.ceil(-math.log10(grid_size))
+    simplified = shapely.set_precision(
+        np.array(
+            [shapely.union_all(faces[face_index[kept & (borough_index == i)]]) for i in range(len(boundaries))],
+            dtype=object,
+        ),
+        grid_size,
+    )
+
+    return boundaries.set_geometry(shapely.transform(simplified, lambda coordinates: np.round(coordinates, decimals)))
+
+
+def write_frame(data: pd.DataFrame, output: str | Path) -> None:
+    partial = f"{output}.partial"
+    data.to_parquet(partial)
+    os.replace(partial, output)
+
+
+def build_projected(source: str | Path = NYC_PATH, output: str | Path = BOUNDARIES_PATH) -> None:
+    # The borough boundaries come in the New York state plane, in feet, and are stored in degrees with their centers.
+    nyc = gpd.read_parquet(source)
+    projected = nyc.to_crs(epsg=WGS84)
+    projected["center"] = nyc.centroid.to_crs(epsg=WGS84).apply(lambda center: (center.y, center.x))
+
+    write_frame(projected.rename(columns={"Shape_Leng": "length", "Shape_Area": "area"}), output)
+
+
+def build_heatmap(
+    source: str | Path = BOUNDARIES_PATH, counts: str | Path = BOROUGH_PATH, output: str | Path = HEATMAP_PATH
+) -> None:
+    totals = pd.read_parquet(counts)
+    totals["code"] = totals["borough"].map(BOROUGH_CODES)
+    boundaries = gpd.read_parquet(source).drop(columns="center")
+
+    write_frame(boundaries.merge(totals.drop(columns="borough"), on="code"), output)
+
+
+def build_per_unit(source: str | Path = HEATMAP_PATH, output: str | Path = PER_UNIT_PATH) -> None:
+    heatmap = gpd.read_parquet(source)
+    per_unit = pd.DataFrame(heatmap.drop(columns=["geometry", "code"]))
+    per_unit["borough"] = per_unit["borough"].str.lower()
+    columns = ["length", "area", "borough"]
+
+    write_frame(per_unit[columns + [column for column in per_unit.columns if column not in columns]], output)
+
+
+def build_simplified(source: str | Path = BOUNDARIES_PATH, output: str | Path = SIMPLIFIED_PATH) -> None:
+    boundaries = gpd.read_parquet(source)
+    levels = []
+    for level, tolerance in enumerate(TOLERANCES):
+        simplified = simplify_coverage(boundaries, tolerance=tolerance)
+        simplified.insert(0, "level", level)
+        levels.append(simplified)
+
+    partial = f"{output}.partial"
+    gpd.GeoDataFrame(pd.concat(levels, ignore_index=True), crs=boundaries.crs).to_parquet(partial)
+    os.replace(partial, output)
+
+
+def tolerance_level(zoom: int) -> int:
+    # The coarsest level whose tolerance stays under the size of a pixel at the zoom.
+    pixel = 360 / (256 * 2**zoom)
+    fitting = [level for level, tolerance in enumerate(TOLERANCES) if tolerance <= pixel]
+
+    return fitting[0] if fitting else len(TOLERANCES) - 1
+
+
+def load_simplified(level: int, path: str | Path = SIMPLIFIED_PATH) -> gpd.GeoDataFrame:
+    simplified = storage.read_geo(path)
+
+    return simplified[simplified["level"] == level].drop(columns="level").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    build_simplified()
@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any
+
+from common import CUBOIDS, MEASURES, cuboid_keys, form_filename
+
+DIRECTORY = "data"
+SOURCE = "data/vehicle_crash.parquet"
+STATE_PATH = "data/_build.json"
+# Directories are hashed by the parquet files under them, which leaves out partial writes, IPC copies and the usage
+# counts the aggregates keep.
+DIRECTORY_PATTERN = "*.parquet"
+# The keys of ingest.METRIC_KEYS, ingest is not imported here so that a build with nothing to do starts fast.
+METRIC_KEYS = ["borough", "year"]
+
+
+class Node:
+    # One step of the build. The target is a "module:function" run in a worker process, so the modules it needs are
+    # only imported where it runs and a build with nothing to do never loads them.
+    def __init__(
+        self, name: str, target: str, inputs: list[str], outputs: list[str], kwargs: dict[str, Any] | None = None
+    ) -> None:
+        self.name = name
+        self.target = target
+        self.inputs = inputs
+        self.outputs = outputs
+        self.kwargs = kwargs or {}
+
+    def recipe(self) -> str:
+        return f"{self.target} {sorted((key, str(value)) for key, value in self.kwargs.items())}"
+
+    def module(self) -> str:
+        # The module the target is defined in counts as an input, so a changed step runs again.
+        return f"{self.target.split(':')[0]}.py"
+
+
+def data_path(name: str) -> str:
+    return f"{DIRECTORY}/{name}"
+
+
+def nodes(source: str = SOURCE, ellipsoidal: bool = True, correct: bool = False, ipc: bool = False) -> list[Node]:
+    directory = Path(DIRECTORY)
+    processed, clean_map = data_path("processed"), data_path("clean_map")
+    graph = [
+        Node(
+            "processed",
+            "ingest:processed_stage",
+            inputs=[source, data_path("nyc_projected.parquet")],
+            outputs=[processed, clean_map, data_path("invalid_coordinate.parquet")],
+            kwargs={"source": source, "directory": directory, "ellipsoidal": ellipsoidal, "correct": correct},
+        ),
+        Node(
+            "cuboids",
+            "ingest:cuboids_stage",
+            inputs=[processed],
+            outputs=[form_filename(keys, on=MEASURES) for keys in cuboid_keys(CUBOIDS)],
+            kwargs={"directory": directory},
+        ),
+        *[
+            Node(
+                f"metrics_{key}",
+                "ingest:persist_metrics",
+                inputs=[form_filename([key], on=MEASURES)],
+                outputs=[data_path(f"cumulative_{key}.parquet"), data_path(f"metrics_{key}.parquet")],
+                kwargs={"key": key, "output": directory},
+            )
+            for key in METRIC_KEYS
+        ],
+        Node(
+            "metrics",
+            "ingest:metrics_stage",
+            inputs=[processed, data_path("invalid_coordinate.parquet")],
+            outputs=[data_path("metrics.json")],
+            kwargs={"directory": directory},
+        ),
+        Node(
+            "summary",
+            "ingest:summary_stage",
+            inputs=[processed],
+            outputs=[data_path("summary.json")],
+            kwargs={"directory": directory},
+        ),
+        Node(
+            "aggregates",
+            "ingest:aggregates_stage",
+            inputs=[processed],
+            outputs=[data_path("aggregates")],
+            kwargs={"directory": directory},
+        ),
+        Node(
+            "hexbin",
+            "ingest:pyramid_stage",
+            inputs=[clean_map],
+            outputs=[data_path("hexbin.parquet")],
+            kwargs={"directory": directory},
+        ),
+        Node(
+            "rolling",
+            "rolling:build_rolling",
+            inputs=[form_filename(["borough", "date"], on=MEASURES), form_filename(["borough"], on=MEASURES)],
+            outputs=[data_path("rolling.parquet")],
+        ),
+        Node(
+            "nyc_projected",
+            "boundaries:build_projected",
+            inputs=[data_path("nyc.parquet")],
+            outputs=[data_path("nyc_projected.parquet")],
+        ),
+        Node(
+            "nyc_simplified",
+            "boundaries:build_simplified",
+            inputs=[data_path("nyc_projected.parquet")],
+            outputs=[data_path("nyc_simplified.parquet")],
+        ),
+        Node(
+            "heatmap",
+            "boundaries:build_heatmap",
+            inputs=[data_path("nyc_projected.parquet"), form_filename(["borough"], on=MEASURES)],
+            outputs=[data_path("heatmap.parquet")],
+        ),
+        Node(
+            "per_unit",
+            "boundaries:build_per_unit",
+            inputs=[data_path("heatmap.parquet")],
+            outputs=[data_path("per_unit.parquet")],
+        ),
+    ]
+    # Everything the other steps read or write is described in the catalog, but the raw export and the aggregates,
+    # which come and go with the queries asked.
+    artifacts = {path for node in graph for path in [*node.inputs, *node.outputs]} - {source, data_path("aggregates")}
+    graph.append(
+        Node(
+            "catalog",
+            "catalog:persist_catalog",
+            inputs=sorted(artifacts),
+            outputs=[data_path("catalog.json")],
+            kwargs={"paths": sorted(artifacts)},
+        )
+    )
+    if ipc:
+        # The IPC copies are checked against the parquet files they mirror, so they are left out of the hashes.
+        outputs = [output for node in graph for output in node.outputs if not output.endswith(".json")]
+        graph.append(Node("ipc", "ingest:ipc_stage", inputs=outputs, outputs=[], kwargs={"directory": directory}))
+
+    return graph
+
+
+def dependencies(graph: list[Node]) -> dict[str, set[str]]:
+    producers = {output: node.name for node in graph for output in node.outputs}
+    depends = {node.name: {producers[path] for path in node.inputs if path in producers} for node in graph}
+
+    # Kahn's algorithm, whatever is left once no node is free has a cycle through it.
+    remaining = {name: set(names) for name, names in depends.items()}
+    while free := [name for name, names in remaining.items() if not names]:
+        for name in free:
+            del remaining[name]
+        for names in remaining.values():
+            names.difference_update(free)
+    if remaining:
+        raise ValueError(f"The build has a cycle through {sorted(remaining)}")
+
+    return depends
+
+
+def file_digest(path: Path, known: dict[str, list[Any]]) -> str:
+    # A file is only read again once its size or modification time changed since it was last hashed.
+    stat = path.stat()
+    entry = known.get(str(path))
+    if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return entry[2]
+
+    with open(path, mode="rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    known[str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+
+    return digest
+
+
+def digest(paths: list[str], known: dict[str, list[Any]], recipe: str = "") -> str:
+    hasher = hashlib.sha256(recipe.encode())
+    for name in paths:
+        path = Path(name)
+        if path.is_dir():
+            for file in sorted(path.rglob(DIRECTORY_PATTERN)):
+                hasher.update(f"{file.relative_to(path)} {file_digest(file, known)}\n".encode())
+        elif path.exists():
+            hasher.update(f"{name} {file_digest(path, known)}\n".encode())
+        else:
+            hasher.update(f"{name} missing\n".encode())
+
+    return hasher.hexdigest()
+
+
+def read_state(path: str | Path = STATE_PATH) -> dict[str, Any]:
+    if not os.path.exists(path):
+        return {"files": {}, "nodes": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(state: dict[str, Any], path: str | Path = STATE_PATH) -> None:
+    with open(f"{path}.partial", mode="w") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.partial", path)
+
+
+def run_node(target: str, kwargs: dict[str, Any]) -> float:
+    start = time.perf_counter()
+    module, name = target.split(":")
+    getattr(importlib.import_module(module), name)(**kwargs)
+
+    return time.perf_counter() - start
+
+
+def build(graph: list[Node], jobs: int | None = None, force: bool = False, state_path: str | Path = STATE_PATH) -> int:
+    # A node runs once everything it reads is built, and is skipped when the hash of its inputs and recipe and the
+    # hash of its outputs are the ones recorded after it last ran. Returns the number of nodes that ran.
+    depends = dependencies(graph)
+    by_name = {node.name: node for node in graph}
+    state = read_state(state_path)
+    known, recorded = state["files"], state["nodes"]
+
+    done: set[str] = set()
+    running: dict[Future, tuple[Node, str]] = {}
+    built = 0
+    # Workers are spawned rather than forked, forking after polars started its thread pool can deadlock.
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+        while len(done) < len(graph):
+            started = {node.name for node, _ in running.values()}
+            for name in [name for name in by_name if name not in done | started and depends[name] <= done]:
+                node = by_name[name]
+                inputs = digest([*node.inputs, node.module()], known, recipe=node.recipe())
+                previous = recorded.get(name, {})
+                missing = [path for path in node.inputs if not os.path.exists(path)]
+                if missing:
+                    # Without the raw export the committed artifacts are kept as they are.
+                    status = "kept" if all(os.path.exists(path) for path in node.outputs) else "blocked"
+                    print(f"{status:<8} {name:<16} {', '.join(missing)} missing, nothing to build it from")
+                    done.add(name)
+                elif not force and previous == {"inputs": inputs, "outputs": digest(node.outputs, known)}:
+                    print(f"{'skipped':<8} {name:<16}")
+                    done.add(name)
+                else:
+                    running[executor.submit(run_node, node.target, node.kwargs)] = (node, inputs)
+            if not running:
+                continue
+            # Steps read the hashes of their inputs back, the catalog records them as checksums.
+            write_state(state, state_path)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node, inputs = running.pop(future)
+                elapsed = future.result()
+                recorded[node.name] = {"inputs": inputs, "outputs": digest(node.outputs, known)}
+                write_state(state, state_path)
+                print(f"{'built':<8} {node.name:<16} {elapsed:8.2f}s")
+                done.add(node.name)
+                built += 1
+
+    write_state(state, state_path)
+
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build every artifact under data/, skipping those already up to date.")
+    parser.add_argument("--source", default=SOURCE, help="Raw export as csv or parquet")
+    parser.add_argument("--jobs", type=int, help="Worker processes, by default one per core")
+    parser.add_argument("--force", action="store_true", help="Run every node even if its inputs did not change")
+    parser.add_argument(
+        "--correct-boroughs",
+        action="store_true",
+        help="Replace boroughs that disagree with the borough boundaries instead of only flagging them",
+    )
+    parser.add_argument(
+        "--spherical", action="store_true", help="Use haversine distances instead of the WGS-84 ellipsoid"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = nodes(
+        source=args.source,
+        ellipsoidal=not args.spherical,
+        correct=args.correct_boroughs,
+        ipc=os.environ.get("STORAGE_BACKEND") == "ipc",
+    )
+    built = build(graph, jobs=args.jobs, force=args.force)
+    print(f"{built} of {len(graph)} nodes built in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,195 @@
+import inspect
+import os
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable
+from datetime import date, datetime, time
+from functools import wraps
+from pathlib import Path
+from types import FunctionType, MethodType, ModuleType
+from typing import Any, ParamSpec, TypeVar
+
+import numpy as np
+import polars as pl
+
+from telemetry import span
+
+BUDGET_BYTES = int(os.environ.get("CACHE_BUDGET_MB", "512")) << 20
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def size_of(value: Any, seen: set[int] | None = None) -> int:
+    # Containers and objects are only counted once, the parts of a folium map refer to each other.
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, pl.DataFrame | pl.Series):
+        return int(value.estimated_size())
+    # pandas is only imported by the loaders returning its frames, so a value can not be one before it was. The import
+    # waits for one the warm-up thread may be running.
+    if "pandas" in sys.modules:
+        import pandas as pd
+
+        if isinstance(value, pd.DataFrame | pd.Series):
+            return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(size_of(key, seen) + size_of(item, seen) for key, item in value.items())
+    if isinstance(value, list | tuple | set | frozenset):
+        return sys.getsizeof(value) + sum(size_of(item, seen) for item in value)
+    # Maps and figures hold their layers and traces in their attributes. Code is shared and never counted.
+    if hasattr(value, "__dict__") and not isinstance(value, type | ModuleType | FunctionType | MethodType):
+        return sys.getsizeof(value) + size_of(vars(value), seen)
+
+    return sys.getsizeof(value)
+
+
+def versions(sources: Iterable[str | Path]) -> tuple[int | None, ...]:
+    # Modification times of the files a loader reads, so a rebuilt file is read again under a new key and the entries
+    # of the old one age out.
+    stamps: list[int | None] = []
+    for source in sources:
+        try:
+            stamps.append(os.stat(source).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+
+    return tuple(stamps)
+
+
+def canonical(value: Any, unordered: bool = False) -> Hashable:
+    # Printed expressions show literal lists as [Series], so is_in filters of different values would share a key.
+    if isinstance(value, pl.Expr):
+        return ("expr", value.meta.serialize(format="binary"))
+    if isinstance(value, dict):
+        return tuple(sorted((canonical(key), canonical(item)) for key, item in value.items()))
+    if isinstance(value, set | frozenset) or (unordered and isinstance(value, list | tuple)):
+        return tuple(sorted({canonical(item) for item in value}, key=repr))
+    if isinstance(value, list | tuple):
+        return tuple(canonical(item) for item in value)
+    if isinstance(value, str | int | float | bool | date | datetime | time) or value is None:
+        return value
+    if isinstance(value, Hashable):
+        return value
+
+    return repr(value)
+
+
+class Cache:
+    # A least recently used cache bounded by the estimated size of its values rather than their number, shared by
+    # every session served from this process.
+    def __init__(self, budget_bytes: int = BUDGET_BYTES) -> None:
+        self.budget_bytes = budget_bytes
+        self.entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], R]) -> R:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        # A lazy frame is only a plan, its size can not be told without collecting it.
+        if isinstance(value, pl.LazyFrame):
+            return value
+        size = size_of(value)
+        with self.lock:
+            if key in self.entries or size > self.budget_bytes:
+                return value
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.budget_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+        return value
+
+    def get(self, key: Hashable) -> Any:
+        # None for a missing key, which is only counted as a miss once get_or_compute computes it.
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+CACHE = Cache()
+
+
+def cached(
+    unordered: Iterable[str] = (), sources: Iterable[str | Path] = ()
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    # Keys hold every argument after defaults are applied, with the arguments named in unordered sorted, so the same
+    # multiselect picked in any order maps to one entry, and the modification times of the sources the loader reads.
+    # Functions are told apart by file as well as by name because pages define loaders with the same names.
+    unordered = set(unordered)
+    sources = list(sources)
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        signature = inspect.signature(func)
+        name = (func.__code__.co_filename, func.__qualname__)
+
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (
+                name,
+                tuple(
+                    (argument, canonical(value, unordered=argument in unordered))
+                    for argument, value in bound.arguments.items()
+                ),
+                versions(sources),
+            )
+
+            computed = False
+
+            def compute() -> R:
+                nonlocal computed
+                computed = True
+                return func(*args, **kwargs)
+
+            with span(func.__qualname__, kind="loader") as record:
+                value = CACHE.get_or_compute(key, compute)
+                record["cache"] = "miss" if computed else "hit"
+
+            return value
+
+        return wrapper
+
+    return decorator
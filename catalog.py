@@ -0,0 +1,135 @@
+import json
+import os
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+import pyarrow.parquet as pq
+
+from build import digest, file_digest, read_state
+from common import form_filename
+from dataset import INDEX_NAME, PARTITIONS, read_index, scan_dataset
+from storage import is_geo
+
+CATALOG_PATH = "data/catalog.json"
+STATISTICS = ["date", "year", "month", "weekday", "hour"]
+COUNT = "number_of_crash"
+
+
+def is_dataset(path: Path) -> bool:
+    return (path / INDEX_NAME).exists()
+
+
+def scan_artifact(path: Path) -> pl.LazyFrame:
+    return scan_dataset(path) if is_dataset(path) else pl.scan_parquet(path)
+
+
+def encode(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def statistics(data: pl.LazyFrame, columns: list[str]) -> dict[str, dict[str, Any]]:
+    # Aggregates count crashes in number_of_crash, so their median is the one of the crashes they count, which is the
+    # median of the rows for every other artifact.
+    weighted = COUNT in data.collect_schema().names()
+    stats = {}
+    for column in columns:
+        counted = data.select(column, pl.col(COUNT) if weighted else pl.lit(1).alias(COUNT)).drop_nulls(column)
+        counted = counted.group_by(column).agg(pl.col(COUNT).sum()).sort(by=column)
+        half = pl.col(COUNT).sum() / 2
+        row = counted.select(
+            pl.col(column).min().alias("min"),
+            pl.col(column).max().alias("max"),
+            pl.col(column).filter(pl.col(COUNT).cum_sum() >= half).first().alias("median"),
+        ).collect()
+        stats[column] = {key: encode(value) for key, value in row.row(0, named=True).items()}
+
+    return stats
+
+
+def partition_counts(path: Path) -> list[dict[str, Any]]:
+    counts = (
+        read_index(path)
+        .group_by(PARTITIONS)
+        .agg(
+            pl.col("length").sum().alias("rows"),
+            pl.col("date").min().alias("start"),
+            pl.col("date").max().alias("end"),
+        )
+    )
+
+    return [
+        {key: encode(value) for key, value in row.items()}
+        for row in counts.sort(by=PARTITIONS, nulls_last=True).iter_rows(named=True)
+    ]
+
+
+def describe(path: Path, known: dict[str, list[Any]]) -> dict[str, Any]:
+    # Checksums come from the hashes the build recorded, a file is only read again if it changed since.
+    if path.suffix == ".json":
+        return {"bytes": path.stat().st_size, "checksum": file_digest(path, known)}
+
+    if path.is_file() and is_geo(path):
+        # Polars can not read the geometry columns, their types are taken from the parquet schema instead.
+        metadata = pq.read_metadata(path)
+        schema = metadata.schema.to_arrow_schema()
+        return {
+            "schema": {name: str(schema.field(name).type) for name in schema.names},
+            "rows": metadata.num_rows,
+            "stats": {},
+            "checksum": file_digest(path, known),
+        }
+
+    data = scan_artifact(path)
+    schema = data.collect_schema()
+    entry = {
+        "schema": {name: str(dtype) for name, dtype in schema.items()},
+        "rows": data.select(pl.len()).collect().item(),
+        "stats": statistics(data, [column for column in STATISTICS if column in schema]),
+    }
+    if is_dataset(path):
+        entry["partitions"] = partition_counts(path)
+        entry["checksum"] = digest([str(path)], known)
+    else:
+        entry["checksum"] = file_digest(path, known)
+
+    return entry
+
+
+def persist_catalog(paths: list[str] | None = None, path: str | Path = CATALOG_PATH) -> int:
+    # Without paths the artifacts already in the catalog are described again, which is what an append needs.
+    if paths is None:
+        paths = list(read_catalog(path))
+    known = read_state()["files"]
+    catalog = {name: describe(Path(name), known) for name in sorted(paths) if os.path.exists(name)}
+
+    with open(f"{path}.partial", mode="w") as f:
+        json.dump(catalog, f, indent=1)
+    os.replace(f"{path}.partial", path)
+
+    return len(catalog)
+
+
+def read_catalog(path: str | Path = CATALOG_PATH) -> dict[str, Any]:
+    return load_catalog(str(path), Path(path).stat().st_mtime_ns)
+
+
+@lru_cache
+def load_catalog(path: str, version: int) -> dict[str, Any]:
+    # The version is the modification time, so every process sees a rebuilt catalog without a restart.
+    with open(path) as f:
+        return json.load(f)
+
+
+def decode(value: Any, dtype: str) -> Any:
+    return date.fromisoformat(value) if dtype == "Date" else value
+
+
+def bounds(dimension: str, path: str | Path = CATALOG_PATH) -> tuple[Any, Any, Any]:
+    # Minimum, maximum and median crash of a dimension, read from the statistics of its own aggregate.
+    entry = read_catalog(path)[form_filename([dimension], on=[])]
+    stats, dtype = entry["stats"][dimension], entry["schema"][dimension]
+
+    return decode(stats["min"], dtype), decode(stats["max"], dtype), decode(stats["median"], dtype)
@@ -1,6 +1,12 @@
-from datetime import date
+import os
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from pathlib import Path
 
+import numpy as np
+import numpy.typing as npt
 import polars as pl
 
 
@@ -26,33 +32,127 @@ class Incident(str, Enum):
 options = [Option.DATE.value, Option.YEAR.value, Option.MONTH.value, Option.HOUR.value]
 
 
-def form_filename(keys: list[str], on: list[str]) -> str:
+def form_filename(keys: list[str], on: list[str], directory: str | Path = "data") -> str:
     filename = "__".join(sorted(keys))
-    filename = f"data/{filename}.parquet"
+    filename = f"{directory}/{filename}.parquet"
 
     return filename
 
 
-def persist_data_bitmask(data: pl.DataFrame, by: list[str], on: list[str]) -> None:
+def key_subsets(by: list[str]) -> list[list[str]]:
     n_cols = len(by)
+    subsets = []
 
     for i in range(1, (1 << n_cols)):
         keys = []
         for j in range(n_cols):
             if (i & (1 << j)) != 0:
                 keys.append(by[j])
+        subsets.append(keys)
 
-        grouped = (
-            data.drop_nulls(subset=keys)
-            .group_by(keys)
-            .agg(pl.col(on).sum(), pl.col(on[0]).count().alias("number_of_crash"))
+    return subsets
+
+
+def crash_count(on: list[str]) -> pl.Expr:
+    # A crash is counted when its first victim count is known, the cuboids, their deltas and the aggregates all agree.
+    return pl.col(on[0]).count().alias("number_of_crash")
+
+
+def rollup(data: pl.LazyFrame, keys: list[str], on: list[str]) -> pl.LazyFrame:
+    return data.group_by(keys).agg(pl.col(on + ["number_of_crash"]).sum())
+
+
+def write_cuboid(data: pl.DataFrame, keys: list[str], on: list[str], directory: str | Path = "data") -> None:
+    grouped = data.drop_nulls(subset=keys).with_columns(pl.col("number_of_crash").cast(pl.UInt32))
+    grouped = grouped.sort(by=keys)
+
+    grouped.write_parquet(form_filename(keys=keys, on=on, directory=directory))
+
+
+def smallest_parent(lattice: dict[tuple[str, ...], pl.DataFrame], keys: list[str]) -> pl.DataFrame:
+    parents = [cuboid for parent, cuboid in lattice.items() if len(parent) == len(keys) + 1 and set(keys) < set(parent)]
+
+    return min(parents, key=len)
+
+
+def persist_data_bitmask(
+    data: pl.DataFrame | pl.LazyFrame, by: list[str], on: list[str], directory: str | Path = "data"
+) -> None:
+    finest = data.lazy().group_by(by).agg(pl.col(on).sum(), crash_count(on))
+    lattice = {tuple(by): finest.collect(streaming=True)}
+
+    with ThreadPoolExecutor() as executor:
+        writes = [executor.submit(write_cuboid, lattice[tuple(by)], by, on, directory)]
+
+        for size in range(len(by) - 1, 0, -1):
+            subsets = [keys for keys in key_subsets(by) if len(keys) == size]
+            parents = [smallest_parent(lattice, keys) for keys in subsets]
+            cuboids = pl.collect_all([rollup(parent.lazy(), keys, on) for keys, parent in zip(subsets, parents)])
+
+            for keys, cuboid in zip(subsets, cuboids):
+                lattice[tuple(keys)] = cuboid
+                writes.append(executor.submit(write_cuboid, cuboid, keys, on, directory))
+
+        for write in writes:
+            write.result()
+
+
+def replace_parquet(data: pl.DataFrame, path: str) -> None:
+    # Every writer stages its own file, processes materializing the same aggregate at once never write over each other.
+    partial = f"{path}.{uuid.uuid4().hex}.partial"
+    data.write_parquet(partial)
+    os.replace(partial, path)
+
+
+def cuboid_keys(cuboids: list[list[str]]) -> list[list[str]]:
+    unique: dict[tuple[str, ...], list[str]] = {}
+    for by in cuboids:
+        for keys in key_subsets(by):
+            unique.setdefault(tuple(sorted(keys)), keys)
+
+    return list(unique.values())
+
+
+def merge_cuboid(changes: pl.DataFrame, keys: list[str], on: list[str], directory: str | Path = "data") -> None:
+    delta = (
+        changes.drop_nulls(subset=keys)
+        .group_by(keys)
+        .agg(
+            (pl.col(on) * pl.col("sign")).sum(),
+            (pl.col(on[0]).is_not_null() * pl.col("sign")).sum().alias("number_of_crash"),
         )
-        grouped = grouped.sort(by=keys)
+    )
+    if delta.shape[0] == 0:
+        return
+
+    filename = form_filename(keys=keys, on=on, directory=directory)
+    existing = pl.read_parquet(filename)
+    merged = (
+        pl.concat([existing, delta.select(existing.columns)], how="vertical_relaxed")
+        .group_by(keys)
+        .agg(pl.col(on + ["number_of_crash"]).sum())
+        .filter(pl.col("number_of_crash") > 0)
+        .select(pl.col(name).cast(dtype) for name, dtype in existing.schema.items())
+        .sort(by=keys)
+    )
+
+    replace_parquet(merged, filename)
+
+
+def map_coordinates(
+    kernel: Callable[[npt.NDArray[np.float64], npt.NDArray[np.float64]], pl.Series], dtype: pl.DataType
+) -> pl.Expr:
+    def batch(coordinates: pl.Series) -> pl.Series:
+        latitude = coordinates.struct.field("latitude").to_numpy()
+        longitude = coordinates.struct.field("longitude").to_numpy()
+
+        return kernel(latitude, longitude)
 
-        grouped.write_parquet(form_filename(keys=keys, on=on))
+    return pl.struct("latitude", "longitude").map_batches(batch, return_dtype=dtype, is_elementwise=True)
 
 
-MINIMUMS = {"date": date(day=1, month=7, year=2012), "year": 2012, "month": 1, "hour": 0}
-MAXIMUMS = {"date": date(day=8, month=10, year=2024), "year": 2024, "month": 12, "hour": 23}
-MEDIANS = {"date": date(day=1, month=7, year=2014), "year": 2014, "month": 7, "hour": 12}
+MEASURES = ["number_of_persons_injured", "number_of_persons_killed", "number_of_casualty"]
+CUBOIDS = [["borough", "date"], ["borough", "year", "month", "hour"]]
 NY_CENTER = (40.71261963846181, -73.95064260553615)
+BOROUGHS = ["BRONX", "QUEENS", "BROOKLYN", "MANHATTAN", "STATEN ISLAND"]
+BOROUGH_CODES = {borough: code for borough, code in zip(BOROUGHS, [2, 4, 3, 1, 5])}
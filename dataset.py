@@ -0,0 +1,218 @@
+import os
+import shutil
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+import polars as pl
+
+import storage
+
+PROCESSED_PATH = "data/processed"
+CLEAN_MAP_PATH = "data/clean_map"
+
+PARTITIONS = ["year", "borough"]
+HIVE_SCHEMA = {"year": pl.Int32(), "borough": pl.String()}
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+SORT_BY = ["date", "time"]
+
+# Small row groups sorted by date let a one day filter skip almost all of a partition from the footer statistics.
+# Written through pyarrow, the native writer drops the time logical type once a file has several row groups.
+# Dictionaries are left out, coordinates and distances hardly repeat and the few small columns compress anyway.
+ROW_GROUP_SIZE = 4096
+COMPRESSION_LEVEL = 9
+PART_NAME = "part-0.parquet"
+INDEX_NAME = "_index.parquet"
+
+
+def scan_dataset(path: str | Path, ipc: bool = True) -> pl.LazyFrame:
+    # Appends rewrite the index with the partitions, so a stale index copy means some partition copies are stale too.
+    # Scans streamed into a file pass ipc=False, the streaming engine can not read IPC files yet.
+    if ipc and storage.use_ipc(Path(path) / INDEX_NAME):
+        return pl.scan_ipc(
+            f"{path}/*/*/*{storage.IPC_SUFFIX}", hive_partitioning=True, hive_schema=HIVE_SCHEMA, memory_map=True
+        )
+
+    return pl.scan_parquet(f"{path}/*/*/*.parquet", hive_partitioning=True, hive_schema=HIVE_SCHEMA)
+
+
+def partition_directory(path: str | Path, year: int | None, borough: str | None) -> Path:
+    values = [NULL_PARTITION if value is None else str(value) for value in [year, borough]]
+
+    return Path(path).joinpath(*[f"{key}={value}" for key, value in zip(PARTITIONS, values)])
+
+
+def partition_filter(year: int | None, borough: str | None) -> pl.Expr:
+    return pl.col("year").eq_missing(year) & pl.col("borough").eq_missing(borough)
+
+
+def partition_index(frame: pl.DataFrame, year: int | None, borough: str | None) -> pl.DataFrame:
+    # Rows of a partition are sorted by date, so every date is one contiguous run of rows.
+    index = (
+        frame.with_row_index("offset")
+        .group_by("date", maintain_order=True)
+        .agg(pl.col("offset").first(), pl.len().alias("length"))
+    )
+
+    return index.select(
+        pl.lit(year, dtype=HIVE_SCHEMA["year"]).alias("year"),
+        pl.lit(borough, dtype=HIVE_SCHEMA["borough"]).alias("borough"),
+        "date",
+        "offset",
+        "length",
+    )
+
+
+def write_index(path: str | Path, index: pl.DataFrame) -> None:
+    path = Path(path) / INDEX_NAME
+    index.sort(by=[*PARTITIONS, "date"], nulls_last=True).write_parquet(f"{path}.partial")
+    os.replace(f"{path}.partial", path)
+
+
+def write_partition(frame: pl.DataFrame, directory: Path, year: int | None, borough: str | None) -> pl.DataFrame:
+    if frame.shape[0] == 0:
+        shutil.rmtree(directory, ignore_errors=True)
+        return partition_index(frame, year=year, borough=borough)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / PART_NAME
+    frame = frame.drop(PARTITIONS, strict=False).sort(by=SORT_BY, nulls_last=True)
+    frame.write_parquet(
+        f"{path}.partial",
+        compression="zstd",
+        compression_level=COMPRESSION_LEVEL,
+        statistics=True,
+        row_group_size=ROW_GROUP_SIZE,
+        use_pyarrow=True,
+        pyarrow_options={"use_dictionary": False},
+    )
+    os.replace(f"{path}.partial", path)
+
+    return partition_index(frame, year=year, borough=borough)
+
+
+def write_dataset(data: pl.LazyFrame, path: str | Path) -> None:
+    # One year is collected at a time so memory stays bounded by the largest year rather than the whole dataset.
+    path = Path(path)
+    staging = path.with_name(f"{path.name}.partial")
+    shutil.rmtree(staging, ignore_errors=True)
+
+    index = []
+    years = data.select(pl.col("year").unique()).collect().to_series()
+    for year in years:
+        for frame in data.filter(pl.col("year").eq_missing(year)).collect().partition_by("borough"):
+            borough = frame["borough"][0]
+            directory = partition_directory(staging, year=year, borough=borough)
+            index.append(write_partition(frame, directory=directory, year=year, borough=borough))
+    if not index:
+        # A dataset without rows keeps one empty file, so scans of it still know its schema.
+        empty = data.head(0).collect()
+        directory = partition_directory(staging, year=None, borough=None)
+        directory.mkdir(parents=True)
+        empty.drop(PARTITIONS).write_parquet(directory / PART_NAME)
+        index.append(partition_index(empty, year=None, borough=None))
+    write_index(staging, pl.concat(index))
+
+    previous = path.with_name(f"{path.name}.previous")
+    if path.exists():
+        os.replace(path, previous)
+    os.replace(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def read_partition(directory: Path, schema: pl.Schema, year: int | None, borough: str | None) -> pl.LazyFrame:
+    path = directory / PART_NAME
+    if not path.exists():
+        return pl.LazyFrame(schema=schema)
+
+    partition = storage.scan(path).with_columns(
+        pl.lit(year, dtype=HIVE_SCHEMA["year"]).alias("year"),
+        pl.lit(borough, dtype=HIVE_SCHEMA["borough"]).alias("borough"),
+    )
+
+    return partition.select(schema.names())
+
+
+def replace_partitions(path: str | Path, delta: pl.DataFrame, ids: pl.Series, partitions: pl.DataFrame) -> None:
+    schema = scan_dataset(path).collect_schema()
+    partitions = partitions.select(PARTITIONS).unique()
+
+    index = [read_index(path).join(partitions, on=PARTITIONS, how="anti", join_nulls=True)]
+    for year, borough in partitions.iter_rows():
+        directory = partition_directory(path, year=year, borough=borough)
+        kept = read_partition(directory, schema, year=year, borough=borough).filter(~pl.col("collision_id").is_in(ids))
+        added = delta.filter(partition_filter(year, borough)).select(
+            pl.col(name).cast(dtype) for name, dtype in schema.items()
+        )
+        frame = pl.concat([kept.collect(), added])
+        index.append(write_partition(frame, directory=directory, year=year, borough=borough))
+    write_index(path, pl.concat(index))
+
+
+def read_index(path: str | Path) -> pl.DataFrame:
+    return load_index(str(path), (Path(path) / INDEX_NAME).stat().st_mtime_ns)
+
+
+@lru_cache
+def load_index(path: str, version: int) -> pl.DataFrame:
+    # The version is the modification time, an append rewrites the index and every process reads the new one.
+    return storage.scan(Path(path) / INDEX_NAME).collect()
+
+
+def matching_partitions(index: pl.DataFrame, filters: list[pl.Expr]) -> pl.DataFrame:
+    # Filters only on the partition keys and date can be answered from the index alone, the others may match any
+    # partition.
+    prunable = [expr for expr in filters if set(expr.meta.root_names()) <= {*PARTITIONS, "date"}]
+
+    return index.filter(*prunable).select(PARTITIONS).unique() if prunable else index.select(PARTITIONS).unique()
+
+
+def scan_filtered(
+    path: str | Path, filters: list[pl.Expr], index: pl.DataFrame | None = None, ipc: bool = True
+) -> pl.LazyFrame:
+    # Partitions that cannot match are never opened, not even for their footers. The files left are scanned as one
+    # hive partitioned source rather than with literal partition columns, which the streaming sinks can not run.
+    data = scan_dataset(path, ipc=ipc)
+    if not filters:
+        return data
+    if index is None:
+        index = read_index(path)
+    ipc = ipc and storage.use_ipc(Path(path) / INDEX_NAME)
+    files = []
+    for year, borough in matching_partitions(index, filters).sort(by=PARTITIONS, nulls_last=True).iter_rows():
+        file = partition_directory(path, year=year, borough=borough) / PART_NAME
+        if file.exists():
+            files.append(storage.ipc_path(file) if ipc else file)
+    if not files:
+        return pl.LazyFrame(schema=data.collect_schema())
+    if ipc:
+        return pl.scan_ipc(files, hive_partitioning=True, hive_schema=HIVE_SCHEMA, memory_map=True).filter(*filters)
+
+    return pl.scan_parquet(files, hive_partitioning=True, hive_schema=HIVE_SCHEMA).filter(*filters)
+
+
+def read_dates(
+    path: str | Path, start: date, end: date, boroughs: list[str], index: pl.DataFrame | None = None
+) -> pl.DataFrame:
+    # Each selected partition is read as the single run of rows between the first and the last matching date, so the
+    # parquet reader only touches the row groups overlapping the range.
+    if index is None:
+        index = read_index(path)
+    schema = scan_dataset(path).collect_schema()
+    ranges = (
+        index.filter(pl.col("date").is_between(start, end), pl.col("borough").is_in(boroughs))
+        .group_by(PARTITIONS)
+        .agg(pl.col("offset").min(), (pl.col("offset") + pl.col("length")).max().alias("end"))
+        .sort(by=PARTITIONS)
+    )
+    if ranges.shape[0] == 0:
+        return pl.DataFrame(schema=schema)
+
+    frames = [
+        read_partition(partition_directory(path, year=year, borough=borough), schema, year=year, borough=borough).slice(
+            offset, end - offset
+        )
+        for year, borough, offset, end in ranges.iter_rows()
+    ]
+
+    return pl.concat(pl.collect_all(frames))
@@ -0,0 +1,150 @@
+import math
+import os
+from pathlib import Path
+
+import polars as pl
+import streamlit as st
+
+from cache import CACHE
+from telemetry import LOG_BACKUPS, LOG_PATH
+
+# Reached through home.py?diagnostics, and only on servers started with DIAGNOSTICS=1, so the public deployment never
+# shows it. It reads the telemetry log of every server process writing to LOG_PATH.
+ENABLED = os.environ.get("DIAGNOSTICS") == "1"
+SLOWEST_RERUNS = 20
+SCHEMA = {
+    "type": pl.String,
+    "rerun": pl.String,
+    "page": pl.String,
+    "session": pl.String,
+    "name": pl.String,
+    "kind": pl.String,
+    "time": pl.Float64,
+    "seconds": pl.Float64,
+    "bytes_sent": pl.Int64,
+    "rss_delta": pl.Int64,
+    "cache": pl.String,
+    "spans": pl.Int64,
+    "complete": pl.Boolean,
+}
+
+
+def log_files() -> list[Path]:
+    # The current log and its rotated backups, oldest first.
+    paths = [Path(f"{LOG_PATH}.{backup}") for backup in range(LOG_BACKUPS, 0, -1)] + [Path(LOG_PATH)]
+
+    return [path for path in paths if path.exists() and path.stat().st_size > 0]
+
+
+def read_log() -> pl.DataFrame:
+    files = log_files()
+    if not files:
+        return pl.DataFrame(schema=SCHEMA)
+    # A line cut short by a process killed mid write is skipped rather than failing the whole read.
+    frames = [pl.read_ndjson(path, schema=SCHEMA, ignore_errors=True) for path in files]
+
+    return pl.concat(frames).with_columns(
+        pl.from_epoch(pl.col("time"), time_unit="s").alias("time"), (pl.col("seconds") * 1000).alias("ms")
+    )
+
+
+def stage_table(spans: pl.DataFrame) -> pl.DataFrame:
+    return (
+        spans.group_by("page", "kind", "name")
+        .agg(
+            pl.len().alias("count"),
+            pl.col("ms").quantile(0.5).alias("p50_ms"),
+            pl.col("ms").quantile(0.95).alias("p95_ms"),
+            pl.col("ms").quantile(0.99).alias("p99_ms"),
+            pl.col("ms").max().alias("max_ms"),
+            (pl.col("cache") == "hit").mean().alias("hit_rate"),
+            pl.col("bytes_sent").mean().alias("mean_bytes_sent"),
+            pl.col("rss_delta").mean().alias("mean_rss_delta"),
+        )
+        .sort("p95_ms", descending=True)
+    )
+
+
+def histogram(ms: pl.Series) -> pl.DataFrame:
+    # Buckets double in width, so fast stages and their slow tail fit in one chart.
+    ms = ms.drop_nulls()
+    slowest = float(ms.max() or 1)  # type: ignore [arg-type]
+    edges = [2**exponent for exponent in range(math.ceil(math.log2(max(slowest, 1))) + 1)]
+    # cut labels the interval (previous edge, edge] by its edge, the one past the last edge is never filled.
+    labels = [str(edge) for edge in [*edges, 2 * edges[-1]]]
+    buckets = ms.cut(edges, labels=labels).cast(pl.String).cast(pl.Int64)
+
+    return (
+        buckets.alias("bucket")
+        .to_frame()
+        .group_by("bucket")
+        .agg(pl.len().alias("count"))
+        .sort("bucket")
+        .with_columns(pl.format("≤ {} ms", pl.col("bucket")).alias("latency"))
+    )
+
+
+def show() -> None:
+    if not ENABLED:
+        return
+
+    st.title("Diagnostics")
+    st.write("Cache of this process", {"pid": os.getpid(), **CACHE.stats()})
+
+    log = read_log()
+    reruns = log.filter(pl.col("type") == "rerun")
+    spans = log.filter(pl.col("type") == "span")
+    if reruns.is_empty():
+        st.info(f"No rerun was recorded in {LOG_PATH} yet.")
+        st.stop()
+    first, last = reruns.select(pl.col("time").min().alias("first"), pl.col("time").max().alias("last")).row(0)
+    st.caption(f"{reruns.height} reruns and {spans.height} spans from {first} to {last}")
+
+    st.header("Stages")
+    stages = stage_table(spans)
+    st.dataframe(stages, use_container_width=True)
+    labels = [f"{page} · {kind} · {name}" for page, kind, name in stages.select("page", "kind", "name").iter_rows()]
+    selected = st.selectbox("Latency histogram of", range(len(labels)), format_func=labels.__getitem__)
+    if selected is not None:
+        page, kind, name = stages.row(selected)[:3]
+        stage = spans.filter(pl.col("page") == page, pl.col("kind") == kind, pl.col("name") == name)
+        st.bar_chart(histogram(stage["ms"]), x="latency", y="count")
+
+    st.header("Slowest reruns")
+    slowest = reruns.sort("ms", descending=True).head(SLOWEST_RERUNS)
+    st.dataframe(
+        slowest.select("rerun", "page", "time", "ms", "bytes_sent", "spans", "complete"), use_container_width=True
+    )
+    rerun: str | None = st.selectbox("Spans of", slowest["rerun"].to_list())
+    st.dataframe(
+        spans.filter(pl.col("rerun") == rerun)
+        .sort("time")
+        .select("kind", "name", "ms", "cache", "bytes_sent", "rss_delta"),
+        use_container_width=True,
+    )
+
+    st.header("Payload sent to the browser")
+    st.dataframe(
+        reruns.group_by("page")
+        .agg(
+            pl.len().alias("reruns"),
+            pl.col("bytes_sent").quantile(0.5).alias("p50_bytes"),
+            pl.col("bytes_sent").quantile(0.95).alias("p95_bytes"),
+            pl.col("bytes_sent").max().alias("max_bytes"),
+        )
+        .sort("p95_bytes", descending=True),
+        use_container_width=True,
+    )
+    st.dataframe(
+        spans.filter(pl.col("kind") == "render")
+        .group_by("page", "name")
+        .agg(
+            pl.len().alias("count"),
+            pl.col("bytes_sent").quantile(0.5).alias("p50_bytes"),
+            pl.col("bytes_sent").max().alias("max_bytes"),
+        )
+        .sort("max_bytes", descending=True),
+        use_container_width=True,
+    )
+
+    st.stop()
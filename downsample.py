@@ -0,0 +1,51 @@
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+# About the width in pixels of a chart in the wide layout, more points than that per trace can not be told apart.
+MAX_POINTS = 1200
+
+
+def lttb(x: npt.NDArray[np.float64], y: npt.NDArray[np.float64], threshold: int) -> npt.NDArray[np.int64]:
+    # Largest triangle three buckets: the first and last points are kept and from every bucket between them the point
+    # spanning the largest triangle with the point kept before it and the average of the next bucket, which keeps the
+    # peaks and dips a plain stride would skip.
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    every = (length - 2) / (threshold - 2)
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = length - 1
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, length - 1
+
+    kept = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        following = slice(end, edges[bucket + 2] if bucket + 2 < len(edges) else length)
+        average_x, average_y = x[following].mean(), y[following].mean()
+        areas = np.abs(
+            (x[kept] - average_x) * (y[start:end] - y[kept]) - (x[kept] - x[start:end]) * (average_y - y[kept])
+        )
+        kept = start + int(np.argmax(areas))
+        indices[bucket + 1] = kept
+
+    return indices
+
+
+def downsample(data: pl.DataFrame, x: str, y: str, by: str = "borough", threshold: int = MAX_POINTS) -> pl.DataFrame:
+    # Every group is its own trace that spans the whole chart, so each of them is reduced to the threshold.
+    if data.shape[0] <= threshold:
+        return data
+
+    groups = []
+    for _, group in data.sort(by=[by, x]).group_by(by, maintain_order=True):
+        indices = lttb(
+            group[x].to_physical().cast(pl.Float64).to_numpy(),
+            group[y].cast(pl.Float64).fill_null(0).to_numpy(),
+            threshold=threshold,
+        )
+        groups.append(group[indices])
+
+    return pl.concat(groups)
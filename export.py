@@ -0,0 +1,162 @@
+import hashlib
+import html
+import io
+import os
+import uuid
+from collections.abc import Hashable, Iterable
+from enum import Enum
+from pathlib import Path
+
+import polars as pl
+import streamlit as st
+
+from cache import CACHE, canonical, versions
+
+# Full exports are written under the static directory of the app and downloaded from the server's static route, so
+# their bytes are never held in memory. Streamlit serves static files of at most 200 MB.
+EXPORT_DIRECTORY = Path(__file__).parent / "static" / "exports"
+EXPORT_URL = "app/static/exports"
+MAX_EXPORT_BYTES = 200 << 20
+# Exports are kept up to EXPORT_BUDGET_BYTES on disk, the least recently asked for are removed first.
+EXPORT_BUDGET_BYTES = 2 << 30
+
+
+class ExportFormat(str, Enum):
+    CSV = "CSV"
+    PARQUET = "Parquet"
+    ARROW = "Arrow"
+
+
+SUFFIXES = {ExportFormat.CSV: ".csv", ExportFormat.PARQUET: ".parquet", ExportFormat.ARROW: ".arrow"}
+MIMES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+    ExportFormat.ARROW: "application/vnd.apache.arrow.file",
+}
+
+
+def fingerprint(
+    data: pl.DataFrame | pl.LazyFrame, sources: Iterable[str | Path] = (), selection: Hashable = None
+) -> str:
+    # A lazy frame is identified by its plan, which holds the files it scans and every filter on them, a displayed
+    # frame by the selection it was filtered with. Both add the modification times of the sources they are read from.
+    digest = hashlib.sha1()
+    if isinstance(data, pl.LazyFrame):
+        digest.update(data.serialize())
+    else:
+        digest.update(repr((canonical(selection), data.schema, data.shape)).encode())
+    digest.update(repr(versions(sources)).encode())
+
+    return digest.hexdigest()
+
+
+def write(data: pl.DataFrame, target: io.BytesIO | Path, export_format: ExportFormat) -> None:
+    if export_format == ExportFormat.CSV:
+        data.write_csv(target)
+    elif export_format == ExportFormat.PARQUET:
+        data.write_parquet(target)
+    else:
+        data.write_ipc(target)
+
+
+def sink(data: pl.LazyFrame, path: Path, export_format: ExportFormat) -> None:
+    if export_format == ExportFormat.CSV:
+        data.sink_csv(path)
+    elif export_format == ExportFormat.PARQUET:
+        data.sink_parquet(path)
+    else:
+        data.sink_ipc(path)
+
+
+def export_bytes(data: pl.DataFrame, export_format: ExportFormat, token: str) -> bytes:
+    def compute() -> bytes:
+        buffer = io.BytesIO()
+        write(data, buffer, export_format=export_format)
+        return buffer.getvalue()
+
+    return CACHE.get_or_compute(("export", token, export_format), compute)
+
+
+def export_file(data: pl.LazyFrame, export_format: ExportFormat, sources: Iterable[str | Path] = ()) -> Path:
+    # Streamed from the scan into a file in batches, the rows are never collected into one frame. Files are named by
+    # their fingerprint, so an export asked for again is served from the file written the first time.
+    EXPORT_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    path = EXPORT_DIRECTORY / f"{fingerprint(data, sources=sources)}{SUFFIXES[export_format]}"
+    try:
+        # The modification time of an export is when it was last asked for, the order it is evicted in.
+        os.utime(path)
+    except FileNotFoundError:
+        partial = path.with_name(f"{path.name}.{uuid.uuid4().hex}.partial")
+        sink(data, partial, export_format=export_format)
+        os.replace(partial, path)
+    evict_exports(keep=path)
+
+    return path
+
+
+def evict_exports(keep: Path) -> None:
+    # Files still being written end in .partial and are skipped, as is the export just asked for.
+    exports = []
+    for path in EXPORT_DIRECTORY.iterdir():
+        if path.name.endswith(".partial") or path == keep:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        exports.append((stat.st_mtime_ns, stat.st_size, path))
+    total = keep.stat().st_size + sum(size for _, size, _ in exports)
+    for _, size, path in sorted(exports):
+        if total <= EXPORT_BUDGET_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def format_selectbox() -> ExportFormat:
+    return ExportFormat(st.selectbox(label="Download format", options=[option.value for option in ExportFormat]))
+
+
+def download_button(
+    label: str,
+    data: pl.DataFrame | pl.LazyFrame,
+    file_name: str,
+    export_format: ExportFormat,
+    key: str,
+    sources: Iterable[str | Path] = (),
+    selection: Hashable = None,
+) -> None:
+    # The payload of a download button is needed when it is drawn, so it is only built once asked for and the button
+    # stays until the data or the format change. A displayed frame is told apart by the selection it was filtered with
+    # and the sources it was read from, which the caller passes, rather than by hashing its rows on every rerun.
+    state = f"export_{key}"
+    sources = list(sources)
+    token = fingerprint(data, sources=sources, selection=(key, file_name, selection))
+    if st.session_state.get(state) != (token, export_format):
+        if not st.button(label=label, key=f"{state}_prepare"):
+            return
+        st.session_state[state] = (token, export_format)
+
+    file_name = f"{file_name}{SUFFIXES[export_format]}"
+    if isinstance(data, pl.LazyFrame):
+        path = export_file(data, export_format=export_format, sources=sources)
+        size = path.stat().st_size
+        if size > MAX_EXPORT_BYTES:
+            st.warning(
+                f"{file_name} takes {size >> 20} MB, over the {MAX_EXPORT_BYTES >> 20} MB the server sends. "
+                "Narrow the selection or pick a compressed format."
+            )
+        else:
+            st.markdown(
+                f'<a href="{EXPORT_URL}/{path.name}" download="{html.escape(file_name)}">Save {html.escape(file_name)}</a>',
+                unsafe_allow_html=True,
+            )
+    else:
+        payload = export_bytes(data, export_format=export_format, token=token)
+        st.download_button(
+            label=f"Save {file_name}",
+            data=payload,
+            file_name=file_name,
+            mime=MIMES[export_format],
+            key=f"{state}_save",
+        )
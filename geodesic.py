@@ -0,0 +1,44 @@
+import numpy as np
+import numpy.typing as npt
+
+EARTH_RADIUS_KM = 6371.0088
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+
+FloatArray = npt.NDArray[np.float64]
+Coordinates = FloatArray | float
+
+
+def central_angle(lat1: FloatArray, lon1: FloatArray, lat2: FloatArray, lon2: FloatArray) -> FloatArray:
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * np.arcsin(np.sqrt(a))
+
+
+def haversine(lat1: Coordinates, lon1: Coordinates, lat2: Coordinates, lon2: Coordinates) -> FloatArray:
+    return EARTH_RADIUS_KM * central_angle(np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2))
+
+
+def lambert(lat1: Coordinates, lon1: Coordinates, lat2: Coordinates, lon2: Coordinates) -> FloatArray:
+    # Lambert's formula on the WGS-84 ellipsoid. Against geopy's geodesic it is within a metre across the city
+    # and about 10 metres for the (0, 0) coordinates, at a fraction of the cost of Vincenty's iteration.
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sigma = central_angle(beta1, np.radians(lon1), beta2, np.radians(lon2))
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * (np.sin(p) * np.cos(q)) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * (np.cos(p) * np.sin(q)) ** 2 / np.sin(sigma / 2) ** 2
+
+    return np.where(sigma == 0, 0.0, WGS84_A * (sigma - WGS84_F / 2 * (x + y)))
+
+
+def geodesic(
+    latitude: FloatArray, longitude: FloatArray, origin: tuple[float, float], ellipsoidal: bool = True
+) -> FloatArray:
+    if ellipsoidal:
+        return lambert(latitude, longitude, origin[0], origin[1])
+
+    return haversine(latitude, longitude, origin[0], origin[1])
@@ -0,0 +1,110 @@
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+import storage
+from common import MEASURES, NY_CENTER, replace_parquet
+from dataset import CLEAN_MAP_PATH, scan_dataset
+from geodesic import FloatArray
+
+PYRAMID_PATH = "data/hexbin.parquet"
+
+# Circumradius of the hexagons of every level in kilometres, each level halves the one before it.
+HEX_SIZES_KM = [4.0, 2.0, 1.0, 0.5, 0.25]
+# Zoom at which level 0 is drawn, every further zoom step moves one level down.
+BASE_ZOOM = 10
+
+# An equirectangular projection around the city is accurate to well under a percent across the five boroughs.
+KM_PER_DEGREE_LATITUDE = 110.574
+KM_PER_DEGREE_LONGITUDE = 111.320 * math.cos(math.radians(NY_CENTER[0]))
+
+IntArray = npt.NDArray[np.int32]
+
+
+def project(latitude: FloatArray, longitude: FloatArray) -> tuple[FloatArray, FloatArray]:
+    x = (longitude - NY_CENTER[1]) * KM_PER_DEGREE_LONGITUDE
+    y = (latitude - NY_CENTER[0]) * KM_PER_DEGREE_LATITUDE
+
+    return x, y
+
+
+def unproject(x: FloatArray, y: FloatArray) -> tuple[FloatArray, FloatArray]:
+    return NY_CENTER[0] + y / KM_PER_DEGREE_LATITUDE, NY_CENTER[1] + x / KM_PER_DEGREE_LONGITUDE
+
+
+def hex_cells(latitude: FloatArray, longitude: FloatArray, size: float) -> tuple[IntArray, IntArray]:
+    # Axial coordinates of pointy top hexagons, rounded through cube coordinates.
+    x, y = project(latitude, longitude)
+    q = (math.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    rq = np.where((dq > dr) & (dq > ds), -rr - rs, rq)
+    rr = np.where((dr > ds) & ~((dq > dr) & (dq > ds)), -rq - rs, rr)
+
+    return rq.astype(np.int32), rr.astype(np.int32)
+
+
+def hex_boundaries(q: IntArray, r: IntArray, size: float) -> tuple[FloatArray, FloatArray]:
+    x = size * math.sqrt(3) * (q + r / 2)
+    y = size * 1.5 * r
+    angles = np.radians(30 + 60 * np.arange(7))
+
+    return unproject(x[:, None] + size * np.cos(angles), y[:, None] + size * np.sin(angles))
+
+
+def zoom_level(zoom: int) -> int:
+    return min(max(zoom - BASE_ZOOM, 0), len(HEX_SIZES_KM) - 1)
+
+
+def bin_points(points: pl.DataFrame) -> pl.DataFrame:
+    latitude = points["latitude"].to_numpy()
+    longitude = points["longitude"].to_numpy()
+
+    levels = []
+    for level, size in enumerate(HEX_SIZES_KM):
+        q, r = hex_cells(latitude, longitude, size)
+        cells = points.with_columns(pl.lit(level, dtype=pl.UInt8).alias("level"), pl.Series("q", q), pl.Series("r", r))
+        levels.append(
+            cells.group_by("level", "q", "r", "year", "month").agg(
+                pl.col(MEASURES).sum(), pl.len().cast(pl.UInt32).alias("number_of_crash")
+            )
+        )
+
+    return pl.concat(levels)
+
+
+def build_pyramid(
+    source: str | Path = CLEAN_MAP_PATH, output: str | Path = PYRAMID_PATH, years: list[int] | None = None
+) -> int:
+    # Binned a year at a time, an append passes the years it touched and the rest of the pyramid is kept.
+    data = scan_dataset(source).filter(pl.col("latitude").is_not_null(), pl.col("longitude").is_not_null())
+    pyramid = []
+    if years is None:
+        years = data.select(pl.col("year").unique().drop_nulls()).collect().to_series().to_list()
+    elif os.path.exists(output):
+        pyramid.append(pl.read_parquet(output).filter(~pl.col("year").is_in(years)))
+
+    points = data.select("latitude", "longitude", "year", "month", *MEASURES)
+    for year in years:
+        pyramid.append(bin_points(points.filter(pl.col("year").eq(year)).collect()))
+    if not pyramid:
+        # Without a located crash the pyramid is still written, empty.
+        pyramid.append(bin_points(points.head(0).collect()))
+
+    result = pl.concat(pyramid).sort(by=["level", "year", "month", "q", "r"])
+    replace_parquet(result, str(output))
+
+    return result.shape[0]
+
+
+def load_cells(level: int, start: int, end: int, column: str, path: str | Path = PYRAMID_PATH) -> pl.DataFrame:
+    cells = storage.scan(path).filter(pl.col("level").eq(level), pl.col("year").is_between(start, end))
+
+    return cells.group_by("q", "r").agg(pl.col(column).sum()).filter(pl.col(column) > 0).collect()
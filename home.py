@@ -1,7 +1,17 @@
-import altair
 import streamlit as st
 
 st.set_page_config(page_title="NY Motor Vehicles Crash", layout="wide")
+
+import warmup  # noqa: E402
+
+warmup.start()
+
+# A hidden page, home.py?diagnostics on servers started with DIAGNOSTICS=1.
+if "diagnostics" in st.query_params:
+    import diagnostics
+
+    diagnostics.show()
+
 st.title("12 Years of New York Motor Vehicles Crash: Statistics and Interactive Visualizations")
 
 ""
@@ -26,9 +36,6 @@ st.markdown(
 url = "https://data.cityofnewyork.us/Public-Safety/Motor-Vehicle-Collisions-Crashes/h9gi-nx95/about_data"
 
 
-altair.themes.enable("dark")
-
-
 tabs = st.tabs(["Learn More About Dataset", "Data Cleaning policy"])
 with tabs[0]:
     st.link_button(label="New York Motor Vehicles Collisions and Crashes, Public Safety by NYPD", url=url)
@@ -58,4 +65,6 @@ with tabs[1]:
     st.markdown(
         "* <10 locations had distances more than 3-5 times the average and showed up outside the map of New York. They were also considered invalid."
     )
-    st.markdown("* Incorrectly labeled locations e.g. a crash occuring in Queens labeled as Bronx weren't discarded.")
+    st.markdown(
+        "* Every location is checked against the borough boundaries. Incorrectly labeled locations e.g. a crash occuring in Queens labeled as Bronx are flagged rather than discarded."
+    )
@@ -0,0 +1,552 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pyarrow.parquet as pq
+
+import storage
+from catalog import persist_catalog, read_catalog
+from cleaner import sanitize
+from common import (
+    BOROUGH_CODES,
+    CUBOIDS,
+    MEASURES,
+    cuboid_keys,
+    map_coordinates,
+    merge_cuboid,
+    persist_data_bitmask,
+    replace_parquet,
+)
+from dataset import PARTITIONS, replace_partitions, scan_dataset, write_dataset
+from geodesic import FloatArray, geodesic
+from hexbin import build_pyramid
+from query import query, refresh_aggregates
+from rolling import build_rolling, update_rolling
+from spatial import load_borough_index, validate_boroughs
+from summary import persist_summary
+
+NY_REFERENCE = (40.7128, -74.0060)
+INVALID_DISTANCE_KM = 530
+OUTLIER_FACTOR = 3
+BATCH_SIZE = 1 << 18
+
+CASUALTY_COLUMNS = ["number_of_persons_injured", "number_of_persons_killed"]
+DROPPED_COLUMNS = ["crash_date", "crash_time", "location"]
+METRIC_KEYS = ["borough", "year"]
+MAP_COLUMNS = [
+    "collision_id",
+    "date",
+    "borough",
+    "latitude",
+    "longitude",
+    "month",
+    "year",
+    "time",
+    "hour",
+    "coordinate",
+    "number_of_persons_injured",
+    "number_of_persons_killed",
+    "number_of_casualty",
+    "distance",
+    "code",
+    "geo_code",
+    "mislabeled",
+]
+
+
+def scan_raw(source: str) -> pl.LazyFrame:
+    if source.endswith(".csv"):
+        raw = pl.scan_csv(source, infer_schema_length=10000)
+    else:
+        raw = pl.scan_parquet(source)
+
+    return raw.rename(lambda col: sanitize(col, lower=True))
+
+
+def process(raw: pl.LazyFrame) -> pl.LazyFrame:
+    columns = raw.collect_schema().names()
+    dropped = [col for col in columns if "vehicle" in col or "street" in col or col in DROPPED_COLUMNS]
+
+    processed = raw.with_columns(
+        pl.col("crash_date").str.to_date("%m/%d/%Y").alias("date"),
+        pl.col("crash_time").str.to_time("%H:%M").alias("time"),
+    )
+    processed = processed.with_columns(
+        pl.col("date").dt.year().alias("year"),
+        pl.col("date").dt.month().alias("month"),
+        pl.col("time").dt.hour().alias("hour"),
+        pl.col("date").dt.weekday().alias("weekday"),
+        pl.sum_horizontal(CASUALTY_COLUMNS).alias("number_of_casualty"),
+        pl.col("borough").replace_strict(BOROUGH_CODES, default=None, return_dtype=pl.Int8).alias("code"),
+    )
+
+    return processed.drop(dropped)
+
+
+def distance(ellipsoidal: bool = True) -> pl.Expr:
+    def kernel(latitude: FloatArray, longitude: FloatArray) -> pl.Series:
+        return pl.Series(geodesic(latitude, longitude, origin=NY_REFERENCE, ellipsoidal=ellipsoidal))
+
+    return map_coordinates(kernel, dtype=pl.Float64())
+
+
+def coordinate() -> pl.Expr:
+    def kernel(latitude: FloatArray, longitude: FloatArray) -> pl.Series:
+        return pl.Series(np.column_stack([latitude, longitude])).cast(pl.List(pl.Float64))
+
+    return map_coordinates(kernel, dtype=pl.List(pl.Float64))
+
+
+def locate(processed: pl.LazyFrame, ellipsoidal: bool = True) -> pl.LazyFrame:
+    located = processed.drop_nulls(subset=["latitude", "longitude", "borough"] + CASUALTY_COLUMNS)
+
+    return located.with_columns(
+        coordinate().alias("coordinate"),
+        distance(ellipsoidal=ellipsoidal).alias("distance"),
+    )
+
+
+def outlier_threshold(located: pl.LazyFrame) -> float:
+    # (0, 0) and similar placeholders are thousands of kilometres away and would inflate the mean,
+    # so the mean is taken over plausible distances only.
+    plausible = located.select("distance").filter(pl.col("distance") <= INVALID_DISTANCE_KM)
+    mean = plausible.select(pl.col("distance").mean()).collect(streaming=True).item()
+    if mean is None:
+        return INVALID_DISTANCE_KM
+
+    return min(INVALID_DISTANCE_KM, OUTLIER_FACTOR * mean)
+
+
+def clean_map(located: pl.LazyFrame, threshold: float) -> pl.LazyFrame:
+    return located.filter(pl.col("distance") <= threshold).select(MAP_COLUMNS)
+
+
+def invalid_coordinate(located: pl.LazyFrame, threshold: float) -> pl.LazyFrame:
+    return located.filter(pl.col("distance") > threshold).drop("coordinate")
+
+
+def reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", mode="w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1 << 20)
+
+    return peak / 1024
+
+
+def count_rows(path: str) -> int:
+    if os.path.isdir(path):
+        return scan_dataset(path).select(pl.len()).collect().item()
+
+    return pl.scan_parquet(path).select(pl.len()).collect().item()
+
+
+def report(name: str, rows: int, elapsed: float, written: int) -> None:
+    print(
+        f"{name:<20} {rows:>12,} rows in {elapsed:8.2f}s {rows / max(elapsed, 1e-9):>14,.0f} rows/s "
+        f"{written:>12,} written, peak rss {peak_rss_mb():,.1f} MB"
+    )
+
+
+def run_stage(name: str, frame: pl.LazyFrame, path: str, rows: int | None = None) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    partial = f"{path}.partial"
+    frame.sink_parquet(partial)
+    os.replace(partial, path)
+    elapsed = time.perf_counter() - start
+
+    written = count_rows(path)
+    if rows is None:
+        rows = written
+
+    report(name=name, rows=rows, elapsed=elapsed, written=written)
+
+
+def clean_coordinates(source: str, directory: Path, ellipsoidal: bool = True) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    threshold = outlier_threshold(locate(pl.scan_parquet(source), ellipsoidal=ellipsoidal))
+
+    writers: dict[str, pq.ParquetWriter] = {}
+    rows = written = 0
+    parquet = pq.ParquetFile(source)
+    # A source without rows has no batch, one empty table still writes both files with their schema.
+    batches = (
+        parquet.iter_batches(batch_size=BATCH_SIZE)
+        if parquet.metadata.num_rows
+        else [parquet.schema_arrow.empty_table()]
+    )
+    for batch in batches:
+        rows += batch.num_rows
+        located = locate(pl.DataFrame(pl.from_arrow(batch)).lazy(), ellipsoidal=ellipsoidal).collect().lazy()
+
+        for name, frame in [
+            ("clean_map", clean_map(located, threshold)),
+            ("invalid_coordinate", invalid_coordinate(located, threshold)),
+        ]:
+            table = frame.collect().to_arrow()
+            if name not in writers:
+                writers[name] = pq.ParquetWriter(str(directory / f"{name}.parquet.partial"), table.schema)
+            writers[name].write_table(table)
+            written += table.num_rows
+
+    for name, writer in writers.items():
+        writer.close()
+        os.replace(directory / f"{name}.parquet.partial", directory / f"{name}.parquet")
+
+    report(name="clean_coordinates", rows=rows, elapsed=time.perf_counter() - start, written=written)
+
+
+def partition_stage(name: str, path: str, directory: Path) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    partitioned = str(directory / name)
+    write_dataset(pl.scan_parquet(path), partitioned)
+    os.remove(path)
+
+    rows = count_rows(partitioned)
+    report(name=f"partition {name}", rows=rows, elapsed=time.perf_counter() - start, written=rows)
+
+
+def pyramid_stage(directory: Path, years: list[int] | None = None) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    source = directory / "clean_map"
+    cells = build_pyramid(source, output=directory / "hexbin.parquet", years=years)
+    binned = scan_dataset(source)
+    if years is not None:
+        binned = binned.filter(pl.col("year").is_in(years))
+    rows = binned.select(pl.len()).collect().item()
+
+    report(name="hexbin", rows=rows, elapsed=time.perf_counter() - start, written=cells)
+
+
+def aggregates_stage(directory: Path) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    refreshed = refresh_aggregates(str(directory))
+
+    report(
+        name="aggregates",
+        rows=count_rows(str(directory / "processed")),
+        elapsed=time.perf_counter() - start,
+        written=refreshed,
+    )
+
+
+def rolling_stage(directory: Path, since: date | None = None) -> None:
+    # Built from the daily cuboid, an append recomputes the days from since on.
+    reset_peak_rss()
+    start = time.perf_counter()
+    path = directory / "rolling.parquet"
+    if since is None:
+        rows = build_rolling(path=path, directory=str(directory))
+    else:
+        rows = update_rolling(since, path=path, directory=str(directory))
+
+    report(name="rolling", rows=rows, elapsed=time.perf_counter() - start, written=rows)
+
+
+def summary_stage(directory: Path) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    processed = str(directory / "processed")
+    persist_summary(scan_dataset(processed), path=directory / "summary.json")
+    rows = count_rows(processed)
+
+    report(name="summary", rows=rows, elapsed=time.perf_counter() - start, written=1)
+
+
+def ipc_stage(directory: Path) -> None:
+    if storage.BACKEND != "ipc":
+        return
+    reset_peak_rss()
+    start = time.perf_counter()
+    converted = storage.convert(directory)
+    rows = sum(pq.read_metadata(path).num_rows for path in converted)
+
+    report(name="ipc", rows=rows, elapsed=time.perf_counter() - start, written=len(converted))
+
+
+def catalog_stage(directory: Path) -> None:
+    # The artifacts the build catalogued are described again, pages read their bounds from it.
+    path = directory / "catalog.json"
+    if not path.exists():
+        return
+    reset_peak_rss()
+    start = time.perf_counter()
+    described = persist_catalog(path=path)
+    rows = sum(entry.get("rows", 0) for entry in read_catalog(path).values())
+
+    report(name="catalog", rows=rows, elapsed=time.perf_counter() - start, written=described)
+
+
+def report_mislabeled(path: str, correct: bool) -> None:
+    mislabeled = pl.scan_parquet(path).select(pl.col("mislabeled").sum()).collect().item()
+    print(
+        f"{'mislabeled':<20} {mislabeled:>12,} rows {'corrected' if correct else 'flagged'} against borough boundaries"
+    )
+
+
+def processed_stage(source: str, directory: Path, ellipsoidal: bool = True, correct: bool = False) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    staging_path = str(directory / "processed.parquet")
+
+    index = load_borough_index()
+    run_stage("processed", validate_boroughs(process(scan_raw(source)), index=index, correct=correct), staging_path)
+    report_mislabeled(staging_path, correct=correct)
+    clean_coordinates(staging_path, directory=directory, ellipsoidal=ellipsoidal)
+    for name in ["processed", "clean_map"]:
+        partition_stage(name, str(directory / f"{name}.parquet"), directory=directory)
+
+
+def cuboids_stage(directory: Path) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    processed = str(directory / "processed")
+    for by in CUBOIDS:
+        persist_data_bitmask(scan_dataset(processed), by=by, on=MEASURES, directory=directory)
+
+    report(
+        name="cuboids",
+        rows=count_rows(processed),
+        elapsed=time.perf_counter() - start,
+        written=len(cuboid_keys(CUBOIDS)),
+    )
+
+
+def metrics_stage(directory: Path) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    data = scan_dataset(directory / "processed")
+    marked = pl.col("latitude").is_not_null() & pl.col("longitude").is_not_null()
+    timed = pl.all_horizontal(pl.col(["date", "borough", "time", "latitude", "longitude"]).is_not_null())
+    counts = data.select(
+        marked.sum().alias("marked"),
+        pl.len().alias("total"),
+        timed.sum().alias("timed"),
+        pl.col("number_of_persons_killed").sum().alias("killed"),
+        pl.col("number_of_persons_injured").sum().alias("injured"),
+    ).collect()
+    marked_rows, total, timed_rows, killed, injured = counts.row(0)
+    invalid = count_rows(str(directory / "invalid_coordinate.parquet"))
+
+    # Same keys in the same order as the metrics notebook wrote them.
+    metrics = {
+        "Locations marked": marked_rows,
+        "Locations unmarked": total - marked_rows,
+        "Valid markings": marked_rows - invalid,
+        "Invalid markings": invalid,
+        "Total number of crashes": total,
+        "Crashes with time, location": timed_rows,
+        "Total killed": killed,
+        "Total injured": injured,
+    }
+    path = directory / "metrics.json"
+    with open(f"{path}.partial", mode="w") as f:
+        json.dump(metrics, f)
+    os.replace(f"{path}.partial", path)
+
+    report(name="metrics", rows=total, elapsed=time.perf_counter() - start, written=1)
+
+
+def ingest(source: str, output: str = "data", ellipsoidal: bool = True, correct: bool = False) -> None:
+    directory = Path(output)
+    processed_stage(source, directory=directory, ellipsoidal=ellipsoidal, correct=correct)
+    cuboids_stage(directory)
+    for key in METRIC_KEYS:
+        persist_metrics(key, output=directory)
+    metrics_stage(directory)
+    pyramid_stage(directory)
+    aggregates_stage(directory)
+    rolling_stage(directory)
+    summary_stage(directory)
+    catalog_stage(directory)
+    ipc_stage(directory)
+
+
+def load_changes(processed_path: str, delta: pl.DataFrame) -> pl.DataFrame:
+    previous = (
+        scan_dataset(processed_path)
+        .filter(pl.col("collision_id").is_in(delta["collision_id"]))
+        .select(delta.columns)
+        .collect()
+    )
+
+    return pl.concat(
+        [
+            previous.with_columns(pl.lit(-1, dtype=pl.Int8).alias("sign")),
+            delta.with_columns(pl.lit(1, dtype=pl.Int8).alias("sign")),
+        ]
+    )
+
+
+def replace_rows(path: str, delta: pl.LazyFrame, ids: pl.Series) -> pl.LazyFrame:
+    existing = pl.scan_parquet(path)
+    schema = existing.collect_schema()
+
+    return pl.concat(
+        [
+            existing.filter(~pl.col("collision_id").is_in(ids)),
+            delta.select(pl.col(name).cast(dtype) for name, dtype in schema.items()),
+        ]
+    )
+
+
+def partition_stage_rows(name: str, path: str, delta: pl.DataFrame, ids: pl.Series, partitions: pl.DataFrame) -> None:
+    reset_peak_rss()
+    start = time.perf_counter()
+    replace_partitions(path, delta, ids=ids, partitions=partitions)
+    elapsed = time.perf_counter() - start
+
+    report(
+        name=f"{name} ({partitions.shape[0]} partitions)",
+        rows=delta.shape[0],
+        elapsed=elapsed,
+        written=count_rows(path),
+    )
+
+
+def summarize(changes: pl.DataFrame, threshold: float) -> dict[str, int]:
+    sign = pl.col("sign")
+    marked = pl.col("latitude").is_not_null() & pl.col("longitude").is_not_null()
+    timed = pl.all_horizontal(pl.col(["date", "borough", "time", "latitude", "longitude"]).is_not_null())
+
+    summary = changes.select(
+        (marked * sign).sum().alias("Locations marked"),
+        sign.sum().alias("Total number of crashes"),
+        (timed * sign).sum().alias("Crashes with time, location"),
+        (pl.col("number_of_persons_killed") * sign).sum().alias("Total killed"),
+        (pl.col("number_of_persons_injured") * sign).sum().alias("Total injured"),
+    ).row(0, named=True)
+    invalid = invalid_coordinate(locate(changes.lazy()), threshold=threshold)
+    summary["Invalid markings"] = invalid.select(sign.sum()).collect().item()
+
+    return summary
+
+
+def update_metrics(path: str, changes: pl.DataFrame, threshold: float) -> None:
+    with open(path) as f:
+        metrics = json.load(f)
+
+    for key, value in summarize(changes, threshold=threshold).items():
+        metrics[key] += value
+    metrics["Locations unmarked"] = metrics["Total number of crashes"] - metrics["Locations marked"]
+    metrics["Valid markings"] = metrics["Locations marked"] - metrics["Invalid markings"]
+
+    # Pages read the file while it is updated, so it is replaced whole rather than rewritten in place.
+    with open(f"{path}.partial", mode="w") as f:
+        json.dump(metrics, f)
+    os.replace(f"{path}.partial", path)
+
+
+def persist_metrics(key: str, output: Path) -> None:
+    data = query(dimensions=[key], directory=str(output))
+
+    cumulative = data.select(
+        key,
+        "number_of_persons_killed",
+        "number_of_persons_injured",
+        pl.col("number_of_crash").alias("count"),
+        "number_of_casualty",
+    )
+    replace_parquet(cumulative.with_columns(pl.exclude(key).cum_sum()), str(output / f"cumulative_{key}.parquet"))
+    replace_parquet(data.select(key, *MEASURES), str(output / f"metrics_{key}.parquet"))
+
+
+def append(source: str, output: str = "data", ellipsoidal: bool = True, correct: bool = False) -> None:
+    directory = Path(output)
+    processed_path = str(directory / "processed")
+    if "collision_id" not in scan_dataset(processed_path).collect_schema():
+        raise ValueError(f"{processed_path} has no collision_id, rebuild it with a full ingestion first")
+
+    start = time.perf_counter()
+    latest = process(scan_raw(source)).unique(subset="collision_id", keep="last", maintain_order=True)
+    delta = validate_boroughs(latest, index=load_borough_index(), correct=correct).collect()
+    changes = load_changes(processed_path, delta)
+    ids = delta["collision_id"]
+    report(name="delta", rows=delta.shape[0], elapsed=time.perf_counter() - start, written=changes.shape[0])
+
+    # A late correction can move a crash to another year or borough, so both its old and new partitions are rewritten.
+    partitions = changes.select(PARTITIONS).unique()
+    partition_stage_rows("processed", processed_path, delta, ids=ids, partitions=partitions)
+    threshold = outlier_threshold(locate(scan_dataset(processed_path), ellipsoidal=ellipsoidal))
+    located = locate(delta.lazy(), ellipsoidal=ellipsoidal)
+    partition_stage_rows(
+        "clean_map",
+        str(directory / "clean_map"),
+        clean_map(located, threshold).collect(),
+        ids=ids,
+        partitions=partitions,
+    )
+    path = str(directory / "invalid_coordinate.parquet")
+    run_stage(
+        "invalid_coordinate", replace_rows(path, invalid_coordinate(located, threshold), ids), path, rows=delta.shape[0]
+    )
+
+    reset_peak_rss()
+    start = time.perf_counter()
+    cuboids = cuboid_keys(CUBOIDS)
+    for keys in cuboids:
+        merge_cuboid(changes, keys=keys, on=MEASURES, directory=directory)
+    for key in METRIC_KEYS:
+        persist_metrics(key, output=directory)
+    update_metrics(str(directory / "metrics.json"), changes=changes, threshold=threshold)
+    refreshed = refresh_aggregates(str(directory))
+    report(
+        name="aggregates", rows=changes.shape[0], elapsed=time.perf_counter() - start, written=len(cuboids) + refreshed
+    )
+    pyramid_stage(directory, years=partitions["year"].drop_nulls().unique().to_list())
+    # Rolling series are kept per day, a delta of undated crashes changes none of them.
+    since = changes.select(pl.col("date").min()).item()
+    if since is not None:
+        rolling_stage(directory, since=since)
+    summary_stage(directory)
+    catalog_stage(directory)
+    ipc_stage(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the raw NYPD motor vehicle collisions export.")
+    parser.add_argument("source", help="Raw export as csv or parquet e.g. data/vehicle_crash.parquet")
+    parser.add_argument("--output", default="data", help="Directory to write processed data into")
+    parser.add_argument(
+        "--append", action="store_true", help="Merge a daily delta keyed on collision_id into existing data"
+    )
+    parser.add_argument(
+        "--correct-boroughs",
+        action="store_true",
+        help="Replace boroughs that disagree with the borough boundaries instead of only flagging them",
+    )
+    parser.add_argument(
+        "--spherical", action="store_true", help="Use haversine distances instead of the WGS-84 ellipsoid"
+    )
+    args = parser.parse_args()
+
+    if args.append:
+        append(source=args.source, output=args.output, ellipsoidal=not args.spherical, correct=args.correct_boroughs)
+    else:
+        ingest(source=args.source, output=args.output, ellipsoidal=not args.spherical, correct=args.correct_boroughs)
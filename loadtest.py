@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from collections.abc import Callable
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import Any
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ClientState_pb2 import ClientState
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetStates
+from streamlit.runtime.state.common import TESTING_KEY
+from streamlit.testing.v1.element_tree import ElementTree, InitialValue, Widget, parse_tree_from_messages
+from tornado.websocket import WebSocketClientConnection, websocket_connect
+
+from catalog import bounds
+from common import BOROUGHS, options
+
+# Page names are the url paths of the pages, the home page has none.
+PAGES = {"home": "", "report": "Report", "charts": "Charts", "maps": "Maps", "metrics": "Metrics"}
+SESSIONS = 8
+STEPS = 10
+PORT = 8600
+TIMEOUT = 300
+STARTUP_TIMEOUT = 60
+PERCENTILES = [50, 95, 99]
+# Longest date range a Maps session picks, in days.
+MAX_RANGE_DAYS = 7
+CRITERIA = ["year", "borough", "month", "hour", "weekday", "victim"]
+
+Action = Callable[[ElementTree, random.Random], None]
+Rerun = tuple[str, str, float, bool]
+
+
+def labelled(elements: Any, label: str) -> Any:
+    return next(element for element in elements if element.label == label)
+
+
+def toggle_borough(tree: ElementTree, rng: random.Random) -> None:
+    boroughs = labelled(tree.multiselect, "Boroughs you want to check")
+    borough = rng.choice(BOROUGHS)
+    if borough in boroughs.value and len(boroughs.value) > 1:
+        boroughs.unselect(borough)
+    else:
+        boroughs.select(borough)
+
+
+def filter_by(tree: ElementTree, rng: random.Random) -> None:
+    labelled(tree.sidebar.selectbox, "Filter by").set_value(rng.choice(options))
+
+
+def move_dates(tree: ElementTree, rng: random.Random) -> None:
+    minimum, maximum, _ = bounds("date")
+    start = minimum + timedelta(days=rng.randrange((maximum - minimum).days - MAX_RANGE_DAYS))
+    labelled(tree.sidebar.slider, "Pick a date range").set_value(
+        (start, start + timedelta(days=rng.randrange(MAX_RANGE_DAYS)))
+    )
+
+
+def check_criterion(tree: ElementTree, rng: random.Random) -> None:
+    labelled(tree.checkbox, f"Choose {rng.choice(CRITERIA)}?").check()
+
+
+def pick_criterion(tree: ElementTree, rng: random.Random) -> None:
+    picked = [selectbox for selectbox in tree.selectbox if selectbox.label.removeprefix("Select ") in CRITERIA]
+    if picked:
+        criteria = rng.choice(picked)
+        criteria.select_index(rng.randrange(len(criteria.options)))
+
+
+def uncheck_criterion(tree: ElementTree, rng: random.Random) -> None:
+    checked = [checkbox for checkbox in tree.checkbox if checkbox.label.startswith("Choose ") and checkbox.value]
+    if checked:
+        rng.choice(checked).uncheck()
+
+
+# Steps of a session on every page, repeated in order. A step changes widgets and the rerun it causes is timed.
+SCRIPTS: dict[str, list[tuple[str, Action]]] = {
+    "home": [],
+    "report": [],
+    "charts": [("toggle borough", toggle_borough), ("filter by", filter_by)],
+    "maps": [("move dates", move_dates)],
+    "metrics": [
+        ("check criterion", check_criterion),
+        ("pick criterion", pick_criterion),
+        ("uncheck criterion", uncheck_criterion),
+    ],
+}
+
+
+class Values:
+    # Stands in for the session state the elements of a tree read their values from when they run under AppTest. A
+    # widget has the last value the session gave it, or else the default it was drawn with. Options are shown as they
+    # are, which holds for the widgets the scripts change.
+    def __init__(self, tree: ElementTree, values: dict[str, Any]) -> None:
+        self.values = values
+        self.defaults: dict[str, Any] = {checkbox.id: checkbox.proto.default for checkbox in tree.checkbox}
+        self.defaults.update(
+            {
+                multiselect.id: [multiselect.options[index] for index in multiselect.proto.default]
+                for multiselect in tree.multiselect
+            }
+        )
+
+    def __getitem__(self, key: str) -> Any:
+        if key == TESTING_KEY:
+            return defaultdict(lambda: str)
+
+        return self.values[key] if key in self.values else self.defaults[key]
+
+
+class Session:
+    # A headless browser tab. Every rerun sends the values of the widgets the last step changed and waits for the script
+    # to finish, the server keeps the values of the others from the run before.
+    def __init__(self, connection: WebSocketClientConnection, page: str) -> None:
+        self.connection = connection
+        self.page = page
+        self.values: dict[str, Any] = {}
+        self.tree = self.parse([])
+        self.cache: dict[str, ForwardMsg] = {}
+
+    def parse(self, messages: list[ForwardMsg]) -> ElementTree:
+        tree = parse_tree_from_messages(messages)
+        tree._runner = SimpleNamespace(session_state=Values(tree, values=self.values))  # type: ignore [assignment]
+
+        return tree
+
+    def changed(self) -> WidgetStates:
+        states = WidgetStates()
+        for node in self.tree:
+            if isinstance(node, Widget) and node._value is not None and not isinstance(node._value, InitialValue):
+                self.values[node.id] = node._value
+                states.widgets.append(node._widget_state)
+
+        return states
+
+    @classmethod
+    async def connect(cls, url: str, page: str) -> "Session":
+        return cls(await websocket_connect(f"{url.replace('http', 'ws', 1)}/_stcore/stream"), page=page)
+
+    async def receive(self) -> ForwardMsg:
+        payload = await self.connection.read_message()
+        if payload is None:
+            raise ConnectionError("The server closed the session")
+        msg = ForwardMsg()
+        msg.ParseFromString(payload)
+        if msg.WhichOneof("type") == "ref_hash":
+            # Large messages already sent to the session are replaced by their hash.
+            reference = msg
+            msg = ForwardMsg()
+            msg.CopyFrom(self.cache[reference.ref_hash])
+            msg.metadata.CopyFrom(reference.metadata)
+        elif msg.hash:
+            self.cache[msg.hash] = msg
+
+        return msg
+
+    async def run(self, timeout: float = TIMEOUT) -> tuple[float, bool]:
+        state = ClientState(page_name=PAGES[self.page], widget_states=self.changed())
+        start = time.perf_counter()
+        await self.connection.write_message(BackMsg(rerun_script=state).SerializeToString(), binary=True)
+
+        messages = []
+        async with asyncio.timeout(timeout):
+            while (msg := await self.receive()).WhichOneof("type") != "script_finished":
+                messages.append(msg)
+        elapsed = time.perf_counter() - start
+        self.tree = self.parse(messages)
+
+        return elapsed, msg.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY or len(self.tree.exception) > 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+async def run_session(url: str, page: str, steps: int, seed: int) -> list[Rerun]:
+    session = await Session.connect(url, page=page)
+    rng = random.Random(seed)
+    try:
+        elapsed, failed = await session.run()
+        reruns = [(page, "load", elapsed, failed)]
+        script = SCRIPTS[page]
+        for step in range(steps if script else 0):
+            name, action = script[step % len(script)]
+            action(session.tree, rng)
+            elapsed, failed = await session.run()
+            reruns.append((page, name, elapsed, failed))
+    finally:
+        session.close()
+
+    return reruns
+
+
+async def run_sessions(urls: list[str], pages: list[str], sessions: int, steps: int, seed: int) -> list[Rerun]:
+    # Sessions are spread over the servers and over the pages in turn, and all of them run at once.
+    runs = [
+        run_session(urls[session % len(urls)], pages[session % len(pages)], steps=steps, seed=seed + session)
+        for session in range(sessions)
+    ]
+
+    return [rerun for reruns in await asyncio.gather(*runs) for rerun in reruns]
+
+
+def start_server(port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            "home.py",
+            "--server.headless=true",
+            f"--server.port={port}",
+            "--browser.gatherUsageStats=false",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}/_stcore/health") as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+
+    raise TimeoutError(f"The server on port {port} did not start within {STARTUP_TIMEOUT}s")
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def report(reruns: list[Rerun], elapsed: float, peaks: list[float | None]) -> None:
+    groups: dict[tuple[str, str], list[float]] = {}
+    for page, name, seconds, _ in reruns:
+        groups.setdefault((page, name), []).append(seconds)
+    groups[("all", "")] = [seconds for _, _, seconds, _ in reruns]
+
+    header = " ".join(f"{f'p{percentile}':>9}" for percentile in PERCENTILES)
+    print(f"{'page':<10} {'step':<18} {'reruns':>7} {header}")
+    for (page, name), durations in groups.items():
+        values = " ".join(f"{value:8.3f}s" for value in np.percentile(durations, PERCENTILES))
+        print(f"{page:<10} {name:<18} {len(durations):>7} {values}")
+
+    failed = sum(failed for *_, failed in reruns)
+    print(f"{len(reruns)} reruns in {elapsed:.2f}s, {len(reruns) / elapsed:.2f} reruns/s, {failed} raised")
+    for server, peak in enumerate(peaks):
+        print(f"server {server} peak rss {'unknown' if peak is None else f'{peak:,.1f} MB'}")
+
+
+def load_test(
+    pages: list[str],
+    sessions: int = SESSIONS,
+    steps: int = STEPS,
+    processes: int = 1,
+    url: str | None = None,
+    seed: int = 0,
+) -> None:
+    # Every server process stands in for one node, so its peak memory is what a node needs for its sessions.
+    servers = [] if url else [start_server(PORT + process) for process in range(processes)]
+    urls = [url] if url else [f"http://localhost:{PORT + process}" for process in range(processes)]
+    try:
+        start = time.perf_counter()
+        reruns = asyncio.run(run_sessions(urls, pages=pages, sessions=sessions, steps=steps, seed=seed))
+        elapsed = time.perf_counter() - start
+        report(reruns, elapsed=elapsed, peaks=[peak_rss_mb(server.pid) for server in servers])
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run scripted concurrent sessions against the pages.")
+    parser.add_argument(
+        "--page", action="append", choices=list(PAGES), help="Page the sessions visit, repeat it for several pages"
+    )
+    parser.add_argument("--sessions", type=int, default=SESSIONS, help="Concurrent sessions in total")
+    parser.add_argument("--steps", type=int, default=STEPS, help="Scripted reruns of every session after loading")
+    parser.add_argument("--processes", type=int, default=1, help="Server processes to start and spread sessions over")
+    parser.add_argument("--url", help="Test a server that is already running instead of starting them")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_test(
+        args.page or list(PAGES),
+        sessions=args.sessions,
+        steps=args.steps,
+        processes=args.processes,
+        url=args.url,
+        seed=args.seed,
+    )
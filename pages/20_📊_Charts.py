@@ -1,14 +1,25 @@
 from enum import Enum
+from typing import Any
 
-import altair
-import plotly.express as px
 import polars as pl
 import streamlit as st
 from plotly.io import templates
 
 st.set_page_config(layout="wide")
 
-from common import MAXIMUMS, MEDIANS, MINIMUMS, options  # noqa: E402
+import warmup  # noqa: E402
+from cache import cached  # noqa: E402
+from catalog import bounds  # noqa: E402
+from common import Option, options  # noqa: E402
+from dataset import INDEX_NAME, PROCESSED_PATH, scan_filtered  # noqa: E402
+from downsample import downsample  # noqa: E402
+from export import download_button, format_selectbox  # noqa: E402
+from query import DIRECTORY, query  # noqa: E402
+from rolling import ROLLING_PATH, SeriesType, load_series  # noqa: E402
+from telemetry import begin_rerun, end_rerun, span  # noqa: E402
+
+warmup.start()
+begin_rerun("Charts")
 
 
 class ReportType(str, Enum):
@@ -25,11 +36,18 @@ class VisualizationType(str, Enum):
     BAR = "Bar"
 
 
-@st.cache_resource
-def load_time_data(boroughs: list[str], option: str) -> pl.DataFrame:
-    data = pl.read_parquet(f"data/borough__{option}.parquet")
+@cached(sources=[DIRECTORY])
+def load_time_base(option: str) -> pl.DataFrame:
+    return query(dimensions=["borough", option])
+
+
+def load_time_data(boroughs: list[str], option: str, start: Any, end: Any) -> pl.DataFrame:
+    data = load_time_base(option=option)
 
-    return data.filter(pl.col("borough").is_in(boroughs))
+    with span("filter", kind="transform"):
+        return data.filter(
+            pl.col("borough").is_in(boroughs), pl.col(option).is_between(lower_bound=start, upper_bound=end)
+        )
 
 
 columns = ["number_of_crash", "number_of_persons_killed", "number_of_persons_injured", "number_of_casualty"]
@@ -37,13 +55,25 @@ columns_readable = [col.capitalize().replace("_", " ") for col in columns]
 COLUMN_MAP = {col1: col2 for col1, col2 in zip(columns_readable, columns)}
 
 
-@st.cache_resource
-def load_cumulative(column: str) -> pl.DataFrame:
-    cumulative = pl.read_parquet(f"data/{column}.parquet")
-    for column in columns:
-        cumulative = cumulative.with_columns(pl.col(column).cum_sum().alias(column))
+@cached(sources=[ROLLING_PATH])
+def load_rolling(measure: str, series: str) -> pl.DataFrame:
+    return load_series(measure=measure, series=SeriesType(series))
+
 
-    return cumulative
+def load_rolling_data(boroughs: list[str], measure: str, series: str, start: Any, end: Any) -> pl.DataFrame:
+    data = load_rolling(measure=measure, series=series)
+
+    with span("filter", kind="transform"):
+        return data.filter(pl.col("borough").is_in(boroughs), pl.col("date").is_between(start, end)).drop_nulls(measure)
+
+
+def load_full_data(filters: list[pl.Expr]) -> pl.LazyFrame:
+    return scan_filtered(PROCESSED_PATH, filters, ipc=False)
+
+
+@cached(sources=[DIRECTORY])
+def load_cumulative(column: str) -> pl.DataFrame:
+    return query(dimensions=[column]).with_columns(pl.col(columns).cum_sum())
 
 
 boroughs = ["BRONX", "QUEENS", "BROOKLYN", "MANHATTAN", "STATEN ISLAND"]
@@ -57,10 +87,11 @@ selected_column = st.selectbox(label="Select", options=COLUMN_MAP.keys())
 column = COLUMN_MAP[selected_column]
 
 with st.sidebar:
-    reporting = st.selectbox(label="Output type", options=[ReportType.CHART.value, ReportType.DATAFRAME.value])
+    reporting = st.selectbox(label="Output type", options=[report_type.value for report_type in ReportType])
+    export_format = format_selectbox()
 
+    template = None
     if reporting == ReportType.CHART.value:
-        template = None
         choose_template = st.checkbox("Choose template?")
         if choose_template:
             template = st.selectbox(label="Template", options=templates)
@@ -73,42 +104,65 @@ if is_cumulative:
     data = cumulative.select(by, column)
 
     if reporting == ReportType.CHART.value:
-        chart = px.bar(
-            data_frame=data,
-            x=by,
-            y=column,
-            template=template,
-            labels=[by, column.capitalize().replace("_", " ")],
-            text_auto=True,
-            color=by,
-        )
-        st.plotly_chart(chart)
+        # plotly.express takes over half a second to import, it is only loaded once a chart is drawn with it.
+        import plotly.express as px
+
+        with span("Bar", kind="chart"):
+            chart = px.bar(
+                data_frame=data,
+                x=by,
+                y=column,
+                template=template,
+                labels=[by, column.capitalize().replace("_", " ")],
+                text_auto=True,
+                color=by,
+            )
+        with span("plotly_chart", kind="render"):
+            st.plotly_chart(chart)
     elif reporting == ReportType.DATAFRAME.value:
-        st.write(data)
+        with span("write", kind="render"):
+            st.write(data)
+    else:
+        download_button(
+            label="Prepare full data",
+            data=load_full_data(filters=[]),
+            file_name="crashes",
+            export_format=export_format,
+            key="full_data",
+            sources=[f"{PROCESSED_PATH}/{INDEX_NAME}"],
+        )
     with st.sidebar:
-        filename = f"cumulative_{by}_{column}.csv"
-        st.download_button(
+        download_button(
             label=f"""Download cumulative data of {by} by {column.replace("_", " ")}""",
-            data=data.to_pandas().to_csv(),
-            mime="text/csv",
-            file_name=filename,
+            data=data,
+            file_name=f"cumulative_{by}_{column}",
+            export_format=export_format,
+            key="cumulative",
+            sources=[DIRECTORY],
+            selection=(by, column),
         )
 else:
     with st.sidebar:
         option = st.selectbox(label="Filter by", options=options)
+        series = SeriesType.DAILY.value
+        if option == Option.DATE.value:
+            series = st.selectbox(label="Series", options=[series_type.value for series_type in SeriesType])
 
-    minimum = MINIMUMS[option]
-    maximum = MAXIMUMS[option]
-    value = (minimum, MEDIANS[option])
+    minimum, maximum, median = bounds(option)
+    value = (minimum, median)
 
     with st.sidebar:
         start_time, end_time = st.slider(f"Choose {option} range", minimum, maximum, value)  # type: ignore [call-overload]
 
     selected_boroughs = st.multiselect("Boroughs you want to check", boroughs, boroughs)
 
-    data = load_time_data(boroughs=selected_boroughs, option=option)
-    data = data.filter(pl.col(option).is_between(lower_bound=start_time, upper_bound=end_time))
     column = COLUMN_MAP[selected_column]
+    if series == SeriesType.DAILY.value:
+        data = load_time_data(boroughs=selected_boroughs, option=option, start=start_time, end=end_time)
+    else:
+        data = load_rolling_data(
+            boroughs=selected_boroughs, measure=column, series=series, start=start_time, end=end_time
+        )
 
     if reporting == ReportType.CHART.value:
         with st.sidebar:
@@ -122,30 +176,82 @@ else:
                     VisualizationType.AREA.value,
                 ],
             )
-        if visualization == VisualizationType.LINE.value:
-            px_chart = px.line(data_frame=data, x=option, y=column, color="borough", template=template)
-        elif visualization == VisualizationType.AREA.value:
-            px_chart = px.area(data_frame=data, x=option, y=column, color="borough", template=template)
-        elif visualization == VisualizationType.BAR.value:
-            px_chart = px.bar(data_frame=data, x=option, y=column, color="borough", template=template)
-        elif visualization == VisualizationType.CIRCLE.value:
-            px_chart = px.scatter(data_frame=data, x=option, y=column, color="borough", template=template, size=column)
-        else:
-            alt_chart = (
-                altair.Chart(data=data).mark_point().encode(x=option, y=column, color="borough", size=column)
-            ).interactive()
-            st.altair_chart(alt_chart, use_container_width=True)
+        # Daily series are reduced to the width of the chart, a narrower date range is sampled again at a finer
+        # resolution. Lines and markers are drawn with WebGL.
+        with span("downsample", kind="transform"):
+            chart_data = downsample(data, x=option, y=column) if option == Option.DATE.value else data
+        render_mode = "webgl" if option == Option.DATE.value else "auto"
+        import plotly.express as px
+
+        with span(visualization, kind="chart"):
+            if visualization == VisualizationType.LINE.value:
+                px_chart = px.line(
+                    data_frame=chart_data,
+                    x=option,
+                    y=column,
+                    color="borough",
+                    template=template,
+                    render_mode=render_mode,
+                )
+            elif visualization == VisualizationType.AREA.value:
+                px_chart = px.area(data_frame=chart_data, x=option, y=column, color="borough", template=template)
+            elif visualization == VisualizationType.BAR.value:
+                px_chart = px.bar(data_frame=chart_data, x=option, y=column, color="borough", template=template)
+            elif visualization == VisualizationType.CIRCLE.value:
+                # Year over year deltas go below zero and can not size markers.
+                size = column if chart_data.select(pl.col(column).min().fill_null(0)).item() >= 0 else None
+                px_chart = px.scatter(
+                    data_frame=chart_data,
+                    x=option,
+                    y=column,
+                    color="borough",
+                    template=template,
+                    size=size,
+                    render_mode=render_mode,
+                )
+            else:
+                import altair
+
+                altair.themes.enable("dark")
+                alt_chart = (
+                    altair.Chart(data=chart_data).mark_point().encode(x=option, y=column, color="borough", size=column)
+                ).interactive()
         if "px_chart" in locals():
-            st.plotly_chart(px_chart)
+            with span("plotly_chart", kind="render"):
+                st.plotly_chart(px_chart)
+        else:
+            with span("altair_chart", kind="render"):
+                st.altair_chart(alt_chart, use_container_width=True)
 
     elif reporting == ReportType.DATAFRAME.value:
         max_rows = 1000
         n_rows = st.number_input(label="Number of rows", min_value=1, max_value=max_rows, value=10)
         st.info(f"You can check at most {max_rows} rows here.", icon="ℹ️")
-        st.dataframe(data=data.head(n=n_rows))
+        with span("dataframe", kind="render"):
+            st.dataframe(data=data.head(n=n_rows))
+    else:
+        full_data = load_full_data(
+            filters=[pl.col("borough").is_in(selected_boroughs), pl.col(option).is_between(start_time, end_time)]
+        )
+        download_button(
+            label="Prepare full data of the selected boroughs and range",
+            data=full_data,
+            file_name=f'{"_".join([borough.lower().replace(" ", "_") for borough in selected_boroughs])}_{option}_{start_time}_{end_time}',
+            export_format=export_format,
+            key="full_data",
+            sources=[f"{PROCESSED_PATH}/{INDEX_NAME}"],
+        )
     with st.sidebar:
-        download_filename = f'{"_".join([borough.lower().replace(" ", "_") for borough in selected_boroughs])}_{selected_column}_{start_time}_{end_time}.csv'
-        st.download_button(
-            label="Download", data=data.to_pandas().to_csv(), mime="text/csv", file_name=download_filename
+        download_filename = f'{"_".join([borough.lower().replace(" ", "_") for borough in selected_boroughs])}_{selected_column}_{start_time}_{end_time}'
+        download_button(
+            label="Download",
+            data=data,
+            file_name=download_filename,
+            export_format=export_format,
+            key="time_data",
+            sources=[DIRECTORY],
+            selection=(selected_boroughs, column, option, series, start_time, end_time),
         )
     ""
+
+end_rerun()
@@ -1,25 +1,28 @@
 from datetime import date
 from enum import Enum
+from typing import TYPE_CHECKING
 
-import branca.colormap as cm
-import folium
-import folium.features
-import folium.map
-import geopandas as gpd
-import pandas as pd
+import numpy as np
 import polars as pl
 import streamlit as st
-from streamlit_folium import st_folium
-
-st.set_page_config(layout="wide")
 
+if TYPE_CHECKING:
+    import folium
+    import pandas as pd
 
-def form_mapfilename(col: str) -> str:
-    col = col.lower().strip().replace(" ", "_")
-    filename = f"data/maps/{col}.parquet"
+st.set_page_config(layout="wide")
 
-    return filename
+import warmup  # noqa: E402
+from cache import cached  # noqa: E402
+from catalog import bounds  # noqa: E402
+from common import NY_CENTER  # noqa: E402
+from dataset import CLEAN_MAP_PATH, INDEX_NAME, read_dates, read_index  # noqa: E402
+from export import download_button, format_selectbox  # noqa: E402
+from hexbin import BASE_ZOOM, HEX_SIZES_KM, PYRAMID_PATH, hex_boundaries, load_cells, zoom_level  # noqa: E402
+from telemetry import begin_rerun, end_rerun, span  # noqa: E402
 
+warmup.start()
+begin_rerun("Maps")
 
 COLOUR_RANGE = [[217, 20, 122, 200], [235, 100, 33, 200], [14, 166, 204, 200], [131, 28, 161, 200], [100, 10, 225, 220]]
 COLORS_CODE = ["#0044ff", "#ffaa00", "#00ff00", "#ff7f0e", "#2ca02c"]
@@ -49,6 +52,7 @@ boroughs = ["BRONX", "QUEENS", "BROOKLYN", "MANHATTAN", "STATEN ISLAND"]
 BOROUGH_CODES = {borough: code for borough, code in zip(boroughs, [2, 4, 3, 1, 5])}
 
 COLORS = ["darkred", "darkpurple", "blue", "darkblue", "purple"]
+DENSITY_SHADES = 9
 # np.random.seed = 10
 # COLORS = np.random.choice(ALL_COLORS, size=len(boroughs))
 
@@ -56,9 +60,6 @@ color_map = {borough: color for borough, color in zip(boroughs, COLORS)}
 
 
 option = "date"
-minimum = date(day=1, month=7, year=2012)
-maximum = date(day=8, month=10, year=2024)
-median = date(day=1, month=7, year=2014)
 
 columns = ["number_of_crash", "number_of_persons_killed", "number_of_persons_injured", "number_of_casualty"]
 columns_readable = [col.capitalize().replace("_", " ") for col in columns]
@@ -69,84 +70,253 @@ class MapType(str, Enum):
     HEATMAP = "Heatmap"
     GEOGRAPHICAL = "Geographical Map"
     BAR = "Bar chart of incidents"
+    DENSITY = "Crash density"
+
+
+class MarkerMode(str, Enum):
+    CLUSTER = "Clustered"
+    INDIVIDUAL = "Individual markers"
+
+
+MAX_INDIVIDUAL_MARKERS = 2000
+BOROUGH_PATH = "data/borough.parquet"
+# Read by boundaries.load_simplified, whose module is only imported by the heatmap.
+SIMPLIFIED_PATH = "data/nyc_simplified.parquet"
+MAP_INDEX_PATH = f"{CLEAN_MAP_PATH}/{INDEX_NAME}"
+
+# Receives one [latitude, longitude, tooltip, popup, color] row per crash, markers are built and clustered in the browser.
+MARKER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: "angle", markerColor: row[4], prefix: "glyphicon"});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindTooltip(row[2]);
+    marker.bindPopup(row[3]);
+    return marker;
+}
+"""
+
 
+def marker_rows(map_data: pl.DataFrame, value_counts: dict[str, int]) -> pl.DataFrame:
+    labels = [col.replace("_", " ").capitalize() for col in columns[1:]]
+    tooltip = pl.format(
+        "Location: ({}, {})" + "".join(f", {label}: {{}}" for label in labels), "latitude", "longitude", *columns[1:]
+    )
+    counts = pl.col("borough").replace_strict(value_counts, return_dtype=pl.String)
 
-@st.cache_resource
-def load_multiple_borough_maps(selected_boroughs: list[str]) -> tuple[pl.DataFrame, dict[str, int]]:
+    return map_data.select(
+        "latitude",
+        "longitude",
+        tooltip.alias("tooltip"),
+        pl.format("{} crashes in {}", counts, "borough").alias("popup"),
+        pl.col("borough").replace_strict(color_map).alias("color"),
+    )
+
+
+@cached(sources=[MAP_INDEX_PATH])
+def load_map_index() -> pl.DataFrame:
+    return read_index(CLEAN_MAP_PATH)
+
+
+@cached(unordered=["selected_boroughs"], sources=[MAP_INDEX_PATH])
+def load_multiple_borough_maps(
+    selected_boroughs: list[str], start: date, end: date
+) -> tuple[pl.DataFrame, dict[str, int]]:
     if len(selected_boroughs) == 0:
         return pl.DataFrame(), {}
 
-    data = []
-    value_counts: dict[str, int] = {}
-    for col in selected_boroughs:
-        filtered_data = pl.read_parquet(form_mapfilename(col=col))
-        filtered_data = filtered_data.filter(pl.col(option).eq(time))
-        value_counts[col] = filtered_data.shape[0]
+    index = load_map_index()
+    map_data = read_dates(CLEAN_MAP_PATH, start=start, end=end, boroughs=selected_boroughs, index=index)
 
-        data.append(filtered_data)
-    map_data = pl.concat(data)
-    map_data = pl.DataFrame(map_data)
+    # Every date of a partition is one run of rows in the index, so the counts never touch the crashes themselves.
+    value_counts = {col: 0 for col in selected_boroughs}
+    value_counts.update(
+        index.filter(pl.col("date").is_between(start, end), pl.col("borough").is_in(selected_boroughs))
+        .group_by("borough")
+        .agg(pl.col("length").sum())
+        .iter_rows()
+    )
 
     return map_data, value_counts
 
 
-@st.cache_resource
-def load_geo_data() -> gpd.GeoDataFrame:
-    return gpd.read_parquet("data/nyc_projected.parquet")
+@cached(sources=[PYRAMID_PATH])
+def load_density(level: int, start: int, end: int, column: str) -> pl.DataFrame:
+    cells = load_cells(level=level, start=start, end=end, column=column)
+    latitude, longitude = hex_boundaries(cells["q"].to_numpy(), cells["r"].to_numpy(), size=HEX_SIZES_KM[level])
+
+    import branca.colormap as cm
+
+    colors = [cm.linear.YlOrRd_09.scale(0, DENSITY_SHADES - 1).rgb_hex_str(shade) for shade in range(DENSITY_SHADES)]
+    values = cells[column].to_numpy()
+    shades = np.floor(np.log1p(values) / np.log1p(values.max(initial=1)) * (DENSITY_SHADES - 1))
+
+    return cells.with_columns(
+        pl.Series("latitude", latitude[:, :-1].mean(axis=1)),
+        pl.Series("longitude", longitude[:, :-1].mean(axis=1)),
+        pl.Series("ring", np.stack([longitude, latitude], axis=-1).round(6)),
+        pl.Series("shade", shades, dtype=pl.Int64).replace_strict(dict(enumerate(colors))).alias("color"),
+    )
+
 
+def density_layer(cells: pl.DataFrame, column: str, label: str) -> "folium.FeatureGroup":
+    import folium
 
-@st.cache_resource
-def load_borough_data() -> pd.DataFrame:
-    data = pd.read_parquet("data/borough.parquet")
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+            "properties": {label: value, "color": color},
+        }
+        for ring, value, color in cells.select("ring", column, "color").iter_rows()
+    ]
+    group = folium.FeatureGroup(name=label)
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        style_function=lambda feature: {
+            "fillColor": feature["properties"]["color"],
+            "color": feature["properties"]["color"],
+            "weight": 0.5,
+            "fillOpacity": 0.6,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=[label]),
+    ).add_to(group)
+
+    return group
+
+
+def in_view(bounds: dict | None, margin: float) -> pl.Expr:
+    if not bounds or not bounds.get("_southWest") or bounds["_southWest"].get("lat") is None:
+        return pl.lit(True)
+    south_west, north_east = bounds["_southWest"], bounds["_northEast"]
+
+    return pl.col("latitude").is_between(south_west["lat"] - margin, north_east["lat"] + margin) & pl.col(
+        "longitude"
+    ).is_between(south_west["lng"] - margin, north_east["lng"] + margin)
+
+
+@cached(sources=[BOROUGH_PATH])
+def load_borough_data() -> "pd.DataFrame":
+    import pandas as pd
+
+    data = pd.read_parquet(BOROUGH_PATH)
     data["code"] = data["borough"].apply(lambda x: BOROUGH_CODES[x.upper()])
     data = data.drop("borough", axis=1)
 
     return data
 
 
-geo_data = load_geo_data()
+@cached(sources=[BOROUGH_PATH, SIMPLIFIED_PATH])
+def load_heatmap(column: str, cmap: str, scheme: str, level: int) -> "folium.Map":
+    from boundaries import load_simplified
 
-rows = geo_data.drop("geometry", axis=1).to_dict("records")
+    merged = load_simplified(level=level).merge(load_borough_data(), on=["code"])
+    with span("explore", kind="chart"):
+        heatmap = merged.explore(column, cmap=cmap, scheme=scheme)
+        heatmap.fit_bounds(heatmap.get_bounds())
+
+    return heatmap
 
 
 with st.sidebar:
-    map_type = st.selectbox(label="Choose type", options=[MapType.GEOGRAPHICAL.value, MapType.HEATMAP.value])
+    map_type = st.selectbox(
+        label="Choose type", options=[MapType.GEOGRAPHICAL.value, MapType.HEATMAP.value, MapType.DENSITY.value]
+    )
 
 
+# folium, its streamlit component, branca and geopandas take seconds to import together, every branch only loads the
+# ones it draws with.
 if map_type == MapType.GEOGRAPHICAL:
     with st.sidebar:
-        time = st.slider(label=f"Pick a {option}", min_value=minimum, max_value=maximum, value=median)
+        minimum, maximum, median = bounds(option)
+        start, end = st.slider(
+            label=f"Pick a {option} range", min_value=minimum, max_value=maximum, value=(median, median)
+        )
         selected_boroughs = st.multiselect("Which boroughs do you want to check?", boroughs, boroughs[:])
+        marker_mode = st.radio(label="Markers", options=[MarkerMode.CLUSTER.value, MarkerMode.INDIVIDUAL.value])
 
-    map_data, value_counts = load_multiple_borough_maps(selected_boroughs=selected_boroughs)
+    map_data, value_counts = load_multiple_borough_maps(selected_boroughs=selected_boroughs, start=start, end=end)
 
     if map_data.shape[0] == 0:
-        st.info(f"No data found for {selected_boroughs} on {time}")
+        st.info(f"No data found for {selected_boroughs} between {start} and {end}")
     else:
-        map_data = map_data.with_columns(pl.col("borough").str.replace_many(boroughs, COLORS).alias("color"))
-
-        borough_counts = map_data["borough"].value_counts()
-
-        center = (map_data["latitude"].mean(), map_data["longitude"].mean())
-        fl_map = folium.Map(location=center, tiles=None, zoom_start=15)
-        folium.TileLayer(tiles="OpenStreetMap").add_to(fl_map)
-
-        for row in map_data.to_dicts():
-            tooltip = f"""Location: ({row["latitude"]}, {row["longitude"]})"""
-            for col in columns[1:]:
-                tooltip += f""", {col.replace("_", " ").capitalize()}: {row[col]}"""
-            folium.Marker(
-                location=row["coordinate"],
-                popup=f"""{value_counts[row['borough']]} crashes in {row["borough"]}""",
-                tooltip=tooltip,
-                icon=folium.Icon(color=color_map[row["borough"]], icon="angle"),
-            ).add_to(fl_map)
-        sw = list(map_data.select("latitude", "longitude").min().to_numpy()[0])
-        ne = list(map_data.select("latitude", "longitude").max().to_numpy()[0])
-        fl_map.fit_bounds(fl_map.get_bounds())
-
-        st_folium(fig=fl_map, use_container_width=True, returned_objects=[])
+        with st.sidebar:
+            download_button(
+                label="Download mapped crashes",
+                data=map_data.drop("coordinate"),
+                file_name=f"crashes_{start}_{end}",
+                export_format=format_selectbox(),
+                key="map_data",
+                sources=[MAP_INDEX_PATH],
+                selection=(selected_boroughs, start, end),
+            )
+        with span("marker_rows", kind="transform"):
+            markers = marker_rows(map_data, value_counts)
+        import folium
+        import folium.plugins
+        from streamlit_folium import st_folium
+
+        if marker_mode == MarkerMode.INDIVIDUAL.value and markers.shape[0] > MAX_INDIVIDUAL_MARKERS:
+            st.info(f"{markers.shape[0]} crashes are too many to draw one by one, showing them clustered instead.")
+            marker_mode = MarkerMode.CLUSTER.value
+
+        with span("markers", kind="chart"):
+            center = (map_data["latitude"].mean(), map_data["longitude"].mean())
+            fl_map = folium.Map(location=center, tiles=None, zoom_start=15)
+            folium.TileLayer(tiles="OpenStreetMap").add_to(fl_map)
+
+            if marker_mode == MarkerMode.CLUSTER.value:
+                folium.plugins.FastMarkerCluster(data=markers.rows(), callback=MARKER_CALLBACK).add_to(fl_map)
+            else:
+                for latitude, longitude, tooltip, popup, color in markers.iter_rows():
+                    folium.Marker(
+                        location=(latitude, longitude),
+                        popup=popup,
+                        tooltip=tooltip,
+                        icon=folium.Icon(color=color, icon="angle"),
+                    ).add_to(fl_map)
+            sw = list(map_data.select("latitude", "longitude").min().row(0))
+            ne = list(map_data.select("latitude", "longitude").max().row(0))
+            fl_map.fit_bounds([sw, ne])
+
+        with span("st_folium", kind="render"):
+            st_folium(fig=fl_map, use_container_width=True, returned_objects=[])
+elif map_type == MapType.DENSITY.value:
+    with st.sidebar:
+        first_year, last_year, _ = bounds("year")
+        start_year, end_year = st.slider(
+            label="Pick a year range", min_value=first_year, max_value=last_year, value=(first_year, last_year)
+        )
+    selected_column = st.selectbox("Show density of", COLUMN_MAP.keys())
+    column = COLUMN_MAP[selected_column]
+
+    # The level follows the zoom the map reported on the previous run, and only cells in the viewport are sent.
+    view = st.session_state.get("density_map") or {}
+    level = zoom_level(view.get("zoom") or BASE_ZOOM)
+    cells = load_density(level=level, start=start_year, end=end_year, column=column)
+    with span("in_view", kind="transform"):
+        cells = cells.filter(in_view(view.get("bounds"), margin=HEX_SIZES_KM[level] / 50))
+
+    import folium
+    from streamlit_folium import st_folium
+
+    with span("density_layer", kind="chart"):
+        fl_map = folium.Map(location=NY_CENTER, zoom_start=BASE_ZOOM, tiles="OpenStreetMap")
+        layer = density_layer(cells, column=column, label=selected_column)
+    with span("st_folium", kind="render"):
+        st_folium(
+            fig=fl_map,
+            key="density_map",
+            feature_group_to_add=layer,
+            use_container_width=True,
+            returned_objects=["zoom", "bounds"],
+        )
+    st.caption(f"{cells.shape[0]} hexagons of {HEX_SIZES_KM[level]} km")
 elif map_type == MapType.HEATMAP.value:
+    import branca.colormap as cm
+    from streamlit_folium import st_folium
+
+    from boundaries import tolerance_level
+
     cmap = "Reds"
     cmaps = list(set(cmap.split("_")[0] for cmap in cm.linear._colormaps))
     with st.sidebar:
@@ -156,14 +326,6 @@ elif map_type == MapType.HEATMAP.value:
     selected_column = st.selectbox("Generate heatmap for", COLUMN_MAP.keys())
     column = COLUMN_MAP[selected_column]
 
-    borough_data = load_borough_data()
-    # geo_data["color"] = geo_data["borough"].apply(lambda x: color_map[x.upper()])
-
-    fl_map = folium.Map(location=(40.71261963846181, -73.95064260553615), zoom_start=15, tiles=None)
-    folium.TileLayer(tiles="OpenStreetMap", name="Light Map", control=False).add_to(fl_map)
-    myscale = (borough_data[column].quantile((0, 0.1, 0.75, 0.9, 0.98, 1))).tolist()  # type: ignore
-
-    merged = geo_data.merge(borough_data, on=["code"])
     schemes = [
         "BoxPlot",
         "EqualInterval",
@@ -180,6 +342,20 @@ elif map_type == MapType.HEATMAP.value:
     with st.sidebar:
         scheme = st.selectbox(label="Select scheme", options=schemes, index=1)
 
-    m = merged.explore(column, cmap=cmap, scheme=scheme)
-    m.fit_bounds(m.get_bounds())
-    st_folium(m, use_container_width=True, returned_objects=[])
+    # Boundaries are drawn at the level fitting the zoom the map reported on the previous run, the view is passed back
+    # so switching levels keeps it.
+    view = st.session_state.get("heatmap_map") or {}
+    level = tolerance_level(view.get("zoom") or BASE_ZOOM)
+    view_center = view.get("center")
+    heatmap = load_heatmap(column=column, cmap=cmap, scheme=scheme, level=level)
+    with span("st_folium", kind="render"):
+        st_folium(
+            heatmap,
+            key="heatmap_map",
+            center=(view_center["lat"], view_center["lng"]) if view_center else None,
+            zoom=view.get("zoom"),
+            use_container_width=True,
+            returned_objects=["zoom", "center"],
+        )
+
+end_rerun()
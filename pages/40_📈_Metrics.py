@@ -1,13 +1,23 @@
 from enum import Enum
+from typing import Any
 
-import altair
-import plotly.express as px
 import polars as pl
 import streamlit as st
 from plotly.io import templates
 
 st.set_page_config(layout="wide")
 
+import warmup  # noqa: E402
+from cache import cached  # noqa: E402
+from catalog import bounds  # noqa: E402
+from dataset import INDEX_NAME, PROCESSED_PATH, scan_filtered  # noqa: E402
+from export import download_button, format_selectbox  # noqa: E402
+from query import DIRECTORY, PER_UNIT_PATH, query, risk_per_unit  # noqa: E402
+from telemetry import begin_rerun, end_rerun, span  # noqa: E402
+
+warmup.start()
+begin_rerun("Metrics")
+
 
 st.title("Statistics by Area and Multiple Criteria")
 
@@ -26,65 +36,53 @@ class VisualizationType(str, Enum):
     BAR = "Bar"
 
 
-def form_filename(keys: list[str], on: list[str]) -> str:
-    filename = "__".join(sorted(keys))
-    filename = f"data/{filename}.parquet"
-
-    return filename
-
-
-@st.cache_resource
-def load_stats(keys: list[str]) -> pl.DataFrame:
-    filename = form_filename(
-        keys=keys, on=["number_of_persons_killed", "number_of_persons_injured", "number_of_casualty"]
-    )
+def criterion(column: str, value: Any) -> pl.Expr:
+    if column == "victim":
+        return (pl.col(f"number_of_{value}_injured") + pl.col(f"number_of_{value}_killed")) > 0
 
-    return pl.read_parquet(filename)
+    return pl.col(column).eq(value)
 
 
-@st.cache_resource
-def load_data(column: str) -> pl.DataFrame:
-    return pl.read_parquet(f"data/{column}.parquet")
+@cached(sources=[DIRECTORY, f"{PROCESSED_PATH}/{INDEX_NAME}"])
+def load_stats(inputs: dict[str, Any]) -> pl.DataFrame:
+    return query(dimensions=[], filters=[criterion(key, value) for key, value in inputs.items()])
 
 
-@st.cache_resource
+@cached(sources=[PER_UNIT_PATH])
 def load_borough_metrics() -> pl.DataFrame:
-    return pl.read_parquet("data/per_unit.parquet")
+    return risk_per_unit()
 
 
 by = ["borough", "year"]
 
 
+first_year, last_year, _ = bounds("year")
 COLUMN_VALUES = {
-    "year": range(2012, 2025),
+    "year": range(first_year, last_year + 1),
     "borough": ["BRONX", "QUEENS", "BROOKLYN", "MANHATTAN", "STATEN ISLAND"],
     "month": range(1, 13),
     "hour": range(0, 24),
+    "weekday": range(1, 8),
+    "date": [],
+    "victim": ["pedestrians", "cyclist", "motorist"],
 }
+# The page opens on borough and hour, which a cuboid answers. Weekday, date and victim start unchecked.
+DEFAULT_CRITERIA = {"borough", "hour"}
+WEEKDAYS = {1: "Monday", 2: "Tuesday", 3: "Wednesday", 4: "Thursday", 5: "Friday", 6: "Saturday", 7: "Sunday"}
 
 borough_metrics = load_borough_metrics()
 metric_cols = ["number_of_persons_killed", "number_of_persons_injured", "number_of_casualty", "number_of_crash"]
 
 with st.sidebar:
-    reporting = st.selectbox(label="Output type", options=[ReportType.CHART.value, ReportType.DATAFRAME.value])
+    reporting = st.selectbox(label="Output type", options=[report_type.value for report_type in ReportType])
+    export_format = format_selectbox()
 
+    template = None
     if reporting == ReportType.CHART.value:
-        template = None
         choose_template = st.checkbox("Choose template?")
         if choose_template:
             template = st.selectbox(label="Template", options=templates)
 
-
-for column in metric_cols:
-    borough_metrics = borough_metrics.with_columns(
-        pl.col(column).cast(pl.Float64) * 10000 / pl.col("area").alias(column)
-    )
-
-borough_metrics = borough_metrics.sort(by=["number_of_casualty", "number_of_crash"])
-borough_metrics = borough_metrics.with_columns(
-    pl.sum_horizontal("number_of_casualty", "number_of_crash").alias("risk_factor")
-)
-
 columns = ["number_of_crash", "number_of_persons_killed", "number_of_persons_injured", "number_of_casualty"]
 columns_readable = [col.capitalize().replace("_", " ") for col in columns]
 COLUMN_MAP = {col1: col2 for col1, col2 in zip(columns_readable, columns)}
@@ -95,7 +93,8 @@ with st_cols[0]:
     st.header("Risk per 10000 Square Area Unit")
 
     if reporting == ReportType.DATAFRAME.value:
-        st.write(borough_metrics)
+        with span("write", kind="render"):
+            st.write(borough_metrics)
     else:
         x_col = "borough"
         with st.sidebar:
@@ -110,23 +109,35 @@ with st_cols[0]:
             )
         selected_column = st.selectbox(label="Select", options=COLUMN_MAP.keys())
         column = COLUMN_MAP[selected_column]
-
-        if visualization == VisualizationType.AREA.value:
-            px_chart = px.area(data_frame=borough_metrics, x=x_col, y=column, color="borough", template=template)
-        elif visualization == VisualizationType.BAR.value:
-            px_chart = px.bar(data_frame=borough_metrics, x=x_col, y=column, color="borough", template=template)
-        elif visualization == VisualizationType.CIRCLE.value:
-            px_chart = px.scatter(
-                data_frame=borough_metrics, x=x_col, y=column, color="borough", template=template, size=column
-            )
-        else:
-            alt_chart = (
-                altair.Chart(data=borough_metrics).mark_point().encode(x=x_col, y=column, color="borough", size=column)
-            ).interactive()
-            st.altair_chart(alt_chart, use_container_width=True)
+        # plotly.express takes over half a second to import, it is only loaded once metrics are charted.
+        import plotly.express as px
+
+        with span(visualization, kind="chart"):
+            if visualization == VisualizationType.AREA.value:
+                px_chart = px.area(data_frame=borough_metrics, x=x_col, y=column, color="borough", template=template)
+            elif visualization == VisualizationType.BAR.value:
+                px_chart = px.bar(data_frame=borough_metrics, x=x_col, y=column, color="borough", template=template)
+            elif visualization == VisualizationType.CIRCLE.value:
+                px_chart = px.scatter(
+                    data_frame=borough_metrics, x=x_col, y=column, color="borough", template=template, size=column
+                )
+            else:
+                import altair
+
+                altair.themes.enable("dark")
+                alt_chart = (
+                    altair.Chart(data=borough_metrics)
+                    .mark_point()
+                    .encode(x=x_col, y=column, color="borough", size=column)
+                ).interactive()
+            if "px_chart" in locals():
+                px_chart.update_layout(yaxis_title=column.capitalize().replace("_", " "))
         if "px_chart" in locals():
-            px_chart.update_layout(yaxis_title=column.capitalize().replace("_", " "))
-            st.plotly_chart(px_chart)
+            with span("plotly_chart", kind="render"):
+                st.plotly_chart(px_chart)
+        else:
+            with span("altair_chart", kind="render"):
+                st.altair_chart(alt_chart, use_container_width=True)
 
 
 st.header("Statistics by Multiple Criteria")
@@ -134,20 +145,24 @@ st.header("Statistics by Multiple Criteria")
 
 filtered = pl.DataFrame()
 
-inputs = {}
+inputs: dict[str, Any] = {}
 
 selectable_columns = list(COLUMN_VALUES.keys())
 cols = st.columns((1,) * len(selectable_columns))
 
-choice = False
-
 for i, column in enumerate(selectable_columns):
     with cols[i]:
-        select = st.checkbox(label=f"Choose {column}?", value=choice)
-        choice = not choice
-
-        if select:
-            criteria = st.selectbox(label=f"Select {column}", options=COLUMN_VALUES[column])  # type: ignore [var-annotated]
+        select = st.checkbox(label=f"Choose {column}?", value=column in DEFAULT_CRITERIA)
+
+        if select and column == "date":
+            minimum, maximum, median = bounds("date")
+            inputs[column] = st.date_input(label="Select date", value=median, min_value=minimum, max_value=maximum)
+        elif select:
+            criteria = st.selectbox(
+                label=f"Select {column}",
+                options=COLUMN_VALUES[column],
+                format_func=WEEKDAYS.get if column == "weekday" else str,
+            )
             inputs[column] = criteria
 
         elif column in inputs:
@@ -157,29 +172,37 @@ for i, column in enumerate(selectable_columns):
 keys = list(inputs.keys())
 
 if len(keys) > 0:
-    stats = load_stats(keys=keys)
-
-    filtered = stats.filter(pl.col(keys[0]).eq(inputs[keys[0]]))
-
-    for key in keys[1:]:
-        filtered = filtered.filter(pl.col(key).eq(inputs[key]))
+    filtered = load_stats(inputs=inputs)
 
     metric_cols = sorted(metric_cols)
 
     subcols = st.columns((1,) * len(metric_cols), gap="small")
 
-    for i, col in enumerate(metric_cols):
-        with subcols[i]:
-            st.metric(" ".join(col.split("_")).capitalize(), filtered[col].sum())
+    with span("metric", kind="render"):
+        for i, col in enumerate(metric_cols):
+            with subcols[i]:
+                st.metric(" ".join(col.split("_")).capitalize(), filtered[col].sum())
+
+if reporting == ReportType.FILE_DOWNLOAD.value:
+    full_data = scan_filtered(PROCESSED_PATH, [criterion(key, value) for key, value in inputs.items()], ipc=False)
+    download_button(
+        label="Prepare full data of the selected criteria",
+        data=full_data,
+        file_name="_".join(["crashes", *[f"{key}_{value}" for key, value in inputs.items()]]).lower().replace(" ", "_"),
+        export_format=export_format,
+        key="full_data",
+        sources=[f"{PROCESSED_PATH}/{INDEX_NAME}"],
+    )
 
 
 with st.sidebar:
-    filename = "borough_metrics.csv"
-    st.download_button(
+    download_button(
         label="Download metrics for boroughs",
-        data=borough_metrics.to_pandas().to_csv(),
-        file_name=filename,
-        mime="text/csv",
+        data=borough_metrics,
+        file_name="borough_metrics",
+        export_format=export_format,
+        key="borough_metrics",
+        sources=[PER_UNIT_PATH],
     )
     # st.download_button(
     #     label=f"Download correlation data for {column}s",
@@ -187,3 +210,5 @@ with st.sidebar:
     #     mime="text/csv",
     #     file_name=f"correlation_{column}.csv",
     # )
+
+end_rerun()
@@ -0,0 +1,241 @@
+import fcntl
+import json
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+import polars as pl
+import pyarrow.parquet as pq
+
+import storage
+from common import MEASURES, crash_count, replace_parquet
+from dataset import scan_dataset, scan_filtered
+
+DIRECTORY = "data"
+COUNT = "number_of_crash"
+PER_UNIT_PATH = "data/per_unit.parquet"
+DIMENSIONS = ["borough", "date", "year", "month", "weekday", "hour"]
+
+# Cuboids drop the groups where one of their keys is null, so rolling a key away is only exact for keys that are
+# never null. Only borough can be missing, the date and time parts come from columns every crash has.
+NULLABLE = {"borough"}
+NEVER_NULL = set(DIMENSIONS) - NULLABLE
+DERIVED = {
+    "year": pl.col("date").dt.year(),
+    "month": pl.col("date").dt.month(),
+    "weekday": pl.col("date").dt.weekday(),
+}
+
+# Groupings no cuboid covers are answered from the processed dataset. Once one has been asked for HOT_QUERIES times
+# it is materialized into the aggregates directory, which keeps the MAX_AGGREGATES most asked for.
+# Usage is counted in a directory of its own, so counting never changes the modification time of the aggregates.
+AGGREGATE_DIRECTORY = "aggregates"
+USAGE_DIRECTORY = "aggregates/usage"
+USAGE_NAME = "usage.json"
+LOCK_NAME = "usage.lock"
+HOT_QUERIES = 3
+MAX_AGGREGATES = 16
+
+# Risk counts victims and crashes per 10000 square units of borough area.
+AREA_UNIT = 10000
+RISK_MEASURES = ["number_of_persons_killed", "number_of_persons_injured", "number_of_casualty", "number_of_crash"]
+
+
+def aggregates_version(directory: str) -> tuple[int, ...]:
+    # Cuboid files are only ever replaced by a rename, which changes the modification time of their directory. Two
+    # stats are cheap enough for every query, listing the files is not.
+    paths = [Path(directory), Path(directory, AGGREGATE_DIRECTORY)]
+
+    return tuple(path.stat().st_mtime_ns if path.exists() else 0 for path in paths)
+
+
+@lru_cache
+def materialized_cuboids(
+    directory: str = DIRECTORY, version: tuple[int, ...] = ()
+) -> dict[frozenset[str], tuple[str, int, set[str]]]:
+    # The version changes whenever a cuboid is rebuilt or an aggregate is added or evicted, so every process sees them
+    # without a restart.
+    cuboids: dict[frozenset[str], tuple[str, int, set[str]]] = {}
+    for path in [*Path(directory).glob("*.parquet"), *Path(directory, AGGREGATE_DIRECTORY).glob("*.parquet")]:
+        keys = path.stem.split("__")
+        if is_grouping(keys):
+            metadata = pq.read_metadata(path)
+            cuboids.setdefault(frozenset(keys), (str(path), metadata.num_rows, set(metadata.schema.names)))
+
+    return cuboids
+
+
+def is_grouping(keys: Iterable[str]) -> bool:
+    # Victim counts are summed, never grouped on, so only dimensions are keys of a cuboid or an aggregate.
+    return set(keys) <= set(DIMENSIONS)
+
+
+def covers(keys: frozenset[str], needed: set[str]) -> bool:
+    if not is_grouping(keys):
+        return False
+    derivable = keys | (set(DERIVED) if "date" in keys else set())
+    if not needed <= derivable:
+        return False
+
+    used = needed | ({"date"} if needed & (set(DERIVED) - keys) else set())
+
+    return (keys - used) <= NEVER_NULL
+
+
+def smallest_cuboid(
+    needed: set[str], measures: list[str], directory: str = DIRECTORY
+) -> tuple[frozenset[str], str] | None:
+    candidates = [
+        (rows, keys, path)
+        for keys, (path, rows, columns) in materialized_cuboids(directory, aggregates_version(directory)).items()
+        if covers(keys, needed) and set(measures) <= columns
+    ]
+    if len(candidates) == 0:
+        return None
+    _, keys, path = min(candidates, key=lambda candidate: (candidate[0], len(candidate[1])))
+
+    return keys, path
+
+
+def scan_processed(directory: str = DIRECTORY) -> pl.LazyFrame:
+    return scan_dataset(Path(directory) / "processed")
+
+
+def aggregate(data: pl.LazyFrame, keys: list[str], measures: list[str]) -> pl.LazyFrame:
+    aggregations = [pl.col([measure for measure in measures if measure != COUNT]).sum(), crash_count(MEASURES)]
+    if not keys:
+        return data.select(aggregations)
+
+    return data.drop_nulls(keys).group_by(keys).agg(aggregations)
+
+
+def aggregate_name(keys: Iterable[str]) -> str:
+    return "__".join(sorted(keys))
+
+
+def read_usage(directory: str) -> dict[str, int]:
+    path = Path(directory, USAGE_DIRECTORY, USAGE_NAME)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+@contextmanager
+def usage_lock(directory: str) -> Iterator[None]:
+    # Server processes and their sessions count usage in one file, each update holds an exclusive lock on it.
+    path = Path(directory, USAGE_DIRECTORY, LOCK_NAME)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode="a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def record_usage(keys: Iterable[str], directory: str) -> int:
+    name = aggregate_name(keys)
+    path = Path(directory, USAGE_DIRECTORY, USAGE_NAME)
+    with usage_lock(directory):
+        usage = read_usage(directory)
+        usage[name] = usage.get(name, 0) + 1
+        with open(f"{path}.partial", mode="w") as f:
+            json.dump(usage, f)
+        os.replace(f"{path}.partial", path)
+
+    return usage[name]
+
+
+def materialize(keys: Iterable[str], directory: str = DIRECTORY) -> None:
+    # Every victim count is kept, so one aggregate answers a grouping for any of the measures.
+    data = scan_processed(directory)
+    measures = [name for name in data.collect_schema().names() if name.startswith("number_of_")]
+    aggregated = aggregate(data, sorted(keys), measures).sort(by=sorted(keys)).collect()
+    replace_parquet(aggregated, str(Path(directory, AGGREGATE_DIRECTORY, f"{aggregate_name(keys)}.parquet")))
+    evict(directory)
+
+
+def evict(directory: str = DIRECTORY) -> None:
+    usage = read_usage(directory)
+    paths = sorted(Path(directory, AGGREGATE_DIRECTORY).glob("*.parquet"), key=lambda path: usage.get(path.stem, 0))
+    for path in paths[: max(len(paths) - MAX_AGGREGATES, 0)]:
+        path.unlink()
+
+
+def refresh_aggregates(directory: str = DIRECTORY) -> int:
+    # Aggregates are rebuilt from the processed dataset after it changes rather than merged like the cuboids. Ones
+    # grouped on a victim count, written before those were only summed, are removed.
+    paths = list(Path(directory, AGGREGATE_DIRECTORY).glob("*.parquet"))
+    for path in paths:
+        if is_grouping(path.stem.split("__")):
+            materialize(path.stem.split("__"), directory=directory)
+        else:
+            path.unlink()
+
+    return len(paths)
+
+
+def query(
+    dimensions: list[str],
+    filters: Iterable[pl.Expr] = (),
+    measures: list[str] | None = None,
+    directory: str = DIRECTORY,
+) -> pl.DataFrame:
+    filters = list(filters)
+    if measures is None:
+        measures = MEASURES + [COUNT]
+    if not is_grouping(dimensions):
+        raise ValueError(f"Can not group by {sorted(set(dimensions) - set(DIMENSIONS))}, expected some of {DIMENSIONS}")
+    # Filters on dimensions select groups of a cuboid. Others, on victim counts for instance, select crashes, so they
+    # are answered from the processed dataset filtered before it is aggregated.
+    key_filters: list[pl.Expr] = []
+    row_filters: list[pl.Expr] = []
+    for expr in filters:
+        (key_filters if is_grouping(expr.meta.root_names()) else row_filters).append(expr)
+    needed = set(dimensions).union(*(expr.meta.root_names() for expr in key_filters))
+
+    found = None if row_filters else smallest_cuboid(needed, measures=measures, directory=directory)
+    if found is None:
+        processed = scan_filtered(Path(directory) / "processed", filters)
+        columns = needed | set(measures) | set().union(*(expr.meta.root_names() for expr in row_filters))
+        missing = columns - set(processed.collect_schema().names()) - {COUNT}
+        if missing:
+            raise ValueError(f"Neither a cuboid nor the processed data in {directory} has {sorted(missing)}")
+        if not row_filters and record_usage(needed, directory=directory) >= HOT_QUERIES:
+            materialize(needed, directory=directory)
+            found = smallest_cuboid(needed, measures=measures, directory=directory)
+
+    if found is None:
+        keys, cuboid = frozenset(needed), aggregate(processed, sorted(needed), measures)
+    else:
+        keys, path = found
+        cuboid = storage.scan(path)
+
+    cuboid = cuboid.with_columns(DERIVED[key].alias(key) for key in needed - keys)
+    for expr in key_filters:
+        cuboid = cuboid.filter(expr)
+
+    if set(dimensions) == keys:
+        result = cuboid.select(*dimensions, *measures)
+    elif len(dimensions) == 0:
+        result = cuboid.select(pl.col(measures).sum())
+    else:
+        result = cuboid.group_by(dimensions).agg(pl.col(measures).sum())
+
+    if len(dimensions) > 0:
+        result = result.sort(by=dimensions)
+
+    return result.collect()
+
+
+def risk_per_unit(path: str | Path = PER_UNIT_PATH) -> pl.DataFrame:
+    return (
+        storage.scan(path)
+        .with_columns(pl.col(RISK_MEASURES).cast(pl.Float64) * AREA_UNIT / pl.col("area"))
+        .sort(by=["number_of_casualty", "number_of_crash"])
+        .with_columns(pl.sum_horizontal("number_of_casualty", "number_of_crash").alias("risk_factor"))
+        .collect()
+    )
@@ -0,0 +1,124 @@
+from datetime import date, timedelta
+from enum import Enum
+from pathlib import Path
+
+import polars as pl
+
+import storage
+from common import MEASURES, replace_parquet
+from query import COUNT, DIRECTORY, query
+
+ROLLING_PATH = "data/rolling.parquet"
+SERIES_MEASURES = [*MEASURES, COUNT]
+WINDOWS = [7, 30, 90]
+YEAR_DAYS = 365
+# Days an update recomputes before the first changed date, a year over year delta reaches two years back.
+LOOKBACK_DAYS = 2 * YEAR_DAYS
+
+
+class SeriesType(str, Enum):
+    DAILY = "Daily"
+    SUM_7 = "7 day sum"
+    MEAN_7 = "7 day mean"
+    SUM_30 = "30 day sum"
+    MEAN_30 = "30 day mean"
+    SUM_90 = "90 day sum"
+    MEAN_90 = "90 day mean"
+    CUMULATIVE = "Cumulative"
+    YEAR_OVER_YEAR = "Year over year"
+
+
+SUFFIXES = {
+    SeriesType.DAILY: "",
+    **{SeriesType(f"{window} day sum"): f"_sum_{window}" for window in WINDOWS},
+    **{SeriesType(f"{window} day mean"): f"_mean_{window}" for window in WINDOWS},
+    SeriesType.CUMULATIVE: "_cumulative",
+    SeriesType.YEAR_OVER_YEAR: "_yoy",
+}
+
+
+def series_column(measure: str, series: SeriesType) -> str:
+    return f"{measure}{SUFFIXES[series]}"
+
+
+def daily_totals(boroughs: list[str], start: date | None = None, directory: str = DIRECTORY) -> pl.DataFrame:
+    # Every borough gets a row for every day, days without crashes count zero so windows span calendar days.
+    filters = [] if start is None else [pl.col("date") >= start]
+    totals = query(dimensions=["borough", "date"], filters=filters, directory=directory).with_columns(
+        pl.col(COUNT).cast(pl.Int64)
+    )
+    if totals.shape[0] == 0:
+        return totals
+
+    first, last = totals.select(pl.col("date").min().alias("first"), pl.col("date").max().alias("last")).row(0)
+    dates = pl.date_range(first if start is None else start, last, interval="1d", eager=True).alias("date")
+    calendar = pl.DataFrame({"borough": boroughs}).join(dates.to_frame(), how="cross")
+
+    return (
+        calendar.join(totals, on=["borough", "date"], how="left")
+        .with_columns(pl.col(SERIES_MEASURES).fill_null(0))
+        .sort(by=["borough", "date"])
+    )
+
+
+def compute_series(daily: pl.DataFrame) -> pl.DataFrame:
+    columns: list[pl.Expr] = []
+    for measure in SERIES_MEASURES:
+        column = pl.col(measure)
+        yearly = column.rolling_sum(YEAR_DAYS)
+        columns.extend(
+            column.rolling_sum(window).over("borough").alias(f"{measure}_sum_{window}") for window in WINDOWS
+        )
+        columns.extend(
+            column.rolling_mean(window).over("borough").alias(f"{measure}_mean_{window}") for window in WINDOWS
+        )
+        columns.append(column.cum_sum().over("borough").alias(f"{measure}_cumulative"))
+        columns.append((yearly - yearly.shift(YEAR_DAYS)).over("borough").alias(f"{measure}_yoy"))
+
+    return daily.with_columns(columns)
+
+
+def build_rolling(path: str | Path = ROLLING_PATH, directory: str = DIRECTORY) -> int:
+    boroughs = query(dimensions=["borough"], directory=directory)["borough"].to_list()
+    rolling = compute_series(daily_totals(boroughs=boroughs, directory=directory))
+    replace_parquet(rolling, str(path))
+
+    return rolling.shape[0]
+
+
+def update_rolling(since: date, path: str | Path = ROLLING_PATH, directory: str = DIRECTORY) -> int:
+    # Only days from since on are replaced. They are computed from the daily totals of the lookback before them, with
+    # the cumulative totals carried over from the last kept day.
+    existing = pl.read_parquet(path)
+    start = max(since - timedelta(days=LOOKBACK_DAYS), existing.select(pl.col("date").min()).item())
+    boroughs = sorted(set(existing["borough"]) | set(query(dimensions=["borough"], directory=directory)["borough"]))
+
+    daily = daily_totals(boroughs=boroughs, start=start, directory=directory)
+    carried = (
+        existing.filter(pl.col("date") == start - timedelta(days=1))
+        .select("borough", *[pl.col(f"{measure}_cumulative").alias(measure) for measure in SERIES_MEASURES])
+        .join(pl.DataFrame({"borough": boroughs}), on="borough", how="right")
+        .select("borough", pl.col(SERIES_MEASURES).fill_null(0).name.suffix("_carried"))
+    )
+    updated = (
+        compute_series(daily)
+        .join(carried, on="borough", how="left")
+        .with_columns(pl.col(f"{measure}_cumulative") + pl.col(f"{measure}_carried") for measure in SERIES_MEASURES)
+        .filter(pl.col("date") >= since)
+        .select(existing.columns)
+    )
+
+    rolling = pl.concat([existing.filter(pl.col("date") < since), updated]).sort(by=["borough", "date"])
+    replace_parquet(rolling, str(path))
+
+    return updated.shape[0]
+
+
+def load_series(measure: str, series: SeriesType, path: str | Path = ROLLING_PATH) -> pl.DataFrame:
+    column = series_column(measure, series)
+
+    return storage.scan(path).select("borough", "date", pl.col(column).alias(measure)).collect()
+
+
+if __name__ == "__main__":
+    build_rolling()
@@ -0,0 +1,12 @@
+import sys
+
+import warmup
+
+if __name__ == "__main__":
+    # Starts the server in this process with the warm-up already running, so it overlaps the server boot instead of
+    # the first session. Arguments are passed on to streamlit run.
+    from streamlit.web import cli
+
+    warmup.start()
+    sys.argv = ["streamlit", "run", "home.py", *sys.argv[1:]]
+    sys.exit(cli.main())
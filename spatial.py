@@ -0,0 +1,89 @@
+import math
+
+import geopandas as gpd
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+import shapely
+
+from common import BOROUGH_CODES, map_coordinates
+
+CELL_SIZE = 0.01
+OUTSIDE = 0
+MIXED = -1
+
+BOROUGH_NAMES = {code: borough for borough, code in BOROUGH_CODES.items()}
+
+
+class BoroughIndex:
+    # A regular grid over the city. Cells that lie inside exactly one borough resolve a point with an array
+    # lookup, only points in cells crossed by a boundary are tested against the clipped polygons in an STRtree.
+    def __init__(self, boundaries: gpd.GeoDataFrame, cell_size: float = CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        self.min_x, self.min_y, max_x, max_y = boundaries.total_bounds
+        self.n_x = math.ceil((max_x - self.min_x) / cell_size)
+        self.n_y = math.ceil((max_y - self.min_y) / cell_size)
+
+        x, y = np.meshgrid(np.arange(self.n_x), np.arange(self.n_y))
+        x = self.min_x + x.ravel() * cell_size
+        y = self.min_y + y.ravel() * cell_size
+        cells = shapely.box(x, y, x + cell_size, y + cell_size)
+        cell_tree = shapely.STRtree(cells)
+
+        self.cells = np.full(cells.shape[0], OUTSIDE, dtype=np.int8)
+        pieces, codes = [], []
+        for code, geometry in zip(boundaries["code"], boundaries.geometry):
+            shapely.prepare(geometry)
+            hits = cell_tree.query(geometry, predicate="intersects")
+            inside = shapely.contains(geometry, cells[hits])
+
+            self.cells[hits] = np.where(self.cells[hits] == OUTSIDE, np.where(inside, code, MIXED), MIXED)
+            pieces.append(np.where(inside, cells[hits], shapely.intersection(cells[hits], geometry)))
+            codes.append(np.full(hits.shape[0], code, dtype=np.int8))
+
+        self.pieces = np.concatenate(pieces)
+        self.codes = np.concatenate(codes)
+        self.tree = shapely.STRtree(self.pieces)
+
+    def locate(self, latitude: npt.NDArray[np.float64], longitude: npt.NDArray[np.float64]) -> npt.NDArray[np.int8]:
+        x = np.floor((longitude - self.min_x) / self.cell_size)
+        y = np.floor((latitude - self.min_y) / self.cell_size)
+        covered = (x >= 0) & (x < self.n_x) & (y >= 0) & (y < self.n_y)
+
+        located = np.full(latitude.shape[0], OUTSIDE, dtype=np.int8)
+        located[covered] = self.cells[(y[covered] * self.n_x + x[covered]).astype(np.int64)]
+
+        mixed = np.flatnonzero(located == MIXED)
+        located[mixed] = OUTSIDE
+        points, pieces = self.tree.query(shapely.points(longitude[mixed], latitude[mixed]), predicate="intersects")
+        located[mixed[points]] = self.codes[pieces]
+
+        return located
+
+
+def load_borough_index(path: str = "data/nyc_projected.parquet") -> BoroughIndex:
+    return BoroughIndex(gpd.read_parquet(path))
+
+
+def validate_boroughs(data: pl.LazyFrame, index: BoroughIndex, correct: bool = False) -> pl.LazyFrame:
+    def kernel(latitude: npt.NDArray[np.float64], longitude: npt.NDArray[np.float64]) -> pl.Series:
+        return pl.Series(index.locate(latitude, longitude))
+
+    validated = data.with_columns(map_coordinates(kernel, dtype=pl.Int8()).alias("geo_code"))
+    validated = validated.with_columns(
+        pl.when(pl.col("geo_code") != OUTSIDE).then(pl.col("geo_code")).alias("geo_code")
+    )
+    validated = validated.with_columns(pl.col("geo_code").ne(pl.col("code")).fill_null(False).alias("mislabeled"))
+
+    if correct:
+        # Kept as its own projection, a replace_strict nested in when/then is not supported by the streaming engine.
+        validated = validated.with_columns(
+            pl.col("geo_code").replace_strict(BOROUGH_NAMES, default=None, return_dtype=pl.String).alias("geo_borough")
+        )
+        validated = validated.with_columns(
+            pl.when(pl.col("mislabeled")).then(pl.col("geo_borough")).otherwise(pl.col("borough")).alias("borough"),
+            pl.when(pl.col("mislabeled")).then(pl.col("geo_code")).otherwise(pl.col("code")).alias("code"),
+        )
+        validated = validated.drop("geo_borough")
+
+    return validated
@@ -0,0 +1,76 @@
+import os
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import polars as pl
+import pyarrow.parquet as pq
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+# With STORAGE_BACKEND=ipc every parquet artifact that has an up to date uncompressed Arrow IPC copy next to it is
+# memory mapped from that copy instead, so the worker processes of a host share one page cache copy of the data.
+BACKEND = os.environ.get("STORAGE_BACKEND", "parquet")
+IPC_SUFFIX = ".arrow"
+
+
+def ipc_path(path: str | Path) -> Path:
+    return Path(path).with_suffix(IPC_SUFFIX)
+
+
+def use_ipc(path: str | Path) -> bool:
+    if BACKEND != "ipc":
+        return False
+    ipc = ipc_path(path)
+
+    return ipc.exists() and ipc.stat().st_mtime >= Path(path).stat().st_mtime
+
+
+def scan(path: str | Path) -> pl.LazyFrame:
+    if use_ipc(path):
+        return pl.scan_ipc(ipc_path(path), memory_map=True)
+
+    return pl.scan_parquet(path)
+
+
+def read_geo(path: str | Path) -> "gpd.GeoDataFrame":
+    # geopandas takes longer to import than the rest of the data stack, it is only loaded by the views drawing shapes.
+    import geopandas as gpd
+
+    if use_ipc(path):
+        return gpd.read_feather(ipc_path(path), memory_map=True)
+
+    return gpd.read_parquet(path)
+
+
+def is_geo(path: Path) -> bool:
+    return b"geo" in (pq.read_schema(path).metadata or {})
+
+
+def convert_file(path: Path) -> None:
+    ipc = ipc_path(path)
+    partial = ipc.with_name(f"{ipc.name}.partial")
+    if is_geo(path):
+        import geopandas as gpd
+
+        gpd.read_parquet(path).to_feather(partial, compression="uncompressed")
+    else:
+        pl.read_parquet(path).write_ipc(partial, compression="uncompressed")
+    os.replace(partial, ipc)
+
+
+def convert(directory: str | Path = "data") -> list[Path]:
+    converted = []
+    for path in sorted(Path(directory).rglob("*.parquet")):
+        ipc = ipc_path(path)
+        if not ipc.exists() or ipc.stat().st_mtime < path.stat().st_mtime:
+            convert_file(path)
+            converted.append(path)
+
+    return converted
+
+
+if __name__ == "__main__":
+    for path in convert(sys.argv[1] if len(sys.argv) > 1 else "data"):
+        print(f"{path} -> {ipc_path(path)}")
@@ -0,0 +1,49 @@
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+
+SUMMARY_PATH = "data/summary.json"
+COUNTED_COLUMNS = ["hour", "weekday", "year", "borough"]
+SAMPLE_ROWS = 5
+
+
+def build_summary(data: pl.LazyFrame) -> dict[str, Any]:
+    schema = data.collect_schema()
+    victims = [name for name in schema.names() if name.startswith("number_of_")]
+
+    overview, head, *counts = pl.collect_all(
+        [
+            data.select(
+                pl.len().alias("rows"),
+                *[pl.col(name).null_count().alias(f"null_{name}") for name in schema.names()],
+                *[pl.col(name).sum().alias(f"total_{name}") for name in victims],
+            ),
+            data.head(SAMPLE_ROWS),
+            *[data.group_by(column).len(name="count").drop_nulls().sort(by=column) for column in COUNTED_COLUMNS],
+        ]
+    )
+    totals = overview.row(0, named=True)
+
+    return {
+        "rows": totals["rows"],
+        "columns": len(schema),
+        "null_count": {name: totals[f"null_{name}"] for name in schema.names()},
+        "victims": {name: totals[f"total_{name}"] for name in victims},
+        "value_counts": {column: count.rows() for column, count in zip(COUNTED_COLUMNS, counts)},
+        "head": head.with_columns(pl.col(pl.Date, pl.Time, pl.Datetime).cast(pl.String)).to_dict(as_series=False),
+    }
+
+
+def persist_summary(data: pl.LazyFrame, path: str | Path = SUMMARY_PATH) -> None:
+    partial = f"{path}.partial"
+    with open(partial, mode="w") as f:
+        json.dump(build_summary(data), f)
+    os.replace(partial, path)
+
+
+def load_summary(path: str | Path = SUMMARY_PATH) -> dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
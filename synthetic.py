@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+import pyarrow.parquet as pq
+import shapely
+
+from common import BOROUGH_CODES, BOROUGHS
+
+BATCH_ROWS = 1 << 20
+SYNTHETIC_PATH = "data/synthetic_crash.parquet"
+
+# The cuboids only keep person totals, victims are split by roughly the shares the city reports.
+VICTIM_SHARES = {
+    "injured": {"pedestrians": 0.2, "cyclist": 0.09, "motorist": 0.71},
+    "killed": {"pedestrians": 0.5, "cyclist": 0.08, "motorist": 0.42},
+}
+ZIP_CODES = {
+    "MANHATTAN": (10001, 10282),
+    "BRONX": (10451, 10475),
+    "BROOKLYN": (11201, 11256),
+    "QUEENS": (11354, 11697),
+    "STATEN ISLAND": (10301, 10314),
+}
+STREETS = ["BROADWAY", "ATLANTIC AVENUE", "NORTHERN BOULEVARD", "GRAND CONCOURSE", "HYLAN BOULEVARD", "3 AVENUE"]
+FACTORS = ["Unspecified", "Driver Inattention/Distraction", "Failure to Yield Right-of-Way", "Following Too Closely"]
+VEHICLES = ["Sedan", "Station Wagon/Sport Utility Vehicle", "Taxi", "Pick-up Truck", "Bus", "Bike"]
+# Share of crashes with at least 1, 2, ... 5 vehicles.
+VEHICLE_SHARES = [1.0, 0.75, 0.1, 0.03, 0.01]
+RAW_COLUMNS = [
+    "crash_date",
+    "crash_time",
+    "borough",
+    "zip_code",
+    "latitude",
+    "longitude",
+    "location",
+    "on_street_name",
+    "cross_street_name",
+    "off_street_name",
+    *[
+        f"number_of_{kind}_{victim}"
+        for kind in ["persons", "pedestrians", "cyclist", "motorist"]
+        for victim in VICTIM_SHARES
+    ],
+    *[f"contributing_factor_vehicle_{i}" for i in range(1, len(VEHICLE_SHARES) + 1)],
+    "collision_id",
+    *[f"vehicle_type_code_{i}" for i in range(1, len(VEHICLE_SHARES) + 1)],
+]
+
+
+def weights(path: str | Path, key: str) -> tuple[npt.NDArray, npt.NDArray[np.float64]]:
+    counts = pl.read_parquet(path).drop_nulls(key).sort(by=key)
+    crashes = counts["number_of_crash"].cast(pl.Float64).to_numpy()
+
+    return counts[key].to_numpy(), crashes / crashes.sum()
+
+
+class Profile:
+    # Distributions of the committed cuboids and metrics, so generated crashes fall on the same days, hours and
+    # boroughs in the same proportions as the real ones, and coordinates inside the borough they are reported in.
+    def __init__(self, directory: str | Path = "data") -> None:
+        directory = Path(directory)
+        with open(directory / "metrics.json") as f:
+            metrics = json.load(f)
+        totals = pl.read_parquet(directory / "date.parquet").select(pl.exclude("date").sum()).row(0, named=True)
+
+        self.rows = metrics["Total number of crashes"]
+        self.dates, self.date_weights = weights(directory / "date.parquet", key="date")
+        self.hours, self.hour_weights = weights(directory / "hour.parquet", key="hour")
+        self.boroughs, self.borough_weights = weights(directory / "borough.parquet", key="borough")
+        self.missing_borough = 1 - pl.read_parquet(directory / "borough.parquet")["number_of_crash"].sum() / self.rows
+        self.unmarked = metrics["Locations unmarked"] / self.rows
+        self.invalid = metrics["Invalid markings"] / self.rows
+        self.means = {
+            victim: totals[f"number_of_persons_{victim}"] / totals["number_of_crash"] for victim in VICTIM_SHARES
+        }
+
+        boundaries = gpd.read_parquet(directory / "nyc_projected.parquet")
+        codes = {code: borough for borough, code in BOROUGH_CODES.items()}
+        self.geometries = {codes[code]: geometry for code, geometry in zip(boundaries["code"], boundaries.geometry)}
+        for geometry in self.geometries.values():
+            shapely.prepare(geometry)
+
+
+def sample_points(
+    geometry: shapely.Geometry, count: int, rng: np.random.Generator
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    # Rejection sampled from the bounding box, every round draws enough candidates for the share that landed inside.
+    min_x, min_y, max_x, max_y = geometry.bounds
+    longitude, latitude = np.empty(0), np.empty(0)
+    while longitude.shape[0] < count:
+        x = rng.uniform(min_x, max_x, 2 * count)
+        y = rng.uniform(min_y, max_y, 2 * count)
+        inside = shapely.contains_xy(geometry, x, y)
+        longitude, latitude = np.concatenate([longitude, x[inside]]), np.concatenate([latitude, y[inside]])
+
+    return latitude[:count], longitude[:count]
+
+
+def victims(profile: Profile, rows: int, rng: np.random.Generator) -> dict[str, npt.NDArray[np.int64]]:
+    columns = {}
+    for victim, shares in VICTIM_SHARES.items():
+        persons = rng.poisson(profile.means[victim], rows)
+        split = rng.multinomial(persons, list(shares.values()))
+        columns[f"number_of_persons_{victim}"] = persons
+        columns.update({f"number_of_{kind}_{victim}": split[:, i] for i, kind in enumerate(shares)})
+
+    return columns
+
+
+def pick(options: list[str], rows: int, rng: np.random.Generator) -> pl.Series:
+    return pl.Series(options).gather(rng.integers(0, len(options), rows))
+
+
+def vehicles(rows: int, rng: np.random.Generator) -> dict[str, pl.Series]:
+    involved = rng.random(rows)
+    columns = {}
+    for i, share in enumerate(VEHICLE_SHARES, start=1):
+        absent = np.flatnonzero(involved >= share)
+        columns[f"contributing_factor_vehicle_{i}"] = pick(FACTORS, rows, rng=rng).scatter(absent, None)
+        columns[f"vehicle_type_code_{i}"] = pick(VEHICLES, rows, rng=rng).scatter(absent, None)
+
+    return columns
+
+
+def generate_batch(profile: Profile, rows: int, first_id: int, rng: np.random.Generator) -> pl.DataFrame:
+    # Columns and types of the raw export, so every generated batch goes through the same ingestion as the real one.
+    dates = rng.choice(profile.dates, size=rows, p=profile.date_weights)
+    hours = rng.choice(profile.hours, size=rows, p=profile.hour_weights)
+    located = rng.choice(profile.boroughs, size=rows, p=profile.borough_weights)
+
+    latitude, longitude = np.empty(rows), np.empty(rows)
+    for borough in BOROUGHS:
+        at = np.flatnonzero(located == borough)
+        latitude[at], longitude[at] = sample_points(profile.geometries[borough], at.shape[0], rng)
+    zip_codes = np.zeros(rows, dtype=np.int64)
+    for borough, (low, high) in ZIP_CODES.items():
+        at = located == borough
+        zip_codes[at] = rng.integers(low, high + 1, at.sum())
+
+    draw = rng.random(rows)
+    unmarked = pl.Series(draw < profile.unmarked)
+    # Placeholder coordinates at (0, 0), the invalid markings ingestion sets apart.
+    placeholder = draw < profile.unmarked + profile.invalid
+    latitude[placeholder], longitude[placeholder] = 0, 0
+    unreported = pl.Series(rng.random(rows) < profile.missing_borough)
+
+    data = pl.DataFrame(
+        {
+            "crash_date": dates,
+            "crash_time": hours,
+            "borough": located,
+            "zip_code": zip_codes,
+            "latitude": latitude,
+            "longitude": longitude,
+            "on_street_name": pick(STREETS, rows, rng=rng),
+            "cross_street_name": pick(STREETS, rows, rng=rng),
+            "off_street_name": pl.Series([None] * rows, dtype=pl.String),
+            **victims(profile, rows=rows, rng=rng),
+            "collision_id": np.arange(first_id, first_id + rows),
+            **vehicles(rows, rng=rng),
+        }
+    )
+    minutes = pl.Series(rng.integers(0, 60, rows)).cast(pl.String).str.zfill(2)
+
+    return (
+        data.with_columns(
+            pl.col("crash_date").dt.strftime("%m/%d/%Y"),
+            pl.format("{}:{}", "crash_time", pl.lit(minutes)).alias("crash_time"),
+            pl.when(~unreported).then(pl.col("borough", "zip_code")),
+            pl.when(~unmarked).then(pl.col("latitude", "longitude")),
+        )
+        .with_columns(pl.format("({}, {})", "latitude", "longitude").alias("location"))
+        .select(RAW_COLUMNS)
+    )
+
+
+def generate(
+    output: str | Path = SYNTHETIC_PATH, scale: float = 1, directory: str | Path = "data", seed: int = 0
+) -> int:
+    # scale is relative to the number of crashes in the committed data, batches are written as they are generated.
+    profile = Profile(directory)
+    rng = np.random.default_rng(seed)
+    rows = round(profile.rows * scale)
+
+    partial = f"{output}.partial"
+    writer = None
+    for first in range(0, rows, BATCH_ROWS):
+        table = generate_batch(profile, rows=min(BATCH_ROWS, rows - first), first_id=first + 1, rng=rng).to_arrow()
+        if writer is None:
+            writer = pq.ParquetWriter(partial, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+        os.replace(partial, output)
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw crash export shaped like the real one.")
+    parser.add_argument("--output", default=SYNTHETIC_PATH, help="Parquet file to write")
+    parser.add_argument("--scale", type=float, default=1, help="Rows relative to the committed data e.g. 1, 10, 100")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = generate(output=args.output, scale=args.scale, seed=args.seed)
+    print(f"{rows:,} crashes written to {args.output}")
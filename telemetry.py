@@ -0,0 +1,174 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any
+
+# Every rerun of a page and the spans timed inside it are written as JSON lines to a log rotated at LOG_BYTES, keeping
+# LOG_BACKUPS older files. Spans outside a rerun, from the build, the API or the warm-up, are not recorded.
+ENABLED = os.environ.get("TELEMETRY", "1") != "0"
+LOG_PATH = os.environ.get("TELEMETRY_LOG", "logs/telemetry.jsonl")
+LOG_BYTES = 16 << 20
+LOG_BACKUPS = 4
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Reruns in progress by session, so a rerun whose script thread exited on an exception or st.stop is still found and
+# written by the next rerun of its session. Reruns of sessions closed meanwhile are written after STALE_SECONDS.
+active: dict[str, dict[str, Any]] = {}
+active_lock = threading.Lock()
+STALE_SECONDS = 3600
+reruns = itertools.count()
+logger = logging.getLogger("telemetry")
+logger.propagate = False
+setup_lock = threading.Lock()
+
+
+def session_id() -> str | None:
+    from streamlit.runtime.scriptrunner_utils.script_run_context import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    return ctx.session_id if ctx is not None else None
+
+
+def rss_bytes() -> int | None:
+    # Resident memory of the whole process, read from /proc where there is one. Sessions share the process, so a
+    # delta can include what other sessions allocated meanwhile.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+def write(record: dict[str, Any]) -> None:
+    # The log is only opened by the first rerun, so modules importing this one never create it.
+    if not logger.handlers:
+        with setup_lock:
+            if not logger.handlers:
+                Path(LOG_PATH).parent.mkdir(parents=True, exist_ok=True)
+                handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+    logger.info(json.dumps(record, default=str))
+
+
+def count_payload(enqueue: Any, session: str) -> Any:
+    # Streamlit has no public hook on the messages a session sends to the browser. Every element goes through the
+    # public ScriptRunContext.enqueue, so that method is wrapped on the context and every message is counted against
+    # the rerun of the session and the spans open while it was sent.
+    def counted(msg: Any) -> None:
+        rerun = active.get(session)
+        if rerun is not None:
+            size = msg.ByteSize()
+            rerun["bytes_sent"] += size
+            for record in rerun["open"]:
+                record["bytes_sent"] += size
+        enqueue(msg)
+
+    counted.counting = True  # type: ignore [attr-defined]
+
+    return counted
+
+
+def begin_rerun(page: str) -> None:
+    # Called at the top of every page. A rerun the page never finished, because it raised, stopped or was interrupted
+    # by a newer one, is written as incomplete.
+    if not ENABLED:
+        return
+
+    from streamlit.runtime.scriptrunner_utils.script_run_context import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return
+    end_rerun(complete=False)
+    if not getattr(ctx.enqueue, "counting", False):
+        ctx.enqueue = count_payload(ctx.enqueue, ctx.session_id)  # type: ignore [method-assign]
+    now = time.perf_counter()
+    rerun = {
+        "type": "rerun",
+        "rerun": f"{os.getpid()}-{next(reruns)}",
+        "page": page,
+        "session": ctx.session_id,
+        "time": time.time(),
+        "seconds": now,
+        "ended": None,
+        "bytes_sent": 0,
+        "spans": 0,
+        "complete": True,
+        "open": [],
+    }
+    with active_lock:
+        stale = [
+            active.pop(session)
+            for session, other in list(active.items())
+            if now - (other["ended"] or other["seconds"]) > STALE_SECONDS
+        ]
+        active[ctx.session_id] = rerun
+    for other in stale:
+        finish(other, complete=False)
+
+
+def end_rerun(complete: bool = True) -> None:
+    # Called at the bottom of every page.
+    session = session_id()
+    if session is None:
+        return
+    with active_lock:
+        rerun = active.pop(session, None)
+    if rerun is not None:
+        finish(rerun, complete)
+
+
+def finish(rerun: dict[str, Any], complete: bool) -> None:
+    # An incomplete rerun is only ended by a later one, so it is timed up to the end of its last span instead.
+    # A span still open in a thread the rerun outlived finishes against the record, so the record written is a copy.
+    record = {key: value for key, value in rerun.items() if key not in ("ended", "open")}
+    ended = rerun["ended"]
+    record["seconds"] = (time.perf_counter() if complete or ended is None else ended) - rerun["seconds"]
+    record["complete"] = complete
+    write(record)
+
+
+@contextmanager
+def span(name: str, kind: str) -> Iterator[dict[str, Any]]:
+    # Times a stage of the current rerun with its memory delta and the bytes sent to the browser while it ran. The
+    # record is yielded so the caller can annotate it, with a cache hit or miss for instance.
+    # Processes without a rerun in progress, the build and the API, never look up a session.
+    session = session_id() if active else None
+    rerun = active.get(session) if session is not None else None
+    if rerun is None:
+        yield {}
+        return
+
+    rss = rss_bytes()
+    record: dict[str, Any] = {
+        "type": "span",
+        "rerun": rerun["rerun"],
+        "page": rerun["page"],
+        "name": name,
+        "kind": kind,
+        "time": time.time(),
+        "bytes_sent": 0,
+        "cache": None,
+    }
+    rerun["open"].append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        after = rss_bytes()
+        record["rss_delta"] = after - rss if after is not None and rss is not None else None
+        rerun["open"].remove(record)
+        rerun["ended"] = time.perf_counter()
+        rerun["spans"] += 1
+        write(record)
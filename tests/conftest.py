@@ -0,0 +1,56 @@
+from datetime import date, time, timedelta
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pytest
+
+from common import BOROUGHS, CUBOIDS, MEASURES, persist_data_bitmask
+from dataset import scan_dataset, write_dataset
+
+ROWS = 400
+
+
+def make_crashes(rows: int = ROWS, seed: int = 0, first_id: int = 0) -> pl.DataFrame:
+    # Crashes over three years with a few unknown boroughs and unknown victim counts, like the processed dataset.
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 3 * 365, rows)
+    injured = rng.integers(0, 4, rows)
+    killed = rng.choice([0, 0, 0, 0, 1, 2], rows)
+    pedestrians = rng.integers(0, 2, rows)
+
+    return (
+        pl.DataFrame(
+            {
+                "collision_id": np.arange(first_id, first_id + rows),
+                "date": [date(2019, 1, 1) + timedelta(days=int(day)) for day in days],
+                "time": [time(int(hour)) for hour in rng.integers(0, 24, rows)],
+                "borough": [[*BOROUGHS, None][code] for code in rng.choice(6, rows, p=[0.18] * 5 + [0.1])],
+                "number_of_persons_injured": pl.Series(injured, dtype=pl.Int64).scatter(
+                    rng.choice(rows, rows // 20, replace=False), None
+                ),
+                "number_of_persons_killed": killed,
+                "number_of_pedestrians_injured": pedestrians,
+                "number_of_pedestrians_killed": np.zeros(rows, dtype=np.int64),
+            }
+        )
+        .with_columns(
+            pl.col("date").dt.year().alias("year"),
+            pl.col("date").dt.month().alias("month"),
+            pl.col("date").dt.weekday().alias("weekday"),
+            pl.col("time").dt.hour().alias("hour"),
+        )
+        .with_columns(
+            pl.sum_horizontal("number_of_persons_injured", "number_of_persons_killed").alias("number_of_casualty")
+        )
+    )
+
+
+@pytest.fixture
+def data_directory(tmp_path: Path) -> Path:
+    # A data directory holding a processed dataset and the cuboids built from it.
+    write_dataset(make_crashes().lazy(), tmp_path / "processed")
+    for by in CUBOIDS:
+        persist_data_bitmask(scan_dataset(tmp_path / "processed"), by=by, on=MEASURES, directory=tmp_path)
+
+    return tmp_path
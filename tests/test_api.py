@@ -0,0 +1,115 @@
+import asyncio
+import io
+import json
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+import api
+from api import ARROW, JSON, app
+from cache import CACHE
+
+Response = tuple[int, dict[bytes, bytes], bytes]
+
+
+@pytest.fixture(autouse=True)
+def artifacts(monkeypatch: pytest.MonkeyPatch) -> None:
+    # The routes read the committed cuboids and per unit table under data/.
+    monkeypatch.chdir(Path(__file__).parent.parent)
+    CACHE.clear()
+
+
+def call(path: str, query: str = "", headers: list[tuple[bytes, bytes]] | None = None, method: str = "GET") -> Response:
+    sent = []
+
+    async def receive() -> dict:
+        return {"type": "http.request"}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(), "headers": headers or []}
+    asyncio.run(app(scope, receive, send))
+
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+
+@pytest.mark.parametrize(
+    ("path", "query"),
+    [
+        ("/totals", "colour=red"),
+        ("/totals", "by=colour"),
+        ("/totals", "year=abc"),
+        ("/totals", "start=yesterday"),
+        ("/totals", "by=borough&format=xml"),
+        ("/totals", "measures=foo"),
+        ("/totals", "by=borough&measures=number_of_persons_killed,number_of_nothing"),
+        ("/risk", "year=2020"),
+        ("/risk", "format=xml"),
+    ],
+)
+def test_invalid_parameters(path: str, query: str) -> None:
+    status, headers, body = call(path, query)
+
+    assert status == 400
+    assert headers[b"content-type"] == JSON.encode()
+    assert "error" in json.loads(body)
+
+
+@pytest.mark.parametrize(("path", "query"), [("/totals", "by=borough"), ("/risk", "borough=BRONX")])
+def test_not_modified(path: str, query: str) -> None:
+    status, headers, body = call(path, query)
+    assert status == 200
+    etag = headers[b"etag"]
+
+    status, headers, body = call(path, query, [(b"if-none-match", etag)])
+
+    assert status == 304
+    assert headers[b"etag"] == etag
+    assert body == b""
+
+
+def test_arrow_answer() -> None:
+    _, json_headers, json_body = call("/totals", "by=borough")
+
+    status, headers, body = call("/totals", "by=borough", [(b"accept", ARROW.encode())])
+
+    assert status == 200
+    assert headers[b"content-type"] == ARROW.encode()
+    assert headers[b"etag"] != json_headers[b"etag"]
+    assert pl.read_ipc_stream(io.BytesIO(body)).height == len(json.loads(json_body))
+
+
+@pytest.mark.parametrize(("path", "query"), [("/totals", "by=year&borough=brooklyn"), ("/risk", "")])
+def test_head(path: str, query: str) -> None:
+    _, get_headers, get_body = call(path, query)
+
+    status, headers, body = call(path, query, method="HEAD")
+
+    assert status == 200
+    assert body == b""
+    assert headers[b"content-length"] == str(len(get_body)).encode() == get_headers[b"content-length"]
+    assert headers[b"etag"] == get_headers[b"etag"]
+
+
+def test_unknown_route_and_method() -> None:
+    assert call("/nope")[0] == 404
+    assert call("/totals", method="POST")[0] == 405
+
+
+@pytest.mark.parametrize(("path", "query"), [("/totals", "by=weekday,hour"), ("/totals", "by=hour&date=2020-01-01")])
+def test_without_processed_data(path: str, query: str) -> None:
+    # The committed tree has the cuboids but not the processed dataset groupings no cuboid covers are read from.
+    assert not Path("data/processed").exists()
+
+    status, headers, body = call(path, query)
+
+    assert status == 503
+    assert "error" in json.loads(body)
+
+
+def test_without_risk_data(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(api, "PER_UNIT_PATH", str(tmp_path / "per_unit.parquet"))
+
+    assert call("/risk")[0] == 503
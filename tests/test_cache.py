@@ -0,0 +1,46 @@
+import polars as pl
+import pytest
+
+from cache import CACHE, cached, canonical
+
+BOROUGHS = pl.DataFrame({"borough": ["BRONX", "QUEENS", "QUEENS"], "crashes": [1, 2, 3]})
+
+
+@pytest.fixture(autouse=True)
+def empty_cache() -> None:
+    CACHE.clear()
+
+
+@cached()
+def load_filtered(filters: list[pl.Expr]) -> pl.DataFrame:
+    return BOROUGHS.filter(*filters)
+
+
+def test_is_in_filters_have_their_own_entries() -> None:
+    bronx = load_filtered([pl.col("borough").is_in(["BRONX"])])
+    queens = load_filtered([pl.col("borough").is_in(["QUEENS"])])
+
+    assert bronx["crashes"].to_list() == [1]
+    assert queens["crashes"].to_list() == [2, 3]
+    assert CACHE.stats()["misses"] == 2
+
+    load_filtered([pl.col("borough").is_in(["QUEENS"])])
+    assert CACHE.stats()["hits"] == 1
+
+
+def test_expression_keys() -> None:
+    assert canonical(pl.col("year") == 2020) == canonical(pl.col("year") == 2020)
+    assert canonical(pl.col("year") == 2020) != canonical(pl.col("year") == 2021)
+    assert canonical(pl.col("borough").is_in(["BRONX"])) != canonical(pl.col("borough").is_in(["QUEENS"]))
+
+
+def test_unordered_arguments() -> None:
+    @cached(unordered=["boroughs"])
+    def load_boroughs(boroughs: list[str]) -> pl.DataFrame:
+        return BOROUGHS.filter(pl.col("borough").is_in(boroughs))
+
+    load_boroughs(["QUEENS", "BRONX"])
+    load_boroughs(["BRONX", "QUEENS"])
+
+    assert CACHE.stats()["misses"] == 1
+    assert CACHE.stats()["hits"] == 1
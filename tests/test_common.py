@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from common import CUBOIDS, MEASURES, crash_count, form_filename, key_subsets, persist_data_bitmask
+from conftest import make_crashes
+
+
+@pytest.fixture
+def crashes() -> pl.DataFrame:
+    return make_crashes()
+
+
+@pytest.mark.parametrize("by", CUBOIDS)
+def test_rollups_match_group_by(crashes: pl.DataFrame, tmp_path: Path, by: list[str]) -> None:
+    # Every cuboid is rolled up from its smallest parent rather than grouped from the crashes, and must not differ.
+    persist_data_bitmask(crashes.lazy(), by=by, on=MEASURES, directory=tmp_path)
+
+    for keys in key_subsets(by):
+        cuboid = pl.read_parquet(form_filename(keys, on=MEASURES, directory=tmp_path))
+        expected = (
+            crashes.drop_nulls(keys)
+            .group_by(keys)
+            .agg(pl.col(MEASURES).sum(), crash_count(MEASURES))
+            .sort(by=keys)
+            .select(cuboid.columns)
+        )
+        assert cuboid.equals(expected.select(pl.col(name).cast(dtype) for name, dtype in cuboid.schema.items())), keys
+        assert cuboid.schema["number_of_crash"] == pl.UInt32
+
+
+def test_crashes_without_injured_count_are_not_counted(tmp_path: Path) -> None:
+    crashes = pl.DataFrame(
+        {
+            "borough": ["BRONX", "BRONX", "QUEENS"],
+            "hour": [1, 1, 2],
+            "number_of_persons_injured": [1, None, 2],
+            "number_of_persons_killed": [0, 1, 0],
+            "number_of_casualty": [1, 1, 2],
+        }
+    )
+    persist_data_bitmask(crashes, by=["borough", "hour"], on=MEASURES, directory=tmp_path)
+
+    borough = pl.read_parquet(form_filename(["borough"], on=MEASURES, directory=tmp_path))
+    assert borough.rows() == [("BRONX", 1, 1, 2, 1), ("QUEENS", 2, 0, 2, 1)]
@@ -0,0 +1,75 @@
+from collections.abc import Callable
+from datetime import date, time
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+import storage
+from dataset import scan_dataset, scan_filtered, write_dataset
+from export import ExportFormat, sink
+
+READERS: dict[ExportFormat, Callable[[Path], pl.DataFrame]] = {
+    ExportFormat.CSV: pl.read_csv,
+    ExportFormat.PARQUET: pl.read_parquet,
+    ExportFormat.ARROW: pl.read_ipc,
+}
+
+
+@pytest.fixture
+def dataset(tmp_path: Path) -> Path:
+    crashes = pl.DataFrame(
+        {
+            "collision_id": range(8),
+            "year": [2015, 2015, 2015, 2016, 2016, 2016, None, 2016],
+            "borough": ["BRONX", "QUEENS", None, "BRONX", "BROOKLYN", "QUEENS", None, "BRONX"],
+            "date": [date(2015, 1, day) for day in range(1, 4)]
+            + [date(2016, 1, day) for day in range(1, 4)]
+            + [None, date(2016, 1, 5)],
+            "time": [time(hour) for hour in range(8)],
+            "number_of_persons_injured": [0, 1, 2, 0, 1, 2, 3, 4],
+        }
+    )
+    write_dataset(crashes.lazy(), tmp_path / "processed")
+
+    return tmp_path / "processed"
+
+
+@pytest.mark.parametrize("backend", ["parquet", "ipc"])
+@pytest.mark.parametrize("export_format", list(ExportFormat))
+def test_filtered_export_sinks(
+    dataset: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, backend: str, export_format: ExportFormat
+) -> None:
+    monkeypatch.setattr(storage, "BACKEND", backend)
+    if backend == "ipc":
+        storage.convert(dataset)
+    filters = [
+        pl.col("borough").is_in(["BRONX", "QUEENS"]),
+        pl.col("date").is_between(date(2015, 1, 2), date(2016, 1, 5)),
+    ]
+
+    path = tmp_path / f"export{export_format.value}"
+    sink(scan_filtered(dataset, filters, ipc=False), path, export_format=export_format)
+
+    expected = scan_dataset(dataset).filter(*filters).collect().sort("collision_id")
+    exported = READERS[export_format](path).sort("collision_id")
+    assert exported["collision_id"].to_list() == expected["collision_id"].to_list() == [1, 3, 5, 7]
+    assert exported["borough"].to_list() == expected["borough"].to_list()
+
+
+@pytest.mark.parametrize("ipc", [True, False])
+def test_filtered_scan_of_ipc_copies(dataset: Path, monkeypatch: pytest.MonkeyPatch, ipc: bool) -> None:
+    monkeypatch.setattr(storage, "BACKEND", "ipc")
+    storage.convert(dataset)
+    filters = [pl.col("borough").is_in(["BRONX", "QUEENS"]), pl.col("year") == 2016]
+
+    filtered = scan_filtered(dataset, filters, ipc=ipc).collect().sort("collision_id")
+
+    assert filtered["collision_id"].to_list() == [3, 5, 7]
+
+
+def test_filtered_scan_without_matching_partition(dataset: Path) -> None:
+    filtered = scan_filtered(dataset, [pl.col("borough") == "MANHATTAN"])
+
+    assert filtered.collect().shape[0] == 0
+    assert filtered.collect_schema() == scan_dataset(dataset).collect_schema()
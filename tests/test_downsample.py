@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+
+import numpy as np
+import polars as pl
+import pytest
+
+from downsample import downsample, lttb
+
+
+@pytest.fixture
+def series() -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    x = np.arange(5000, dtype=np.float64)
+    y = rng.normal(size=5000)
+    y[1234] = 50
+    y[4321] = -50
+
+    return x, y
+
+
+@pytest.mark.parametrize("threshold", [3, 10, 500, 4999])
+def test_size_and_endpoints(series: tuple[np.ndarray, np.ndarray], threshold: int) -> None:
+    x, y = series
+    indices = lttb(x, y, threshold=threshold)
+
+    assert len(indices) == threshold
+    assert indices[0] == 0
+    assert indices[-1] == len(x) - 1
+    assert (np.diff(indices) > 0).all()
+
+
+def test_keeps_peaks(series: tuple[np.ndarray, np.ndarray]) -> None:
+    x, y = series
+    indices = lttb(x, y, threshold=100)
+
+    assert {1234, 4321} <= set(indices.tolist())
+
+
+@pytest.mark.parametrize("threshold", [2, 5000, 6000])
+def test_nothing_to_drop(series: tuple[np.ndarray, np.ndarray], threshold: int) -> None:
+    x, y = series
+
+    assert (lttb(x, y, threshold=threshold) == np.arange(len(x))).all()
+
+
+def test_every_trace_downsampled() -> None:
+    dates = [date(2012, 7, 1) + timedelta(days=day) for day in range(3000)]
+    data = pl.DataFrame(
+        {
+            "borough": ["BRONX"] * 3000 + ["QUEENS"] * 3000,
+            "date": dates * 2,
+            "number_of_crash": list(range(3000)) + [None] * 10 + list(range(2990)),
+        }
+    ).sample(fraction=1, shuffle=True, seed=0)
+
+    reduced = downsample(data, x="date", y="number_of_crash", threshold=200)
+
+    counts = reduced.group_by("borough").agg(
+        pl.len(), pl.col("date").min().alias("first"), pl.col("date").max().alias("last")
+    )
+    assert counts.sort("borough").rows() == [("BRONX", 200, dates[0], dates[-1]), ("QUEENS", 200, dates[0], dates[-1])]
+    assert reduced.filter(pl.col("borough") == "BRONX")["date"].is_sorted()
+
+
+def test_short_data_unchanged() -> None:
+    data = pl.DataFrame({"borough": ["BRONX"] * 10, "date": range(10), "number_of_crash": range(10)})
+
+    assert downsample(data, x="date", y="number_of_crash", threshold=20).equals(data)
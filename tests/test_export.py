@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+import export
+from export import ExportFormat, export_file
+
+
+@pytest.fixture
+def exports(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(export, "EXPORT_DIRECTORY", tmp_path / "exports")
+
+    return tmp_path / "exports"
+
+
+def crashes(year: int) -> pl.LazyFrame:
+    return pl.LazyFrame({"year": [year] * 1000, "crashes": range(1000)}).filter(pl.col("year") == year)
+
+
+def test_export_written_once(exports: Path) -> None:
+    path = export_file(crashes(2020), export_format=ExportFormat.PARQUET)
+    os.utime(path, ns=(0, 0))
+
+    assert export_file(crashes(2020), export_format=ExportFormat.PARQUET) == path
+    assert path.stat().st_mtime_ns > 0
+    assert pl.read_parquet(path)["crashes"].to_list() == list(range(1000))
+    assert [file.name for file in exports.iterdir()] == [path.name]
+
+
+def test_least_recently_asked_for_evicted(exports: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    first = export_file(crashes(2019), export_format=ExportFormat.CSV)
+    second = export_file(crashes(2020), export_format=ExportFormat.CSV)
+    os.utime(first, ns=(1, 1))
+    os.utime(second, ns=(2, 2))
+    partial = exports / "other.csv.0123.partial"
+    partial.write_bytes(b"x" * (first.stat().st_size * 4))
+    os.utime(partial, ns=(0, 0))
+    monkeypatch.setattr(export, "EXPORT_BUDGET_BYTES", first.stat().st_size + second.stat().st_size)
+
+    # Asking for the first again makes the second the least recently asked for.
+    export_file(crashes(2019), export_format=ExportFormat.CSV)
+    third = export_file(crashes(2021), export_format=ExportFormat.CSV)
+
+    assert first.exists()
+    assert not second.exists()
+    assert third.exists()
+    assert partial.exists()
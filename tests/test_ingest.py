@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from dataset import scan_dataset
+from ingest import append, ingest
+from synthetic import Profile, generate_batch
+
+BASE_ROWS = 3000
+DELTA_ROWS = 300
+# The delta corrects the last OVERLAP crashes of the base, moving them to other days and boroughs, and adds new ones.
+OVERLAP = 100
+
+
+@pytest.fixture(scope="module")
+def builds(tmp_path_factory: pytest.TempPathFactory) -> tuple[Path, Path]:
+    # Raw batches are drawn from the committed data, and borough boundaries are read from it too.
+    root = tmp_path_factory.mktemp("ingest")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(Path(__file__).parent.parent)
+        profile = Profile("data")
+        rng = np.random.default_rng(0)
+        base = generate_batch(profile, rows=BASE_ROWS, first_id=1, rng=rng)
+        delta = generate_batch(profile, rows=DELTA_ROWS, first_id=BASE_ROWS - OVERLAP + 1, rng=rng)
+        combined = pl.concat([base.filter(~pl.col("collision_id").is_in(delta["collision_id"])), delta])
+        for name, raw in [("base", base), ("delta", delta), ("combined", combined)]:
+            raw.write_parquet(root / f"{name}.parquet")
+
+        ingest(str(root / "base.parquet"), output=str(root / "appended"))
+        append(str(root / "delta.parquet"), output=str(root / "appended"))
+        ingest(str(root / "combined.parquet"), output=str(root / "fresh"))
+
+    return root / "appended", root / "fresh"
+
+
+def outputs(directory: Path) -> set[Path]:
+    return {path.relative_to(directory) for path in directory.glob("*") if path.is_file()}
+
+
+def test_same_outputs(builds: tuple[Path, Path]) -> None:
+    appended, fresh = builds
+
+    assert outputs(appended) == outputs(fresh)
+
+
+@pytest.mark.parametrize("dataset", ["processed", "clean_map"])
+def test_datasets_match_rebuild(builds: tuple[Path, Path], dataset: str) -> None:
+    appended, fresh = builds
+
+    rows = scan_dataset(appended / dataset).collect().sort("collision_id")
+    assert_frame_equal(rows, scan_dataset(fresh / dataset).collect().sort("collision_id"))
+    assert rows["collision_id"].n_unique() == rows.height
+
+
+def test_tables_match_rebuild(builds: tuple[Path, Path]) -> None:
+    # Cuboids merged from signed deltas, metrics, cumulative counts, rolling series and hexbins.
+    appended, fresh = builds
+
+    differing = []
+    for name in sorted(path for path in outputs(fresh) if path.suffix == ".parquet"):
+        table = pl.read_parquet(appended / name)
+        expected = pl.read_parquet(fresh / name).select(table.columns)
+        if not table.sort(pl.all()).equals(expected.sort(pl.all())):
+            differing.append(str(name))
+
+    assert differing == []
+
+
+def test_metrics_match_rebuild(builds: tuple[Path, Path]) -> None:
+    appended, fresh = builds
+
+    for name in ["metrics.json", "summary.json"]:
+        with open(appended / name) as f, open(fresh / name) as g:
+            assert json.load(f) == json.load(g), name
+    assert not list(appended.glob("*.partial"))
@@ -0,0 +1,117 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from common import MEASURES, crash_count
+from dataset import scan_dataset
+from query import AGGREGATE_DIRECTORY, COUNT, HOT_QUERIES, query, smallest_cuboid
+
+
+def expected(directory: Path, dimensions: list[str], filters: list[pl.Expr] = []) -> pl.DataFrame:
+    data = scan_dataset(directory / "processed").filter(*filters) if filters else scan_dataset(directory / "processed")
+    aggregations = [pl.col(MEASURES).sum(), crash_count(MEASURES)]
+    if not dimensions:
+        return data.select(aggregations).collect()
+
+    return data.drop_nulls(dimensions).group_by(dimensions).agg(aggregations).sort(by=dimensions).collect()
+
+
+def assert_same(result: pl.DataFrame, answer: pl.DataFrame) -> None:
+    assert_frame_equal(result, answer.select(result.columns), check_dtypes=False)
+
+
+@pytest.mark.parametrize(
+    ("dimensions", "filters"),
+    [
+        (["hour"], [pl.col("number_of_persons_killed") > 0]),
+        ([], [pl.col("number_of_pedestrians_injured") + pl.col("number_of_pedestrians_killed") > 0]),
+        (["borough"], [pl.col("number_of_persons_killed") > 0, pl.col("year") == 2020]),
+    ],
+)
+def test_victim_count_filter(data_directory: Path, dimensions: list[str], filters: list[pl.Expr]) -> None:
+    result = query(dimensions, filters=filters, directory=str(data_directory))
+
+    assert_same(result, expected(data_directory, dimensions, filters))
+    # Crashes selected by a victim count are no grouping, so nothing is materialized for them.
+    assert not list((data_directory / AGGREGATE_DIRECTORY).glob("*.parquet"))
+
+
+@pytest.mark.parametrize(
+    "dimensions", [["weekday"], ["date"], ["borough", "weekday"], ["year", "month"], ["borough", "hour"]]
+)
+def test_grouping(data_directory: Path, dimensions: list[str]) -> None:
+    result = query(dimensions, directory=str(data_directory))
+
+    assert_same(result, expected(data_directory, dimensions))
+
+
+@pytest.mark.parametrize(
+    ("needed", "keys"),
+    [
+        ({"borough"}, {"borough"}),
+        ({"year"}, {"year"}),
+        ({"hour", "month"}, {"hour", "month"}),
+        ({"weekday"}, {"date"}),
+        ({"borough", "weekday"}, {"borough", "date"}),
+        ({"year", "month", "hour"}, {"hour", "month", "year"}),
+    ],
+)
+def test_smallest_cuboid(data_directory: Path, needed: set[str], keys: set[str]) -> None:
+    found = smallest_cuboid(needed, measures=MEASURES + [COUNT], directory=str(data_directory))
+
+    assert found is not None
+    assert found[0] == keys
+    assert Path(found[1]).name == f"{'__'.join(sorted(keys))}.parquet"
+
+
+@pytest.mark.parametrize(
+    ("needed", "measures"),
+    [
+        ({"weekday", "hour"}, [COUNT]),
+        ({"borough", "number_of_persons_killed"}, [COUNT]),
+        ({"borough"}, ["number_of_pedestrians_injured"]),
+    ],
+)
+def test_no_cuboid_covers(data_directory: Path, needed: set[str], measures: list[str]) -> None:
+    assert smallest_cuboid(needed, measures=measures, directory=str(data_directory)) is None
+
+
+def test_never_rolled_up_over_borough(data_directory: Path) -> None:
+    # Crashes without a borough are missing from every cuboid keyed on it.
+    for path in data_directory.glob("*.parquet"):
+        if "borough" not in path.stem:
+            path.unlink()
+
+    assert smallest_cuboid({"hour"}, measures=[COUNT], directory=str(data_directory)) is None
+    assert_same(query(["hour"], directory=str(data_directory)), expected(data_directory, ["hour"]))
+
+
+def test_grouping_on_victim_count(data_directory: Path) -> None:
+    with pytest.raises(ValueError, match="Can not group by"):
+        query(["number_of_persons_killed"], directory=str(data_directory))
+
+
+def test_materialized_aggregate(data_directory: Path) -> None:
+    filters = [pl.col("hour") < 12]
+    answers = [query(["weekday"], filters=filters, directory=str(data_directory)) for _ in range(HOT_QUERIES + 1)]
+
+    assert (data_directory / AGGREGATE_DIRECTORY / "hour__weekday.parquet").exists()
+    for answer in answers:
+        assert_same(answer, expected(data_directory, ["weekday"], filters))
+
+
+def test_aggregate_counts_match_cuboids(data_directory: Path) -> None:
+    # borough and year is both a cuboid and, once asked for often enough, an aggregate when the cuboid is gone.
+    from_cuboid = query(["borough", "year"], directory=str(data_directory))
+    assert smallest_cuboid({"borough", "year"}, measures=[COUNT], directory=str(data_directory)) is not None
+
+    for path in data_directory.glob("*.parquet"):
+        path.unlink()
+    for _ in range(HOT_QUERIES):
+        from_aggregate = query(["borough", "year"], directory=str(data_directory))
+
+    found = smallest_cuboid({"borough", "year"}, measures=[COUNT], directory=str(data_directory))
+    assert found is not None and AGGREGATE_DIRECTORY in found[1]
+    assert_frame_equal(from_cuboid, from_aggregate, check_dtypes=False)
@@ -0,0 +1,90 @@
+import shutil
+from datetime import date
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from common import CUBOIDS, MEASURES, crash_count, persist_data_bitmask
+from conftest import make_crashes
+from dataset import scan_dataset, write_dataset
+from query import COUNT
+from rolling import SERIES_MEASURES, SeriesType, build_rolling, load_series, series_column, update_rolling
+
+
+def build(directory: Path, crashes: pl.DataFrame) -> Path:
+    write_dataset(crashes.lazy(), directory / "processed")
+    for by in CUBOIDS:
+        persist_data_bitmask(scan_dataset(directory / "processed"), by=by, on=MEASURES, directory=directory)
+    build_rolling(path=directory / "rolling.parquet", directory=str(directory))
+
+    return directory / "rolling.parquet"
+
+
+@pytest.fixture
+def rolling(data_directory: Path) -> pl.DataFrame:
+    build_rolling(path=data_directory / "rolling.parquet", directory=str(data_directory))
+
+    return pl.read_parquet(data_directory / "rolling.parquet")
+
+
+def daily(data_directory: Path, series: pl.DataFrame, borough: str) -> list[int]:
+    crashes = scan_dataset(data_directory / "processed").filter(pl.col("borough") == borough)
+    counts = crashes.group_by("date").agg(crash_count(MEASURES)).collect()
+
+    return series.select("date").join(counts, on="date", how="left")[COUNT].fill_null(0).to_list()
+
+
+def test_every_calendar_day(rolling: pl.DataFrame) -> None:
+    days = rolling.group_by("borough").agg(pl.len(), pl.col("date").n_unique().alias("dates"), pl.col("date").min())
+
+    assert days["len"].n_unique() == 1
+    assert (days["len"] == days["dates"]).all()
+    assert rolling.select(pl.col(SERIES_MEASURES).is_null().any()).row(0) == (False,) * len(SERIES_MEASURES)
+
+
+def test_windows(data_directory: Path, rolling: pl.DataFrame) -> None:
+    series = rolling.filter(pl.col("borough") == "QUEENS").sort("date")
+    counts = daily(data_directory, series, "QUEENS")
+    assert series[COUNT].to_list() == counts
+
+    day = len(counts) - 1
+    assert series[series_column(COUNT, SeriesType.SUM_7)][day] == sum(counts[day - 6 : day + 1])
+    assert series[series_column(COUNT, SeriesType.MEAN_30)][day] == pytest.approx(sum(counts[day - 29 : day + 1]) / 30)
+    assert series[series_column(COUNT, SeriesType.CUMULATIVE)][day] == sum(counts[: day + 1])
+    assert series[series_column(COUNT, SeriesType.SUM_90)][:89].null_count() == 89
+
+
+def test_year_over_year(data_directory: Path, rolling: pl.DataFrame) -> None:
+    series = rolling.filter(pl.col("borough") == "BRONX").sort("date")
+    counts = series[COUNT].to_list()
+    yoy = series[series_column(COUNT, SeriesType.YEAR_OVER_YEAR)]
+
+    day = len(counts) - 1
+    assert day >= 2 * 365 - 1
+    assert yoy[day] == sum(counts[day - 364 : day + 1]) - sum(counts[day - 729 : day - 364])
+    assert yoy[: 2 * 365 - 1].null_count() == 2 * 365 - 1
+
+
+def test_update_matches_rebuild(tmp_path: Path) -> None:
+    # Late crashes are added after the series were built, only the days from the first of them on are recomputed.
+    crashes = make_crashes()
+    late = make_crashes(rows=100, seed=1, first_id=10_000).filter(pl.col("date") >= date(2021, 6, 1))
+    since = late["date"].min()
+    assert isinstance(since, date)
+    path = build(tmp_path / "before", crashes)
+    rebuilt = build(tmp_path / "after", pl.concat([crashes, late]))
+
+    shutil.copy(path, tmp_path / "updated.parquet")
+    update_rolling(since, path=tmp_path / "updated.parquet", directory=str(tmp_path / "after"))
+
+    updated = pl.read_parquet(tmp_path / "updated.parquet")
+    assert updated.equals(pl.read_parquet(rebuilt))
+    assert not updated.equals(pl.read_parquet(path))
+
+
+def test_load_series(data_directory: Path, rolling: pl.DataFrame) -> None:
+    series = load_series("number_of_persons_killed", SeriesType.MEAN_7, path=data_directory / "rolling.parquet")
+
+    assert series.columns == ["borough", "date", "number_of_persons_killed"]
+    assert series["number_of_persons_killed"].equals(rolling["number_of_persons_killed_mean_7"], check_names=False)
@@ -0,0 +1,85 @@
+import os
+import sys
+import threading
+import time
+from importlib import import_module
+from typing import Any
+
+# Only the standard library is imported here, so pages can start the warm-up before loading anything themselves.
+ENABLED = os.environ.get("WARMUP", "1") != "0"
+STARTED = time.perf_counter()
+
+# Steps of the warm-up as "module:function" targets with their arguments, run in order in one thread. The artifacts
+# the pages read on their first run come first: dataset indexes, the catalog and the cuboid metadata stay in memory,
+# the other reads leave the files in the page cache. The libraries the chart and map branches import follow, the
+# ones the default views draw with first.
+STEPS: list[tuple[str, str, dict[str, Any]]] = [
+    ("catalog", "catalog:read_catalog", {}),
+    ("summary", "summary:load_summary", {}),
+    ("borough cuboid", "query:query", {"dimensions": ["borough"]}),
+    ("daily cuboid", "query:query", {"dimensions": ["borough", "date"]}),
+    ("processed index", "dataset:read_index", {"path": "data/processed"}),
+    ("clean_map index", "dataset:read_index", {"path": "data/clean_map"}),
+    ("rolling", "rolling:load_series", {"measure": "number_of_crash", "series": "7 day sum"}),
+    # The density map opens on the coarsest level over every year.
+    ("hexbin", "hexbin:load_cells", {"level": 0, "start": 0, "end": 9999, "column": "number_of_crash"}),
+    *[
+        (library, "importlib:import_module", {"name": library})
+        for library in ["plotly.express", "folium", "folium.plugins", "streamlit_folium", "altair", "geopandas"]
+    ],
+    ("plotly figure", "warmup:draw_figure", {}),
+    ("boundaries", "importlib:import_module", {"name": "boundaries"}),
+]
+
+timings: dict[str, float] = {}
+lock = threading.Lock()
+thread: threading.Thread | None = None
+
+
+def draw_figure() -> None:
+    # plotly loads its validators and the default template while building its first figure, which takes about as
+    # long as importing plotly.express.
+    import plotly.express as px
+
+    px.bar(x=["warm-up"], y=[0]).to_json()
+
+
+def run_step(name: str, target: str, kwargs: dict[str, Any]) -> None:
+    start = time.perf_counter()
+    module, function = target.split(":")
+    try:
+        getattr(import_module(module), function)(**kwargs)
+    except Exception as error:
+        # A failed step only leaves its work to the first page that needs it.
+        print(f"{'failed':<8} {name:<20} {error}", file=sys.stderr)
+        return
+    timings[name] = time.perf_counter() - start
+
+
+def warm() -> dict[str, float]:
+    for name, target, kwargs in STEPS:
+        run_step(name, target, kwargs)
+    # Counted from the import of this module, which is the first thing the launcher does.
+    timings["total"] = time.perf_counter() - STARTED
+    report()
+
+    return timings
+
+
+def report() -> None:
+    for name, elapsed in timings.items():
+        print(f"{'warmed':<8} {name:<20} {elapsed:8.2f}s")
+
+
+def start() -> None:
+    # Runs once per server process, whichever of the launcher and the pages starts it first.
+    global thread
+    with lock:
+        if thread is not None or not ENABLED:
+            return
+        thread = threading.Thread(target=warm, name="warmup", daemon=True)
+        thread.start()
+
+
+if __name__ == "__main__":
+    warm()